@@ -5,18 +5,23 @@ import threading
 import re
 import uuid
 import random
+import hashlib
+import base64
 import urllib3
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, List, Tuple
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterator
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 import pandas as pd
+from poll_timing import get_poll_timing
 
 # Tắt warnings về SSL certificate
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
 API_URL = "http://62.171.131.164:5000"
+API_AUTH_ENDPOINT = f"{API_URL}/api/make_video_ai/auth"
 GENERATE_URL = "https://aisandbox-pa.googleapis.com/v1/video:batchAsyncGenerateVideoText"
 GENERATE_IMAGE_URL = "https://aisandbox-pa.googleapis.com/v1/video:batchAsyncGenerateVideoStartImage"
 UPSCALE_URL = "https://aisandbox-pa.googleapis.com/v1/video:batchAsyncGenerateVideoUpsampleVideo"
@@ -161,14 +166,14 @@ def add_human_like_delay() -> None:
 		time.sleep(random.uniform(3.0, 8.0))
 
 
-def create_browser_like_session() -> requests.Session:
+def create_browser_like_session(pool_connections: int = 1, pool_maxsize: int = 1) -> requests.Session:
 	"""Tạo session giống browser thật với các cài đặt bổ sung"""
 	session = requests.Session()
 	
 	# Cài đặt adapter với keep-alive
 	adapter = requests.adapters.HTTPAdapter(
-		pool_connections=1,
-		pool_maxsize=1,
+		pool_connections=pool_connections,
+		pool_maxsize=pool_maxsize,
 		max_retries=0,  # Tắt retry tự động của requests
 		pool_block=False
 	)
@@ -181,6 +186,111 @@ def create_browser_like_session() -> requests.Session:
 	return session
 
 
+# Registry session dùng chung: mỗi (account, proxy) giữ một connection pool sống suốt lượt chạy
+# để các lần poll/generate/download tái sử dụng kết nối TCP+TLS thay vì bắt tay lại mỗi request
+SESSION_POOL_CONNECTIONS = 4  # Số host khác nhau (aisandbox-pa, labs.google, storage...)
+SESSION_POOL_MAXSIZE = 16  # Số kết nối song song tối đa tới mỗi host cho một account
+
+_http_sessions: Dict[Tuple[str, str], requests.Session] = {}
+_http_sessions_lock = threading.Lock()
+
+
+def _proxy_key(proxy: Optional[Dict[str, str]]) -> str:
+	"""Chuẩn hóa proxy dict thành key cho registry"""
+	if not proxy:
+		return ""
+	return json.dumps(proxy, sort_keys=True)
+
+
+def resolve_account_key(account_key: Optional[str], credential: Optional[str] = None) -> str:
+	"""Trả về key account; nếu không truyền thì suy ra từ hash của token/cookie"""
+	if account_key:
+		return account_key
+	if credential:
+		return "anon_" + hashlib.sha256(credential.encode("utf-8")).hexdigest()[:16]
+	return "anonymous"
+
+
+def get_http_session(account_key: Optional[str] = None, proxy: Optional[Dict[str, str]] = None) -> requests.Session:
+	"""Lấy session dùng chung theo (account, proxy), tạo mới nếu chưa có"""
+	key = (account_key or "anonymous", _proxy_key(proxy))
+	with _http_sessions_lock:
+		session = _http_sessions.get(key)
+		if session is None:
+			session = create_browser_like_session(
+				pool_connections=SESSION_POOL_CONNECTIONS,
+				pool_maxsize=SESSION_POOL_MAXSIZE
+			)
+			_http_sessions[key] = session
+		return session
+
+
+def close_http_sessions(account_key: Optional[str] = None) -> int:
+	"""Đóng các session dùng chung (của một account hoặc tất cả). Trả về số session đã đóng"""
+	with _http_sessions_lock:
+		keys = [k for k in _http_sessions if account_key is None or k[0] == account_key]
+		sessions = [_http_sessions.pop(k) for k in keys]
+	for session in sessions:
+		try:
+			session.close()
+		except Exception:
+			pass
+	return len(sessions)
+
+
+# Giới hạn tốc độ request theo account (token bucket): request trong hạn mức đi ngay,
+# chỉ chờ khi vượt quá tốc độ cấu hình trong config.json ("rate_limit")
+DEFAULT_RATE_LIMIT_RPS = 2.0
+DEFAULT_RATE_LIMIT_BURST = 5
+
+
+class AccountRateLimiter:
+	"""Token bucket: nạp `rate` token/giây, tối đa `burst` token"""
+	
+	def __init__(self, rate: float = DEFAULT_RATE_LIMIT_RPS, burst: float = DEFAULT_RATE_LIMIT_BURST):
+		self.rate = max(float(rate), 0.001)
+		self.burst = max(float(burst), 1.0)
+		self._tokens = self.burst
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+	
+	def reserve(self, cost: float = 1.0) -> float:
+		"""Đặt chỗ `cost` token, trả về số giây phải chờ trước khi gửi (không sleep)"""
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			# Đặt chỗ trước: token có thể âm, các thread sau tự xếp hàng theo thời gian chờ
+			self._tokens -= cost
+			return -self._tokens / self.rate if self._tokens < 0 else 0.0
+	
+	def acquire(self, cost: float = 1.0) -> float:
+		"""Lấy `cost` token, chờ nếu cần. Trả về số giây đã chờ"""
+		wait = self.reserve(cost)
+		if wait > 0:
+			time.sleep(wait)
+		return wait
+
+
+_rate_limiters: Dict[str, AccountRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(account_key: Optional[str] = None) -> AccountRateLimiter:
+	"""Lấy limiter dùng chung theo account; tốc độ đọc từ config.json"""
+	key = account_key or "anonymous"
+	with _rate_limiters_lock:
+		limiter = _rate_limiters.get(key)
+		if limiter is None:
+			rate_config = _load_config().get("rate_limit", {})
+			limiter = AccountRateLimiter(
+				rate=rate_config.get("requests_per_second", DEFAULT_RATE_LIMIT_RPS),
+				burst=rate_config.get("burst", DEFAULT_RATE_LIMIT_BURST)
+			)
+			_rate_limiters[key] = limiter
+		return limiter
+
+
 def test_request_headers(token: str) -> None:
 	"""Test function để kiểm tra headers được tạo"""
 	print("🔍 Testing request headers...")
@@ -216,115 +326,338 @@ def auto_retry_with_backoff(func, *args, max_retries: int = 3, base_delay: float
 	Raises:
 		Exception cuối cùng nếu hết số lần retry
 	"""
-	last_exception = None
-	
-	for attempt in range(max_retries + 1):  # +1 vì attempt đầu tiên không phải retry
-		try:
-			return func(*args, **kwargs)
-		except retry_on_exceptions as e:
-			last_exception = e
-			
-			if attempt < max_retries:
-				# Tính delay với exponential backoff
-				delay = min(base_delay * (backoff_factor ** attempt), max_delay)
-				# Thêm jitter để tránh thundering herd
-				jitter = random.uniform(0.1, 0.3) * delay
-				final_delay = delay + jitter
-				
-				print(f"🔄 Lỗi lần {attempt + 1}/{max_retries + 1}: {str(e)[:100]}...")
-				print(f"⏳ Thử lại sau {final_delay:.1f} giây...")
-				time.sleep(final_delay)
-			else:
-				print(f"❌ Đã thử {max_retries + 1} lần nhưng vẫn lỗi: {str(e)}")
-				break
-	
-	# Nếu đến đây thì đã hết số lần retry
-	raise last_exception
+	def classify(error: BaseException) -> str:
+		if not isinstance(error, retry_on_exceptions):
+			return ERROR_PERMANENT
+		if isinstance(error, AccountAuthError):
+			return ERROR_AUTH
+		kind = classify_error(error)
+		if kind == ERROR_PERMANENT and not isinstance(error, requests.RequestException):
+			# Lỗi không phải HTTP (JSON hỏng, ValueError...) mà caller đã liệt kê: retry như trước
+			return ERROR_RETRYABLE
+		return kind
+	
+	policy = RetryPolicy(max_retries=max_retries, base_delay=base_delay, max_delay=max_delay, backoff_factor=backoff_factor)
+	return policy.call(lambda attempt: func(*args, **kwargs), classify=classify)
+
+
+# Phân loại lỗi để quyết định có retry hay không
+ERROR_RETRYABLE = "retryable"  # Lỗi mạng, timeout, 5xx: thử lại với backoff
+ERROR_QUOTA = "quota"  # 429: vượt hạn mức, chờ theo Retry-After
+ERROR_AUTH = "auth"  # 401/403: token/cookie hỏng, retry không có tác dụng
+ERROR_PERMANENT = "permanent"  # 4xx khác, dữ liệu sai...: fail ngay
+
+RETRYABLE_STATUS_CODES = (408, 500, 502, 503, 504)
+AUTH_STATUS_CODES = (401, 403)
+DEFAULT_MAX_RETRY_AFTER = 300.0  # Không chờ Retry-After lâu hơn khoảng này
+
+
+def classify_error(error: BaseException) -> str:
+	"""Phân loại lỗi: retryable / quota / auth / permanent"""
+	if isinstance(error, requests.HTTPError):
+		status_code = error.response.status_code if error.response is not None else None
+		if status_code == 429:
+			return ERROR_QUOTA
+		if status_code in AUTH_STATUS_CODES:
+			return ERROR_AUTH
+		if status_code is None or status_code in RETRYABLE_STATUS_CODES:
+			return ERROR_RETRYABLE
+		return ERROR_PERMANENT
+	if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)):
+		return ERROR_RETRYABLE
+	return ERROR_PERMANENT
+
+
+class AccountAuthError(Exception):
+	"""Cookie/token của account không còn dùng được; job nên được chuyển sang account khác"""
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+	"""Đọc header Retry-After (số giây hoặc HTTP-date) từ response lỗi"""
+	response = getattr(error, "response", None)
+	if response is None:
+		return None
+	value = response.headers.get("Retry-After")
+	if not value:
+		return None
+	value = value.strip()
+	if value.isdigit():
+		return float(value)
+	try:
+		retry_at = parsedate_to_datetime(value)
+		return max(0.0, retry_at.timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
+
+
+class RetryPolicy:
+	"""Chính sách retry dùng chung cho các request trong api.py, cấu hình từ "auto_retry" trong config.json"""
+	
+	def __init__(self, max_retries: int = 3, base_delay: float = 2.0, max_delay: float = 30.0, backoff_factor: float = 2.0, enabled: bool = True, max_retry_after: float = DEFAULT_MAX_RETRY_AFTER):
+		self.max_retries = max(0, int(max_retries))
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.backoff_factor = backoff_factor
+		self.enabled = enabled
+		self.max_retry_after = max_retry_after
+	
+	@classmethod
+	def from_config(cls) -> "RetryPolicy":
+		retry_config = _load_config().get("auto_retry", {})
+		return cls(
+			max_retries=retry_config.get("max_retries", 3),
+			base_delay=retry_config.get("base_delay", 2.0),
+			max_delay=retry_config.get("max_delay", 30.0),
+			backoff_factor=retry_config.get("backoff_factor", 2.0),
+			enabled=retry_config.get("enable_auto_retry", True),
+			max_retry_after=retry_config.get("max_retry_after", DEFAULT_MAX_RETRY_AFTER)
+		)
+	
+	@property
+	def max_attempts(self) -> int:
+		return self.max_retries + 1 if self.enabled else 1
+	
+	def backoff_delay(self, attempt: int) -> float:
+		delay = min(self.base_delay * (self.backoff_factor ** attempt), self.max_delay)
+		# Thêm jitter để tránh thundering herd
+		return delay + random.uniform(0.1, 0.3) * delay
+	
+	def delay_for(self, error: BaseException, kind: str, attempt: int) -> float:
+		"""Thời gian chờ trước lần thử tiếp theo; ưu tiên Retry-After của server (429/503)"""
+		retry_after = get_retry_after(error)
+		if retry_after is not None:
+			return min(retry_after, self.max_retry_after)
+		if kind == ERROR_QUOTA:
+			# Hạn mức thường hồi phục chậm, chờ mức tối đa thay vì bắt đầu từ base_delay
+			return self.max_delay
+		return self.backoff_delay(attempt)
+	
+	def call(self, func: Callable[[int], Any], max_attempts: Optional[int] = None, classify: Callable[[BaseException], str] = classify_error, on_error: Optional[Callable[[BaseException, str], None]] = None, label: str = "Request") -> Any:
+		"""Gọi func(attempt) cho tới khi thành công; lỗi auth/permanent raise ngay, không retry"""
+		attempts = max_attempts if max_attempts is not None else self.max_attempts
+		if not self.enabled:
+			attempts = 1
+		attempts = max(1, attempts)
+		
+		for attempt in range(attempts):
+			try:
+				return func(attempt)
+			except Exception as e:
+				kind = classify(e)
+				if on_error is not None:
+					on_error(e, kind)
+				if kind in (ERROR_AUTH, ERROR_PERMANENT):
+					print(f"❌ {label} lỗi {kind}, không thử lại: {str(e)[:200]}")
+					raise
+				if attempt == attempts - 1:
+					print(f"❌ {label}: đã thử {attempts} lần nhưng vẫn lỗi: {str(e)[:200]}")
+					raise
+				delay = self.delay_for(e, kind, attempt)
+				print(f"🔄 {label} lỗi {kind} (lần {attempt + 1}/{attempts}): {str(e)[:100]}")
+				print(f"⏳ Thử lại sau {delay:.1f} giây...")
+				time.sleep(delay)
+
+
+_retry_policy: Optional[RetryPolicy] = None
+_retry_policy_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+	"""Lấy chính sách retry dùng chung (đọc config.json một lần)"""
+	global _retry_policy
+	with _retry_policy_lock:
+		if _retry_policy is None:
+			_retry_policy = RetryPolicy.from_config()
+		return _retry_policy
+
+
+def _invalidate_token_on_auth_error(token: str) -> Callable[[BaseException, str], None]:
+	"""Callback on_error: token hết hạn/bị thu hồi thì bỏ khỏi cache để job sau lấy token mới"""
+	def on_error(error: BaseException, kind: str) -> None:
+		response = getattr(error, "response", None)
+		if kind == ERROR_AUTH and response is not None and response.status_code == 401:
+			invalidate_access_token(token=token)
+	return on_error
 
 
-def http_post_json(url: str, payload: Dict[str, Any], token: str, proxy: Optional[Dict[str, str]] = None, max_retries: int = 5) -> Dict[str, Any]:
+def http_post_json(url: str, payload: Dict[str, Any], token: str, proxy: Optional[Dict[str, str]] = None, max_retries: Optional[int] = None, account_key: Optional[str] = None) -> Dict[str, Any]:
+	return http_post_body(url, lambda: json.dumps(payload), token, proxy, max_retries, account_key)
+
+
+def http_post_body(url: str, body_factory: Callable[[], Any], token: str, proxy: Optional[Dict[str, str]] = None, max_retries: Optional[int] = None, account_key: Optional[str] = None) -> Dict[str, Any]:
+	"""POST body tùy ý (str/bytes/iterable stream) và trả về JSON; body_factory được gọi lại cho mỗi lần thử.
+
+	max_retries là tổng số lần thử, mặc định theo RetryPolicy (config.json "auto_retry").
+	"""
 	headers = get_api_headers(token)
 	session_config = get_session_config()
+	account_key = resolve_account_key(account_key, token)
+	on_auth_error = _invalidate_token_on_auth_error(token)
 	
-	# Tạo session giống browser thật
-	session = create_browser_like_session()
-	session.headers.update(headers)
-	
-	for attempt in range(max_retries):
-		try:
-			# Thêm delay ngẫu nhiên để giả lập hành vi người dùng thật
-			if attempt > 0:
-				# Delay lâu hơn khi retry
-				add_human_like_delay()
-			else:
-				add_random_delay(0.5, 1.5)  # Delay ngắn hơn cho lần đầu
-			
-			# Thử với proxy trước, nếu lỗi thì thử không proxy
-			current_proxy = proxy
-			if attempt > 0 and proxy:
-				print(f"🔄 Lần thử {attempt + 1}: Thử không proxy...")
-				current_proxy = None
-			
-			resp = session.post(
-				url, 
-				data=json.dumps(payload), 
-				proxies=current_proxy,
-				**session_config
-			)
-			resp.raise_for_status()
-			return resp.json()
-			
-		except (requests.exceptions.ProxyError, requests.exceptions.ConnectionError) as e:
-			print(f"❌ Lỗi proxy/connection (lần thử {attempt + 1}/{max_retries}): {e}")
-			if attempt < max_retries - 1:
-				print(f"🔄 Thử lại sau {2 ** attempt} giây...")
-				time.sleep(2 ** attempt)
-				continue
-			else:
-				raise
-				
-		except requests.exceptions.Timeout as e:
-			print(f"⏰ Timeout (lần thử {attempt + 1}/{max_retries}): {e}")
-			if attempt < max_retries - 1:
-				print(f"🔄 Thử lại sau {3 ** attempt} giây...")
-				time.sleep(3 ** attempt)  # Delay lâu hơn cho timeout
-				continue
-			else:
-				raise
-				
-		except requests.HTTPError as e:
+	def attempt_post(attempt: int) -> Dict[str, Any]:
+		# Chỉ chờ khi account vượt tốc độ cho phép
+		get_rate_limiter(account_key).acquire()
+		
+		# Thử với proxy trước, nếu lỗi thì thử không proxy
+		current_proxy = proxy
+		if attempt > 0 and proxy:
+			print(f"🔄 Lần thử {attempt + 1}: Thử không proxy...")
+			current_proxy = None
+		
+		# Dùng session pool theo (account, proxy) để giữ kết nối keep-alive
+		session = get_http_session(account_key, current_proxy)
+		resp = session.post(
+			url, 
+			data=body_factory(), 
+			headers=headers,
+			proxies=current_proxy,
+			**session_config
+		)
+		if not resp.ok:
 			# Debug: In ra response chi tiết khi có lỗi
-			print(f"❌ Lỗi HTTP {e.response.status_code} (lần thử {attempt + 1}/{max_retries}): {e.response.text}")
-			
-			# Nếu là lỗi 500 và chưa hết số lần thử, thử lại
-			if e.response.status_code == 500 and attempt < max_retries - 1:
-				print(f"🔄 Thử lại sau {2 ** attempt} giây...")
-				time.sleep(2 ** attempt)  # Exponential backoff
-				continue
-			
-			# Nếu là lỗi khác hoặc đã hết số lần thử, raise exception
-			if attempt == max_retries - 1:
-				print(f"API Request failed after {max_retries} attempts")
-				print(f"Request Headers: {dict(session.headers)}")
-			raise
+			print(f"❌ Lỗi HTTP {resp.status_code} (lần thử {attempt + 1}): {resp.text}")
+		resp.raise_for_status()
+		return resp.json()
+	
+	return get_retry_policy().call(attempt_post, max_attempts=max_retries, on_error=on_auth_error, label=f"POST {url.rsplit('/', 1)[-1]}")
 
 
 
-def http_download_mp4(url: str, output_path: str, proxy: Optional[Dict[str, str]] = None) -> None:
-	"""Tải trực tiếp file mp4 từ URL"""
-	headers = get_browser_headers()
-	session = requests.Session()
-	session.headers.update(headers)
-	
-	with session.get(url, stream=True, timeout=120, proxies=proxy) as r:
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_SEGMENT_MIN_SIZE = 8 * 1024 * 1024  # Chỉ chia segment song song với file lớn hơn ngưỡng này
+DOWNLOAD_MAX_SEGMENTS = 4
+DOWNLOAD_MAX_ATTEMPTS = 5
+
+
+def _probe_download(session: requests.Session, url: str, headers: Dict[str, str], proxy: Optional[Dict[str, str]]) -> Tuple[Optional[int], bool]:
+	"""HEAD để lấy Content-Length và kiểm tra server có hỗ trợ Range không"""
+	try:
+		resp = session.head(url, headers=headers, proxies=proxy, timeout=30, allow_redirects=True)
+		if resp.ok:
+			length = resp.headers.get("Content-Length")
+			accepts_ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+			return (int(length) if length and length.isdigit() else None), accepts_ranges
+	except requests.RequestException:
+		pass
+	return None, False
+
+
+def _download_range(session: requests.Session, url: str, headers: Dict[str, str], proxy: Optional[Dict[str, str]], part_path: str, start: int = 0, end: Optional[int] = None) -> Optional[int]:
+	"""Tải đoạn [start, end] vào part_path, tiếp tục từ số byte đã có trên đĩa. Trả về tổng kích thước file nếu biết"""
+	offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+	if end is not None and offset == end - start + 1:
+		return None
+	if end is not None and offset > end - start + 1:
+		# Segment dài hơn đoạn cần tải (file cũ/lỗi ghi): tải lại từ đầu thay vì ghép file hỏng
+		os.remove(part_path)
+		offset = 0
+
+	request_headers = dict(headers)
+	range_start = start + offset
+	if range_start > 0 or end is not None:
+		request_headers["Range"] = f"bytes={range_start}-{end if end is not None else ''}"
+
+	with session.get(url, stream=True, timeout=(30, 120), headers=request_headers, proxies=proxy) as r:
+		content_range = r.headers.get("Content-Range", "")
+		if r.status_code == 416 and end is None and offset > 0:
+			# Range bắt đầu ở cuối file: .part đã tải đủ từ lần trước ("bytes */<size>")
+			remote_size = content_range.rsplit("/", 1)[1] if "/" in content_range else ""
+			if remote_size.isdigit() and int(remote_size) == offset:
+				return offset
+			# .part không khớp file trên server: xóa để lần thử sau tải lại từ đầu
+			os.remove(part_path)
+			raise IOError(f"File tạm dài hơn file trên server ({offset}/{remote_size or '?'} bytes)")
 		r.raise_for_status()
-		with open(output_path, "wb") as f:
-			for chunk in r.iter_content(chunk_size=1024 * 1024):
+		total_size = None
+		if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+			total_size = int(content_range.rsplit("/", 1)[1])
+		elif r.status_code == 200 and r.headers.get("Content-Length", "").isdigit():
+			total_size = int(r.headers["Content-Length"])
+
+		if r.status_code != 206 and range_start > 0:
+			# Server bỏ qua Range: chỉ tải lại từ đầu được khi đây là stream đơn
+			if start > 0 or end is not None:
+				raise IOError("Server không hỗ trợ Range cho tải song song")
+			offset = 0
+
+		with open(part_path, "ab" if offset else "wb") as f:
+			for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
 				if chunk:
 					f.write(chunk)
 
+	if end is not None and os.path.getsize(part_path) != end - start + 1:
+		raise IOError(f"Segment {start}-{end} tải chưa đủ")
+	return total_size
+
+
+def _download_segmented(session: requests.Session, url: str, headers: Dict[str, str], proxy: Optional[Dict[str, str]], temp_path: str, total_size: int, segments: int) -> None:
+	"""Chia file thành các segment tải song song (mỗi segment một file .segN để resume được), rồi ghép lại"""
+	segment_size = (total_size + segments - 1) // segments
+	ranges = [(i, i * segment_size, min(total_size, (i + 1) * segment_size) - 1) for i in range(segments)]
+	ranges = [r for r in ranges if r[1] <= r[2]]
 
-def get_encoded_video(token: str, media_id: str, proxy: Optional[Dict[str, str]] = None) -> Optional[str]:
+	with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+		futures = [
+			executor.submit(_download_range, session, url, headers, proxy, f"{temp_path}.seg{i}", start, end)
+			for i, start, end in ranges
+		]
+		for future in futures:
+			future.result()
+
+	with open(temp_path, "wb") as out:
+		for i, _, _ in ranges:
+			segment_path = f"{temp_path}.seg{i}"
+			with open(segment_path, "rb") as f:
+				while True:
+					chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+					if not chunk:
+						break
+					out.write(chunk)
+	for i, _, _ in ranges:
+		os.remove(f"{temp_path}.seg{i}")
+
+
+def http_download_mp4(url: str, output_path: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None, max_attempts: int = DOWNLOAD_MAX_ATTEMPTS, segments: int = DOWNLOAD_MAX_SEGMENTS) -> None:
+	"""Tải trực tiếp file mp4 từ URL.
+
+	Ghi qua file .part rồi rename atomic; lỗi giữa chừng thì resume bằng Range từ số byte đã có;
+	file lớn được chia segment tải song song; kích thước cuối được đối chiếu với Content-Length.
+	"""
+	headers = get_browser_headers()
+	headers["Accept-Encoding"] = "identity"  # Cần kích thước byte thật để Range/Content-Length khớp
+	session = get_http_session(account_key, proxy)
+	temp_path = output_path + ".part"
+
+	total_size, accepts_ranges = _probe_download(session, url, headers, proxy)
+	use_segments = bool(accepts_ranges and total_size and total_size >= DOWNLOAD_SEGMENT_MIN_SIZE and segments > 1)
+	state = {"total_size": total_size}
+
+	def attempt_download(attempt: int) -> None:
+		# Mỗi lần thử tiếp tục từ các byte đã có trong file .part/.segN
+		if use_segments:
+			_download_segmented(session, url, headers, proxy, temp_path, total_size, segments)
+		else:
+			reported_size = _download_range(session, url, headers, proxy, temp_path)
+			state["total_size"] = state["total_size"] or reported_size
+
+		size = os.path.getsize(temp_path)
+		expected_size = state["total_size"]
+		if expected_size and size != expected_size:
+			if size > expected_size:
+				os.remove(temp_path)
+			raise IOError(f"Kích thước file không khớp: {size}/{expected_size} bytes")
+		os.replace(temp_path, output_path)
+
+	def classify(error: BaseException) -> str:
+		# Tải thiếu/đứt giữa chừng thì resume được; link hết hạn (403/404) thì không
+		if not isinstance(error, requests.RequestException) and isinstance(error, IOError):
+			return ERROR_RETRYABLE
+		return classify_error(error)
+
+	get_retry_policy().call(attempt_download, max_attempts=max_attempts, classify=classify, label="Tải video")
+
+
+def get_encoded_video(token: str, media_id: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> Optional[str]:
 	"""Lấy encodedVideo từ mediaId sau khi upscale"""
 	print(f"🚀 DEBUG: get_encoded_video được gọi!")
 	print(f"🚀 DEBUG: media_id: {media_id}")
@@ -332,14 +665,16 @@ def get_encoded_video(token: str, media_id: str, proxy: Optional[Dict[str, str]]
 	url = f"https://aisandbox-pa.googleapis.com/v1/media/{media_id}?clientContext.tool=PINHOLE"
 	headers = get_api_headers(token)
 	
-	session = requests.Session()
-	session.headers.update(headers)
+	session = get_http_session(resolve_account_key(account_key, token), proxy)
 	session_config = get_session_config()
 	
-	try:
-		resp = session.get(url, proxies=proxy, **session_config)
+	def attempt_get(attempt: int) -> Dict[str, Any]:
+		resp = session.get(url, headers=headers, proxies=proxy, **session_config)
 		resp.raise_for_status()
-		data = resp.json()
+		return resp.json()
+	
+	try:
+		data = get_retry_policy().call(attempt_get, on_error=_invalidate_token_on_auth_error(token), label="Lấy encodedVideo")
 		
 		# Trích xuất encodedVideo
 		video_data = data.get("video", {})
@@ -364,7 +699,6 @@ def download_encoded_video(encoded_video: str, output_path: str) -> None:
 	print(f"🚀 DEBUG: encoded_video length: {len(encoded_video)}")
 	
 	try:
-		import base64
 		# Decode base64 encoded video
 		video_data = base64.b64decode(encoded_video)
 		
@@ -379,7 +713,125 @@ def download_encoded_video(encoded_video: str, output_path: str) -> None:
 		raise
 
 
-def delete_media(names: List[str], cookie_header_value: Optional[str], proxy: Optional[Dict[str, str]] = None, max_retries: int = 3) -> bool:
+class _EncodedVideoStreamDecoder:
+	"""Tìm field "encodedVideo" trong JSON đang stream và decode base64 từng phần thẳng ra file"""
+
+	KEY = b'"encodedVideo"'
+
+	def __init__(self, output_file):
+		self.output_file = output_file
+		self.state = "search"  # search -> open_quote -> value -> done
+		self.buffer = b""  # phần đuôi chưa xử lý xong (key bị cắt giữa 2 chunk, ký tự escape)
+		self.pending = b""  # base64 còn dư chưa đủ bội số 4
+		self.bytes_written = 0
+
+	@property
+	def done(self) -> bool:
+		return self.state == "done"
+
+	def feed(self, chunk: bytes) -> None:
+		if self.done:
+			return
+		data = self.buffer + chunk
+		self.buffer = b""
+
+		if self.state == "search":
+			index = data.find(self.KEY)
+			if index < 0:
+				# Giữ lại đuôi phòng trường hợp key bị cắt giữa 2 chunk
+				self.buffer = data[-(len(self.KEY) - 1):]
+				return
+			data = data[index + len(self.KEY):]
+			self.state = "open_quote"
+
+		if self.state == "open_quote":
+			index = data.find(b'"')
+			if index < 0:
+				return
+			data = data[index + 1:]
+			self.state = "value"
+
+		if self.state == "value":
+			end = data.find(b'"')
+			if end >= 0:
+				self._decode(data[:end], final=True)
+				self.state = "done"
+			else:
+				self._decode(data, final=False)
+
+	_ESCAPE = re.compile(rb"\\(u[0-9a-fA-F]{4}|[^u])")
+
+	@staticmethod
+	def _unescape(match) -> bytes:
+		escape = match.group(1)
+		if escape.startswith(b"u"):
+			# Encoder JSON của Google hay ghi "=" thành "\u003d"
+			return chr(int(escape[1:], 16)).encode("utf-8")
+		return escape if escape in (b"/", b"\\", b'"') else b""  # \n \r \t \b \f: bỏ như khoảng trắng
+
+	def _decode(self, part: bytes, final: bool) -> None:
+		# Escape bị cắt ở cuối chunk ("\" hoặc "\u00") để dành cho chunk sau
+		last_end = 0
+		for match in self._ESCAPE.finditer(part):
+			last_end = match.end()
+		tail = part.find(b"\\", last_end)
+		if not final and tail >= 0:
+			self.buffer = part[tail:]
+			part = part[:tail]
+		# Bỏ escape JSON ("\/" -> "/", "\u003d" -> "=") và khoảng trắng/xuống dòng
+		part = self._ESCAPE.sub(self._unescape, part)
+		part = re.sub(rb"\s+", b"", part)
+
+		data = self.pending + part
+		usable = len(data) if final else len(data) - len(data) % 4
+		self.pending = data[usable:]
+		if usable:
+			decoded = base64.b64decode(data[:usable])
+			self.output_file.write(decoded)
+			self.bytes_written += len(decoded)
+
+
+def download_encoded_video_stream(token: str, media_id: str, output_path: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None, chunk_size: int = 256 * 1024) -> int:
+	"""Tải video upscale từ mediaId: đọc response theo stream, decode encodedVideo từng chunk ra file.
+
+	RAM dùng không phụ thuộc kích thước video. Trả về số byte đã ghi.
+	"""
+	url = f"https://aisandbox-pa.googleapis.com/v1/media/{media_id}?clientContext.tool=PINHOLE"
+	headers = get_api_headers(token)
+	session = get_http_session(resolve_account_key(account_key, token), proxy)
+	session_config = get_session_config()
+	temp_path = output_path + ".part"
+
+	def attempt_stream(attempt: int) -> int:
+		# Mỗi lần thử ghi lại file tạm từ đầu (base64 không resume được giữa chừng)
+		with session.get(url, headers=headers, proxies=proxy, stream=True, **session_config) as resp:
+			resp.raise_for_status()
+			with open(temp_path, "wb") as f:
+				decoder = _EncodedVideoStreamDecoder(f)
+				for chunk in resp.iter_content(chunk_size=chunk_size):
+					if chunk:
+						decoder.feed(chunk)
+					if decoder.done:
+						break
+		if not decoder.done:
+			raise ValueError("Không tìm thấy encodedVideo trong response")
+		os.replace(temp_path, output_path)
+		return decoder.bytes_written
+
+	try:
+		bytes_written = get_retry_policy().call(attempt_stream, on_error=_invalidate_token_on_auth_error(token), label="Tải encodedVideo")
+		print(f"✅ Đã tải video từ encodedVideo (stream): {output_path} ({bytes_written} bytes)")
+		return bytes_written
+	except Exception:
+		if os.path.exists(temp_path):
+			try:
+				os.remove(temp_path)
+			except OSError:
+				pass
+		raise
+
+
+def delete_media(names: List[str], cookie_header_value: Optional[str], proxy: Optional[Dict[str, str]] = None, max_retries: Optional[int] = None, account_key: Optional[str] = None) -> bool:
 	"""Gọi API xóa media trên labs.google. Trả về True nếu thành công.
 
 	API: https://labs.google/fx/api/trpc/media.deleteMedia (POST)
@@ -397,79 +849,112 @@ def delete_media(names: List[str], cookie_header_value: Optional[str], proxy: Op
 		"Cookie": cookie_header_value,
 	})
 	
-	session = requests.Session()
-	session.headers.update(headers)
+	account_key = resolve_account_key(account_key, cookie_header_value)
+	session = get_http_session(account_key, proxy)
 	session_config = get_session_config()
 	payload = {"json": {"names": names}}
 	
-	for attempt in range(max_retries):
-		try:
-			if attempt > 0:
-				add_random_delay(0.5, 1.5)
-			resp = session.post(url, data=json.dumps(payload), proxies=proxy, **session_config)
-			resp.raise_for_status()
-			print("🧹 Đã gửi yêu cầu xóa media thành công")
-			return True
-		except requests.HTTPError as e:
-			print(f"❌ Xóa media lỗi HTTP {e.response.status_code}: {e.response.text}")
-			if e.response.status_code >= 500 and attempt < max_retries - 1:
-				print("🔄 Thử xóa lại...")
-				continue
-			return False
-		except Exception as e:
-			print(f"❌ Xóa media lỗi: {e}")
-			return False
+	def attempt_delete(attempt: int) -> None:
+		get_rate_limiter(account_key).acquire()
+		resp = session.post(url, data=json.dumps(payload), headers=headers, proxies=proxy, **session_config)
+		if not resp.ok:
+			print(f"❌ Xóa media lỗi HTTP {resp.status_code}: {resp.text}")
+		resp.raise_for_status()
+	
+	try:
+		get_retry_policy().call(attempt_delete, max_attempts=max_retries, label="Xóa media")
+		print("🧹 Đã gửi yêu cầu xóa media thành công")
+		return True
+	except Exception as e:
+		print(f"❌ Xóa media lỗi: {e}")
+		return False
 
 
-def upload_image(token: str, image_path: str, proxy: Optional[Dict[str, str]] = None) -> str:
-	"""Upload image và trả về mediaGenerationId"""
-	if not os.path.exists(image_path):
-		raise FileNotFoundError(f"Không tìm thấy file image: {image_path}")
-	
-	# Đọc file image
-	with open(image_path, "rb") as f:
-		image_data = f.read()
-	
-	# Chuyển đổi thành base64
-	import base64
-	base64_data = base64.b64encode(image_data).decode('utf-8')
-	
-	# Xác định mime type
-	mime_type = "image/jpeg"
-	if image_path.lower().endswith('.png'):
-		mime_type = "image/png"
-	elif image_path.lower().endswith('.gif'):
-		mime_type = "image/gif"
-	elif image_path.lower().endswith('.webp'):
-		mime_type = "image/webp"
-	
+class StreamingBase64JsonBody:
+	"""Body JSON gửi theo stream: envelope JSON + base64 của file được encode từng chunk ngay khi gửi.
+
+	Có __len__ để requests gửi Content-Length thay vì chunked; có thể lặp lại nhiều lần khi retry.
+	"""
+
+	PLACEHOLDER = "__STREAMED_FILE_BYTES__"
+
+	def __init__(self, envelope: Dict[str, Any], file_path: str, chunk_size: int = 768 * 1024):
+		prefix, suffix = json.dumps(envelope).split(json.dumps(self.PLACEHOLDER), 1)
+		self.prefix = (prefix + '"').encode("utf-8")
+		self.suffix = ('"' + suffix).encode("utf-8")
+		self.file_path = file_path
+		# Chunk là bội số của 3 để ghép base64 từng chunk bằng đúng base64 của cả file
+		self.chunk_size = max(3, chunk_size - chunk_size % 3)
+		file_size = os.path.getsize(file_path)
+		self.length = len(self.prefix) + 4 * ((file_size + 2) // 3) + len(self.suffix)
+
+	def __len__(self) -> int:
+		return self.length
+
+	def __iter__(self) -> Iterator[bytes]:
+		yield self.prefix
+		with open(self.file_path, "rb") as f:
+			while True:
+				chunk = f.read(self.chunk_size)
+				if not chunk:
+					break
+				yield base64.b64encode(chunk)
+		yield self.suffix
+
+
+def _upload_media_file(token: str, file_path: str, mime_type: str, aspect_ratio: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> str:
+	"""Upload file lên uploadUserImage bằng body stream và trả về mediaGenerationId"""
 	# Tạo session ID ngẫu nhiên
 	session_id = f";{int(time.time() * 1000)}"
 	
-	payload = {
+	envelope = {
 		"imageInput": {
-			"aspectRatio": "IMAGE_ASPECT_RATIO_LANDSCAPE",
+			"aspectRatio": aspect_ratio,
 			"isUserUploaded": True,
 			"mimeType": mime_type,
-			"rawImageBytes": base64_data
+			"rawImageBytes": StreamingBase64JsonBody.PLACEHOLDER
 		},
 		"clientContext": {
 			"sessionId": session_id,
 			"tool": "ASSET_MANAGER"
 		}
 	}
-	
-	response = http_post_json(UPLOAD_IMAGE_URL, payload, token, proxy)
+	body = StreamingBase64JsonBody(envelope, file_path)
+	response = http_post_body(UPLOAD_IMAGE_URL, lambda: body, token, proxy, account_key=account_key)
 	
 	# Trích xuất mediaGenerationId
-	media_gen_id = response.get("mediaGenerationId", {}).get("mediaGenerationId")
+	return response.get("mediaGenerationId", {}).get("mediaGenerationId")
+
+
+IMAGE_UPLOAD_ASPECT_RATIO = "IMAGE_ASPECT_RATIO_LANDSCAPE"
+
+
+def get_image_mime_type(image_path: str) -> str:
+	"""Xác định mime type của image theo đuôi file"""
+	mime_type = "image/jpeg"
+	if image_path.lower().endswith('.png'):
+		mime_type = "image/png"
+	elif image_path.lower().endswith('.gif'):
+		mime_type = "image/gif"
+	elif image_path.lower().endswith('.webp'):
+		mime_type = "image/webp"
+	return mime_type
+
+
+def upload_image(token: str, image_path: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> str:
+	"""Upload image và trả về mediaGenerationId"""
+	if not os.path.exists(image_path):
+		raise FileNotFoundError(f"Không tìm thấy file image: {image_path}")
+	
+	# File được đọc và base64 từng chunk ngay khi gửi, không giữ cả file trong RAM
+	media_gen_id = _upload_media_file(token, image_path, get_image_mime_type(image_path), IMAGE_UPLOAD_ASPECT_RATIO, proxy, account_key)
 	if not media_gen_id:
 		raise ValueError("Không tìm thấy mediaGenerationId trong phản hồi upload")
 	
 	return media_gen_id
 
 
-def upload_video(token: str, video_path: str, proxy: Optional[Dict[str, str]] = None) -> str:
+def upload_video(token: str, video_path: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> str:
 	"""Upload video và trả về mediaGenerationId - sử dụng cùng endpoint nhưng với payload video"""
 	print(f"🚀 DEBUG: upload_video được gọi!")
 	print(f"🚀 DEBUG: video_path: {video_path}")
@@ -478,14 +963,6 @@ def upload_video(token: str, video_path: str, proxy: Optional[Dict[str, str]] =
 	if not os.path.exists(video_path):
 		raise FileNotFoundError(f"Không tìm thấy file video: {video_path}")
 	
-	# Đọc file video
-	with open(video_path, "rb") as f:
-		video_data = f.read()
-	
-	# Chuyển đổi thành base64
-	import base64
-	base64_data = base64.b64encode(video_data).decode('utf-8')
-	
 	# Xác định mime type
 	mime_type = "video/mp4"
 	if video_path.lower().endswith('.mov'):
@@ -495,35 +972,16 @@ def upload_video(token: str, video_path: str, proxy: Optional[Dict[str, str]] =
 	elif video_path.lower().endswith('.webm'):
 		mime_type = "video/webm"
 	
-	# Tạo session ID ngẫu nhiên
-	session_id = f";{int(time.time() * 1000)}"
-	
 	# Sử dụng cùng endpoint nhưng với payload video (sử dụng imageInput thay vì videoInput)
-	payload = {
-		"imageInput": {
-			"aspectRatio": "VIDEO_ASPECT_RATIO_LANDSCAPE",
-			"isUserUploaded": True,
-			"mimeType": mime_type,
-			"rawImageBytes": base64_data
-		},
-		"clientContext": {
-			"sessionId": session_id,
-			"tool": "ASSET_MANAGER"
-		}
-	}
-	
-	response = http_post_json(UPLOAD_IMAGE_URL, payload, token, proxy)
-	
-	# Trích xuất mediaGenerationId
-	media_gen_id = response.get("mediaGenerationId", {}).get("mediaGenerationId")
+	media_gen_id = _upload_media_file(token, video_path, mime_type, "VIDEO_ASPECT_RATIO_LANDSCAPE", proxy, account_key)
 	if not media_gen_id:
 		raise ValueError("Không tìm thấy mediaGenerationId trong phản hồi upload video")
 	
 	return media_gen_id
 
 
-def generate_video(token: str, prompt: str, project_id: str, model_key: str = "veo_3_0_t2v_fast_ultra", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None, proxy: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, Any], str]:
-	"""Generate video và trả về response cùng với scene_id được tạo"""
+def _resolve_seed(seed: Optional[int]) -> int:
+	"""Chuẩn hóa seed: None thì đọc từ config, 0 thì random theo thời gian"""
 	if seed is None:
 		# Đọc seed từ config, nếu seed = 0 thì random
 		config = _load_config()
@@ -538,6 +996,12 @@ def generate_video(token: str, prompt: str, project_id: str, model_key: str = "v
 	else:
 		# Đảm bảo seed là số nguyên
 		seed = int(seed)
+	return seed
+
+
+def generate_video(token: str, prompt: str, project_id: str, model_key: str = "veo_3_0_t2v_fast_ultra", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+	"""Generate video và trả về response cùng với scene_id được tạo"""
+	seed = _resolve_seed(seed)
 	
 	# Tạo scene_id ngẫu nhiên
 	scene_id = str(uuid.uuid4())
@@ -559,26 +1023,13 @@ def generate_video(token: str, prompt: str, project_id: str, model_key: str = "v
 		]
 	}
 	
-	response = http_post_json(GENERATE_URL, payload, token, proxy)
+	response = http_post_json(GENERATE_URL, payload, token, proxy, account_key=account_key)
 	return response, scene_id
 
 
-def generate_video_from_image(token: str, prompt: str, media_id: str, project_id: str, model_key: str = "veo_3_i2v_s_fast_ultra", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None, proxy: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, Any], str]:
+def generate_video_from_image(token: str, prompt: str, media_id: str, project_id: str, model_key: str = "veo_3_i2v_s_fast_ultra", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
 	"""Generate video từ image + prompt và trả về response cùng với scene_id được tạo"""
-	if seed is None:
-		# Đọc seed từ config, nếu seed = 0 thì random
-		config = _load_config()
-		config_seed = config.get("seed", 0)
-		if config_seed == 0:
-			seed = int(time.time()) % 65535
-		else:
-			seed = int(config_seed)
-	elif seed == 0:
-		# Nếu seed = 0, tạo random seed
-		seed = int(time.time()) % 65535
-	else:
-		# Đảm bảo seed là số nguyên
-		seed = int(seed)
+	seed = _resolve_seed(seed)
 	
 	# Tạo scene_id ngẫu nhiên
 	scene_id = str(uuid.uuid4())
@@ -617,42 +1068,37 @@ def generate_video_from_image(token: str, prompt: str, media_id: str, project_id
 			}
 		]
 	}
-	response = http_post_json(GENERATE_IMAGE_URL, payload, token, proxy)
+	response = http_post_json(GENERATE_IMAGE_URL, payload, token, proxy, account_key=account_key)
 	return response, scene_id
 
 
-def upscale_video(token: str, video_media_id: str, project_id: str, scale: str = "1080p", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None, proxy: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, Any], str]:
+def upscale_video(token: str, video_media_id: str, project_id: str, scale: str = "1080p", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
 	"""Upscale video và trả về response cùng với scene_id được tạo"""
-	if seed is None:
-		# Đọc seed từ config, nếu seed = 0 thì random
-		config = _load_config()
-		config_seed = config.get("seed", 0)
-		if config_seed == 0:
-			seed = int(time.time()) % 65535
-		else:
-			seed = int(config_seed)
-	elif seed == 0:
-		# Nếu seed = 0, tạo random seed
-		seed = int(time.time()) % 65535
-	else:
-		# Đảm bảo seed là số nguyên
-		seed = int(seed)
+	seed = _resolve_seed(seed)
 	
 	# Tạo scene_id ngẫu nhiên
 	scene_id = str(uuid.uuid4())
 	
-	# Chọn model key dựa trên scale
+	payload = _build_upscale_payload(video_media_id, scale, aspect_ratio, seed, scene_id)
+	response = http_post_json(UPSCALE_URL, payload, token, proxy, account_key=account_key)
+	return response, scene_id
+
+
+def upscale_model_key(scale: str) -> str:
+	"""Chọn model key dựa trên scale"""
 	if scale == "720p":
-		model_key = "veo_2_720p_upsampler_8s"
-	elif scale == "1080p":
-		model_key = "veo_2_1080p_upsampler_8s"
-	else:
-		model_key = "veo_2_1080p_upsampler_8s"  # Default to 1080p
+		return "veo_2_720p_upsampler_8s"
+	return "veo_2_1080p_upsampler_8s"  # 1080p và mặc định
+
+
+def _build_upscale_payload(video_media_id: str, scale: str, aspect_ratio: str, seed: int, scene_id: str) -> Dict[str, Any]:
+	"""Tạo payload upscale (dùng chung cho client sync và async)"""
+	model_key = upscale_model_key(scale)
 	
 	# Tạo session ID ngẫu nhiên
 	session_id = f";{int(time.time() * 1000)}"
 	
-	payload = {
+	return {
 		"clientContext": {
 			"sessionId": session_id
 		},
@@ -670,8 +1116,172 @@ def upscale_video(token: str, video_media_id: str, project_id: str, scale: str =
 			}
 		]
 	}
-	response = http_post_json(UPSCALE_URL, payload, token, proxy)
-	return response, scene_id
+
+
+def _build_generate_request(prompt: str, model_key: str, aspect_ratio: str, seed: int, scene_id: str, media_id: Optional[str] = None) -> Dict[str, Any]:
+	"""Tạo một phần tử trong mảng requests của generate (text hoặc image + text)"""
+	request = {
+		"aspectRatio": aspect_ratio,
+		"seed": seed,
+		"textInput": {"prompt": prompt},
+		"videoModelKey": model_key,
+		"metadata": {"sceneId": scene_id},
+	}
+	if media_id:
+		request["promptExpansionInput"] = {
+			"prompt": prompt,
+			"seed": seed,
+			"templateId": "0TNlfC6bSF",
+			"imageInputs": [
+				{
+					"mediaId": media_id,
+					"imageUsageType": "IMAGE_USAGE_TYPE_UNSPECIFIED"
+				}
+			]
+		}
+		request["startImage"] = {"mediaId": media_id}
+	return request
+
+
+def generate_videos_batch(token: str, items: List[Dict[str, Any]], project_id: str, model_key: str, aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> List[Tuple[Dict[str, Any], str]]:
+	"""Gửi nhiều prompt (cùng model/aspect) trong một request generate.
+
+	items: [{"prompt": str, "media_id": Optional[str], "seed": Optional[int]}, ...] - tất cả cùng loại (text hoặc image);
+	item không có "seed" thì dùng seed chung
+	Trả về danh sách (response, scene_id) theo đúng thứ tự items, mỗi response chỉ chứa operation của item đó.
+	"""
+	if not items:
+		return []
+	with_image = bool(items[0].get("media_id"))
+	if any(bool(item.get("media_id")) != with_image for item in items):
+		raise ValueError("Không thể gộp prompt text và image trong cùng một batch")
+
+	scene_ids = [str(uuid.uuid4()) for _ in items]
+	requests_payload = [
+		_build_generate_request(item["prompt"], model_key, aspect_ratio, _resolve_seed(item.get("seed", seed)), scene_id, item.get("media_id"))
+		for item, scene_id in zip(items, scene_ids)
+	]
+	payload = {
+		"clientContext": {
+			"projectId": project_id,
+			"tool": "PINHOLE",
+			"userPaygateTier": "PAYGATE_TIER_TWO",
+		},
+		"requests": requests_payload
+	}
+	url = GENERATE_IMAGE_URL if with_image else GENERATE_URL
+	response = http_post_json(url, payload, token, proxy, account_key=account_key)
+
+	ops = response.get("operations", [])
+	ops_by_scene = {op.get("sceneId"): op for op in ops if op.get("sceneId")}
+	results = []
+	for index, scene_id in enumerate(scene_ids):
+		# Ưu tiên map theo sceneId, nếu server không trả sceneId thì map theo thứ tự
+		op = ops_by_scene.get(scene_id)
+		if op is None and len(ops) == len(scene_ids):
+			op = ops[index]
+		item_response = dict(response)
+		item_response["operations"] = [op] if op else []
+		results.append((item_response, scene_id))
+	return results
+
+
+class BatchGenerateSubmitter:
+	"""Gom các prompt cùng (account, model, aspect) trong một khoảng ngắn rồi gửi chung một request generate"""
+
+	def __init__(self, account_key: str, project_id: str, model_key: str, aspect_ratio: str, proxy: Optional[Dict[str, str]] = None, max_batch_size: int = 4, linger_sec: float = 1.0):
+		self.account_key = account_key
+		self.project_id = project_id
+		self.model_key = model_key
+		self.aspect_ratio = aspect_ratio
+		self.proxy = proxy
+		self.max_batch_size = max(1, int(max_batch_size))
+		self.linger_sec = linger_sec
+		self.token: Optional[str] = None
+		self._queue: List[Dict[str, Any]] = []
+		self._cond = threading.Condition()
+
+	def submit(self, token: str, prompt: str, media_id: Optional[str] = None, seed: Optional[int] = None) -> Tuple[Dict[str, Any], str]:
+		"""Gửi prompt (có thể được gộp với prompt khác) và chờ kết quả (response, scene_id) như generate_video"""
+		entry = {"prompt": prompt, "media_id": media_id, "seed": seed, "done": threading.Event(), "result": None, "error": None}
+		with self._cond:
+			self.token = token
+			self._queue.append(entry)
+			# Job đầu tiên vào hàng đợi rỗng làm leader, chịu trách nhiệm gửi batch
+			is_leader = len(self._queue) == 1
+			if len(self._queue) >= self.max_batch_size:
+				self._cond.notify_all()
+
+		if is_leader:
+			self._lead_batch()
+		entry["done"].wait()
+		if entry["error"] is not None:
+			raise entry["error"]
+		return entry["result"]
+
+	def _lead_batch(self) -> None:
+		with self._cond:
+			deadline = time.time() + self.linger_sec
+			while len(self._queue) < self.max_batch_size:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self._cond.wait(remaining)
+			batch, self._queue = self._queue, []
+			token = self.token
+
+		for i in range(0, len(batch), self.max_batch_size):
+			chunk = batch[i:i + self.max_batch_size]
+			try:
+				self._send(token, chunk)
+			finally:
+				for entry in chunk:
+					entry["done"].set()
+
+	def _send(self, token: Optional[str], chunk: List[Dict[str, Any]]) -> None:
+		"""Gửi một chunk (seed riêng từng prompt); batch bị từ chối thì gửi lại từng prompt để lỗi chỉ rơi vào đúng prompt đó"""
+		try:
+			results = generate_videos_batch(token, chunk, self.project_id, self.model_key, self.aspect_ratio, None, self.proxy, account_key=self.account_key)
+		except Exception as e:
+			if len(chunk) == 1 or classify_error(e) != ERROR_PERMANENT:
+				# Lỗi xác thực/quota/mạng ảnh hưởng cả account: gửi lẻ cũng không khác
+				for entry in chunk:
+					entry["error"] = e
+				return
+			print(f"⚠️ Batch {len(chunk)} prompt bị từ chối ({self.account_key}), gửi lại từng prompt: {str(e)}")
+			for entry in chunk:
+				self._send(token, [entry])
+			return
+		if len(chunk) > 1:
+			print(f"📦 Đã gửi {len(chunk)} prompt trong một request generate ({self.account_key})")
+		for entry, result in zip(chunk, results):
+			entry["result"] = result
+
+
+_generate_submitters: Dict[Tuple[str, ...], BatchGenerateSubmitter] = {}
+_generate_submitters_lock = threading.Lock()
+
+
+def get_generate_submitter(account_key: str, project_id: str, model_key: str, aspect_ratio: str, with_image: bool = False, proxy: Optional[Dict[str, str]] = None) -> BatchGenerateSubmitter:
+	"""Lấy submitter dùng chung theo (account, loại, model, aspect); kích thước batch đọc từ config.json"""
+	key = (account_key, "image" if with_image else "text", project_id, model_key, aspect_ratio, _proxy_key(proxy))
+	with _generate_submitters_lock:
+		submitter = _generate_submitters.get(key)
+		if submitter is None:
+			batch_config = _load_config().get("batch_submit", {})
+			submitter = BatchGenerateSubmitter(
+				account_key, project_id, model_key, aspect_ratio, proxy,
+				max_batch_size=batch_config.get("max_batch_size", 1),
+				linger_sec=batch_config.get("linger_sec", 1.0)
+			)
+			_generate_submitters[key] = submitter
+		return submitter
+
+
+def clear_generate_submitters() -> None:
+	"""Xóa các submitter của lượt chạy"""
+	with _generate_submitters_lock:
+		_generate_submitters.clear()
 
 
 def extract_op_name(response_json: Dict[str, Any]) -> str:
@@ -685,9 +1295,14 @@ def extract_op_name(response_json: Dict[str, Any]) -> str:
 	return name
 
 
-def poll_status(token: str, operation_name: str, scene_id: str, interval_sec: float = 3.0, timeout_sec: int = 1200, proxy: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
-	deadline = time.time() + timeout_sec
+def poll_status(token: str, operation_name: str, scene_id: str, interval_sec: float = 3.0, timeout_sec: int = 1200, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None, model_key: Optional[str] = None) -> Dict[str, Any]:
+	"""Poll một operation tới khi xong; có model_key thì giãn/thu hẹp khoảng poll theo thời gian hoàn thành đã quan sát"""
+	timing = get_poll_timing()
+	started = time.time()
+	deadline = started + timeout_sec
 	last_status = None
+	last_check = started
+	time.sleep(timing.next_delay(model_key, 0, interval_sec))
 	while time.time() < deadline:
 		payload = {
 			"operations": [
@@ -697,7 +1312,7 @@ def poll_status(token: str, operation_name: str, scene_id: str, interval_sec: fl
 				}
 			]
 		}
-		resp = http_post_json(CHECK_URL, payload, token, proxy)
+		resp = http_post_json(CHECK_URL, payload, token, proxy, account_key=account_key)
 		ops = resp.get("operations", [])
 		if not ops:
 			raise ValueError("Phản hồi status không có operations")
@@ -705,14 +1320,223 @@ def poll_status(token: str, operation_name: str, scene_id: str, interval_sec: fl
 		if status != last_status:
 			print(f"Status: {status}")
 			last_status = status
+		now = time.time()
 		if status == "MEDIA_GENERATION_STATUS_SUCCESSFUL":
+			timing.record(model_key, completion_estimate(started, last_check, now))
 			return resp
 		if status in {"MEDIA_GENERATION_STATUS_FAILED", "MEDIA_GENERATION_STATUS_CANCELLED"}:
 			raise RuntimeError(f"Media generation thất bại: {json.dumps(resp, ensure_ascii=False)}")
-		time.sleep(interval_sec)
+		last_check = now
+		time.sleep(timing.next_delay(model_key, now - started, interval_sec))
 	raise TimeoutError("Hết thời gian chờ media generation")
 
 
+STATUS_SUCCESSFUL = "MEDIA_GENERATION_STATUS_SUCCESSFUL"
+STATUS_FAILED = {"MEDIA_GENERATION_STATUS_FAILED", "MEDIA_GENERATION_STATUS_CANCELLED"}
+
+
+def completion_estimate(started: float, last_check: float, now: float) -> float:
+	"""Thời gian hoàn thành ước tính: operation xong ở khoảng giữa lần check trước và lần check này"""
+	return (last_check + now) / 2 - started
+
+
+class BatchStatusPoller:
+	"""Poller dùng chung cho một account: gom mọi operation đang chờ và check trong một request batch mỗi tick"""
+
+	def __init__(self, account_key: str, proxy: Optional[Dict[str, str]] = None, interval_sec: float = 2.0, max_batch: int = 50, token_provider=None):
+		self.account_key = account_key
+		self.proxy = proxy
+		self.token_provider = token_provider  # Hàm trả về token mới nhất (vd. từ cache token), tùy chọn
+		self.interval_sec = interval_sec
+		self.max_batch = max_batch
+		self.token: Optional[str] = None
+		self._pending: Dict[str, Dict[str, Any]] = {}  # operation_name -> thông tin job đang chờ
+		self._cond = threading.Condition()
+		self._stop_event = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	def watch(self, token: str, operation_name: str, scene_id: str, callback, timeout_sec: float = 1200, model_key: Optional[str] = None, started_at: Optional[float] = None) -> None:
+		"""Đăng ký operation; callback(status_json, error) được gọi từ thread poller khi có kết quả
+
+		model_key: videoModelKey của operation để hẹn lần check theo thời gian hoàn thành đã quan sát
+		started_at: thời điểm submit (khi resume operation của lần chạy trước); chỉ là mốc ước lượng
+		nên operation resume không được ghi vào thống kê thời gian hoàn thành
+		"""
+		now = time.time()
+		started = min(started_at, now) if started_at else now
+		with self._cond:
+			# Token mới nhất của account được dùng cho cả batch
+			self.token = token
+			self._pending[operation_name] = {
+				"scene_id": scene_id,
+				"callback": callback,
+				"deadline": now + timeout_sec,
+				"last_status": None,
+				"model_key": model_key,
+				"started": started,
+				"last_check": started,
+				"next_check": now + get_poll_timing().next_delay(model_key, now - started, self.interval_sec),
+				"record_timing": started_at is None,
+			}
+			if self._thread is None or not self._thread.is_alive():
+				self._stop_event.clear()
+				self._thread = threading.Thread(target=self._run, name=f"poller-{self.account_key}", daemon=True)
+				self._thread.start()
+			self._cond.notify()
+
+	def wait(self, token: str, operation_name: str, scene_id: str, timeout_sec: float = 1200, model_key: Optional[str] = None) -> Dict[str, Any]:
+		"""Chờ operation hoàn thành - cùng kết quả/exception như poll_status nhưng dùng batch chung"""
+		done = threading.Event()
+		box: Dict[str, Any] = {}
+
+		def _on_done(result, error):
+			box["result"] = result
+			box["error"] = error
+			done.set()
+
+		self.watch(token, operation_name, scene_id, _on_done, timeout_sec, model_key)
+		if not done.wait(timeout_sec + self.interval_sec * 5):
+			self._finish(operation_name, None, TimeoutError("Hết thời gian chờ media generation"))
+		if box.get("error") is not None:
+			raise box["error"]
+		return box["result"]
+
+	def pending_count(self) -> int:
+		with self._cond:
+			return len(self._pending)
+
+	def stop(self) -> None:
+		"""Dừng poller và báo lỗi cho các job còn đang chờ"""
+		self._stop_event.set()
+		with self._cond:
+			names = list(self._pending)
+			self._cond.notify_all()
+		for name in names:
+			self._finish(name, None, RuntimeError("Poller đã dừng"))
+
+	def _finish(self, operation_name: str, result: Optional[Dict[str, Any]], error: Optional[BaseException]) -> None:
+		with self._cond:
+			entry = self._pending.pop(operation_name, None)
+		if entry is None:
+			return
+		try:
+			entry["callback"](result, error)
+		except Exception as e:
+			print(f"⚠ Lỗi callback poll {operation_name}: {e}")
+
+	def _run(self) -> None:
+		timing = get_poll_timing()
+		while not self._stop_event.is_set():
+			with self._cond:
+				while not self._stop_event.is_set():
+					# Chỉ check các operation đã tới hẹn (hoặc hết hạn), còn lại ngủ tới lần hẹn gần nhất
+					now = time.time()
+					batch = [
+						(name, entry) for name, entry in self._pending.items()
+						if entry["next_check"] <= now or entry["deadline"] <= now
+					]
+					if batch:
+						break
+					wake_at = min((min(e["next_check"], e["deadline"]) for e in self._pending.values()), default=None)
+					self._cond.wait(None if wake_at is None else wake_at - now)
+				token = self.token
+			if self._stop_event.is_set():
+				break
+			if self.token_provider is not None:
+				try:
+					token = self.token_provider() or token
+				except Exception as e:
+					print(f"⚠ Không lấy được token mới cho poller {self.account_key}: {e}")
+
+			for i in range(0, len(batch), self.max_batch):
+				self._check_batch(token, batch[i:i + self.max_batch])
+
+			# Hết hạn chờ cho các operation quá deadline
+			now = time.time()
+			for name, entry in batch:
+				if now >= entry["deadline"]:
+					self._finish(name, None, TimeoutError("Hết thời gian chờ media generation"))
+
+			with self._cond:
+				for name, entry in batch:
+					if name in self._pending:
+						entry["last_check"] = now
+						entry["next_check"] = now + timing.next_delay(entry["model_key"], now - entry["started"], self.interval_sec)
+
+	def _check_batch(self, token: str, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+		payload = {
+			"operations": [
+				{"operation": {"name": name}, "sceneId": entry["scene_id"]}
+				for name, entry in batch
+			]
+		}
+		try:
+			# Tick sau sẽ tự poll lại nên không retry trong cùng một tick
+			resp = http_post_json(CHECK_URL, payload, token, self.proxy, max_retries=1, account_key=self.account_key)
+		except requests.HTTPError as e:
+			status_code = e.response.status_code if e.response is not None else None
+			if status_code == 401 and self.token_provider is not None:
+				# Token đã bị bỏ khỏi cache, tick sau sẽ lấy token mới
+				print(f"⚠ Token hết hạn khi poll ({self.account_key}), sẽ thử lại với token mới")
+			elif status_code in (401, 403):
+				# Token hỏng thì mọi job trong batch đều không thể poll tiếp
+				for name, _ in batch:
+					self._finish(name, None, e)
+			else:
+				print(f"⚠ Lỗi poll batch {len(batch)} operations: {e}")
+			return
+		except Exception as e:
+			print(f"⚠ Lỗi poll batch {len(batch)} operations: {e}")
+			return
+
+		ops_by_name = {}
+		ops_by_scene = {}
+		for op in resp.get("operations", []):
+			ops_by_name[op.get("operation", {}).get("name")] = op
+			ops_by_scene[op.get("sceneId")] = op
+
+		for name, entry in batch:
+			op = ops_by_name.get(name) or ops_by_scene.get(entry["scene_id"])
+			if op is None:
+				continue
+			status = op.get("status")
+			if status != entry["last_status"]:
+				print(f"Status [{entry['scene_id'][:8]}]: {status}")
+				entry["last_status"] = status
+			# Trả về đúng dạng của poll_status để các hàm extract_* dùng được
+			status_json = {"operations": [op]}
+			if status == STATUS_SUCCESSFUL:
+				if entry["record_timing"]:
+					get_poll_timing().record(entry["model_key"], completion_estimate(entry["started"], entry["last_check"], time.time()))
+				self._finish(name, status_json, None)
+			elif status in STATUS_FAILED:
+				self._finish(name, None, RuntimeError(f"Media generation thất bại: {json.dumps(status_json, ensure_ascii=False)}"))
+
+
+_status_pollers: Dict[Tuple[str, str], BatchStatusPoller] = {}
+_status_pollers_lock = threading.Lock()
+
+
+def get_status_poller(account_key: str, proxy: Optional[Dict[str, str]] = None, interval_sec: float = 2.0, token_provider=None) -> BatchStatusPoller:
+	"""Lấy poller dùng chung của account, tạo mới nếu chưa có"""
+	key = (account_key, _proxy_key(proxy))
+	with _status_pollers_lock:
+		poller = _status_pollers.get(key)
+		if poller is None:
+			poller = BatchStatusPoller(account_key, proxy, interval_sec, token_provider=token_provider)
+			_status_pollers[key] = poller
+		return poller
+
+
+def stop_status_pollers() -> None:
+	"""Dừng tất cả poller dùng chung (gọi khi kết thúc lượt chạy)"""
+	with _status_pollers_lock:
+		pollers = list(_status_pollers.values())
+		_status_pollers.clear()
+	for poller in pollers:
+		poller.stop()
+
+
 def _extract_media_id_from_operation(operation: Dict[str, Any], search_paths: List[List[str]], debug_prefix: str) -> Optional[str]:
 	"""Hàm chung để trích xuất mediaId từ operation với các đường dẫn tìm kiếm"""
 	media_id = None
@@ -824,27 +1648,29 @@ def _load_config() -> Dict[str, Any]:
 		return {}
 
 
-def fetch_access_token_from_session(cookie_header_value: str, proxy: Optional[Dict[str, str]] = None) -> Optional[str]:
-	# Gọi GET tới SESSION_URL kèm Cookie để lấy access_token
+def fetch_session_token(cookie_header_value: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> Tuple[Optional[str], Optional[float]]:
+	"""Gọi GET tới SESSION_URL kèm Cookie, trả về (access_token, thời điểm hết hạn dạng timestamp)"""
 	headers = get_browser_headers()
 	headers.update({
 		"Accept": "application/json",
 		"Cookie": cookie_header_value,
 	})
 	
-	# Thêm delay ngẫu nhiên để giả lập hành vi người dùng thật
-	add_random_delay(0.2, 0.8)
-	
-	session = requests.Session()
-	session.headers.update(headers)
+	account_key = resolve_account_key(account_key, cookie_header_value)
+	session = get_http_session(account_key, proxy)
 	session_config = get_session_config()
 	
-	resp = session.get(SESSION_URL, proxies=proxy, **session_config)
-	resp.raise_for_status()
+	def attempt_get(attempt: int) -> requests.Response:
+		get_rate_limiter(account_key).acquire()
+		resp = session.get(SESSION_URL, headers=headers, proxies=proxy, **session_config)
+		resp.raise_for_status()
+		return resp
+	
+	resp = get_retry_policy().call(attempt_get, label="Lấy session token")
 	try:
 		data = resp.json()
 	except ValueError:
-		return None
+		return None, None
 	
 	# Hiển thị thông tin user và thời gian hết hạn
 	user_info = data.get("user", {})
@@ -854,10 +1680,12 @@ def fetch_access_token_from_session(cookie_header_value: str, proxy: Optional[Di
 	
 	# Chuyển đổi thời gian hết hạn sang giờ Việt Nam
 	expires_vn = "Unknown"
+	expires_at = None
 	if expires != "Unknown":
 		try:
 			# Parse thời gian UTC
 			utc_time = datetime.fromisoformat(expires.replace('Z', '+00:00'))
+			expires_at = utc_time.timestamp()
 			# Chuyển sang giờ Việt Nam (UTC+7)
 			vn_time = utc_time.astimezone(timezone(timedelta(hours=7)))
 			# Format theo định dạng Việt Nam
@@ -872,8 +1700,127 @@ def fetch_access_token_from_session(cookie_header_value: str, proxy: Optional[Di
 	
 	token = data.get("access_token")
 	if isinstance(token, str) and token:
+		return token, expires_at
+	return None, expires_at
+
+
+def fetch_access_token_from_session(cookie_header_value: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None) -> Optional[str]:
+	# Gọi GET tới SESSION_URL kèm Cookie để lấy access_token (không qua cache)
+	token, _ = fetch_session_token(cookie_header_value, proxy, account_key)
+	return token
+
+
+# Cache access token theo cookie: cả lượt chạy chỉ gọi SESSION_URL khi token sắp hết hạn
+TOKEN_CACHE_MAX_TTL = 45 * 60  # access_token thường sống ~1 giờ, không dựa hoàn toàn vào "expires" của session
+TOKEN_REFRESH_MARGIN = 5 * 60  # Làm mới nền khi còn ít hơn khoảng này
+
+
+class AccessTokenCache:
+	"""Cache access token theo cookie, mỗi account chỉ một thread được refresh tại một thời điểm"""
+
+	def __init__(self, max_ttl: float = TOKEN_CACHE_MAX_TTL, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+		self.max_ttl = max_ttl
+		self.refresh_margin = refresh_margin
+		self._entries: Dict[str, Dict[str, Any]] = {}  # cookie hash -> {"token", "expires_at", "fetched_at"}
+		self._token_index: Dict[str, str] = {}  # token -> cookie hash (để invalidate khi gặp 401)
+		self._key_locks: Dict[str, threading.Lock] = {}
+		self._refreshing = set()
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def _key(cookie_header_value: str) -> str:
+		return hashlib.sha256(cookie_header_value.encode("utf-8")).hexdigest()
+
+	def _key_lock(self, key: str) -> threading.Lock:
+		with self._lock:
+			lock = self._key_locks.get(key)
+			if lock is None:
+				lock = threading.Lock()
+				self._key_locks[key] = lock
+			return lock
+
+	def get_token(self, cookie_header_value: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None, force_refresh: bool = False) -> Optional[str]:
+		"""Lấy token từ cache, chỉ gọi SESSION_URL khi chưa có / đã hết hạn / bị yêu cầu refresh"""
+		key = self._key(cookie_header_value)
+		requested_at = time.time()
+		with self._lock:
+			entry = self._entries.get(key)
+		if entry and not force_refresh and requested_at < entry["expires_at"]:
+			if requested_at >= entry["expires_at"] - self.refresh_margin:
+				self._refresh_in_background(key, cookie_header_value, proxy, account_key)
+			return entry["token"]
+
+		# Single-flight: các thread khác chờ lock rồi dùng luôn token vừa được làm mới
+		with self._key_lock(key):
+			with self._lock:
+				entry = self._entries.get(key)
+			if entry and time.time() < entry["expires_at"] and (not force_refresh or entry["fetched_at"] >= requested_at):
+				return entry["token"]
+			return self._refresh(key, cookie_header_value, proxy, account_key)
+
+	def _refresh(self, key: str, cookie_header_value: str, proxy: Optional[Dict[str, str]], account_key: Optional[str]) -> Optional[str]:
+		token, expires_at = fetch_session_token(cookie_header_value, proxy, account_key)
+		now = time.time()
+		with self._lock:
+			old_entry = self._entries.pop(key, None)
+			if old_entry:
+				self._token_index.pop(old_entry["token"], None)
+			if not token:
+				return None
+			ttl_limit = now + self.max_ttl
+			self._entries[key] = {
+				"token": token,
+				"expires_at": min(expires_at, ttl_limit) if expires_at else ttl_limit,
+				"fetched_at": now,
+			}
+			self._token_index[token] = key
 		return token
-	return None
+
+	def _refresh_in_background(self, key: str, cookie_header_value: str, proxy: Optional[Dict[str, str]], account_key: Optional[str]) -> None:
+		with self._lock:
+			if key in self._refreshing:
+				return
+			self._refreshing.add(key)
+
+		def _worker():
+			try:
+				with self._key_lock(key):
+					self._refresh(key, cookie_header_value, proxy, account_key)
+			except Exception as e:
+				print(f"⚠ Lỗi làm mới token nền: {e}")
+			finally:
+				with self._lock:
+					self._refreshing.discard(key)
+
+		threading.Thread(target=_worker, name="token-refresh", daemon=True).start()
+
+	def invalidate(self, cookie_header_value: Optional[str] = None, token: Optional[str] = None) -> None:
+		"""Xóa token khỏi cache (theo cookie hoặc theo chính token, ví dụ khi API trả 401)"""
+		with self._lock:
+			key = self._key(cookie_header_value) if cookie_header_value else self._token_index.get(token or "")
+			if not key:
+				return
+			entry = self._entries.pop(key, None)
+			if entry:
+				self._token_index.pop(entry["token"], None)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._entries.clear()
+			self._token_index.clear()
+
+
+_access_token_cache = AccessTokenCache()
+
+
+def get_access_token(cookie_header_value: str, proxy: Optional[Dict[str, str]] = None, account_key: Optional[str] = None, force_refresh: bool = False) -> Optional[str]:
+	"""Lấy access token của account qua cache dùng chung"""
+	return _access_token_cache.get_token(cookie_header_value, proxy, account_key, force_refresh)
+
+
+def invalidate_access_token(cookie_header_value: Optional[str] = None, token: Optional[str] = None) -> None:
+	"""Bỏ token đã cache để lần sau lấy token mới"""
+	_access_token_cache.invalidate(cookie_header_value, token)
 
 
 def sanitize_filename(filename: str) -> str:
@@ -910,9 +1857,12 @@ def create_short_filename(stt: int, prompt: str) -> str:
 
 
 def read_excel_prompts(excel_file: str, require_image: bool = False) -> List[Tuple[int, str, Optional[str]]]:
-	"""Đọc file Excel và trả về danh sách (STT, PROMPT, IMAGE_PATH)"""
+	"""Đọc file Excel (hoặc CSV cùng cấu trúc cột) và trả về danh sách (STT, PROMPT, IMAGE_PATH)"""
 	try:
-		df = pd.read_excel(excel_file)
+		if excel_file.lower().endswith(".csv"):
+			df = pd.read_csv(excel_file)
+		else:
+			df = pd.read_excel(excel_file)
 		
 		# Kiểm tra số cột
 		if require_image:
@@ -0,0 +1,758 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple, Callable
+import requests
+
+try:
+	import aiohttp
+	AIOHTTP_AVAILABLE = True
+except ImportError:
+	AIOHTTP_AVAILABLE = False
+
+from api import (
+	CHECK_URL, GENERATE_URL, GENERATE_IMAGE_URL, UPSCALE_URL, UPLOAD_IMAGE_URL,
+	STATUS_SUCCESSFUL, STATUS_FAILED, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_MAX_ATTEMPTS, IMAGE_UPLOAD_ASPECT_RATIO,
+	ERROR_AUTH, ERROR_PERMANENT, ERROR_RETRYABLE, AccountAuthError, StreamingBase64JsonBody, _EncodedVideoStreamDecoder,
+	_build_generate_request, _build_upscale_payload, _load_config, _resolve_seed,
+	classify_error, completion_estimate, create_short_filename, delete_media, extract_fife_url, extract_op_name,
+	extract_upscale_media_id, extract_video_media_id, get_access_token, get_api_headers,
+	get_browser_headers, get_image_mime_type, get_rate_limiter, get_retry_policy,
+	invalidate_access_token, resolve_account_key, upscale_model_key,
+)
+from pipeline import GENERATE_TIMEOUT_SEC, UPSCALE_TIMEOUT_SEC, STOPPED_MESSAGE, job_output_path, parse_proxy, select_model_key, verify_output_video
+from upload_cache import UploadCache, is_media_missing_error
+from poll_timing import get_poll_timing
+from job_journal import (
+	JobJournal, STATE_QUEUED, STATE_UPLOADED, STATE_SUBMITTED, STATE_GENERATED,
+	STATE_UPSCALE_SUBMITTED, STATE_DONE, STATE_FAILED,
+)
+
+
+# Client async: mọi video của một account chạy trên một event loop, không cần một thread cho mỗi video
+DEFAULT_MAX_CONNECTIONS = 100  # Số kết nối tối đa trong pool của một account
+DEFAULT_POLL_INTERVAL = 2.0
+POLL_MAX_BATCH = 50
+
+
+def async_client_enabled() -> bool:
+	"""Bật client async bằng "async_client": {"enabled": true} trong config.json (cần cài aiohttp)"""
+	return AIOHTTP_AVAILABLE and bool(_load_config().get("async_client", {}).get("enabled", False))
+
+
+class _AsyncResponseInfo:
+	"""Thông tin response lỗi, cùng thuộc tính với requests.Response mà classify_error/get_retry_after dùng"""
+
+	def __init__(self, status_code: int, headers: Dict[str, str], text: str):
+		self.status_code = status_code
+		self.headers = headers
+		self.text = text
+
+
+class AsyncHTTPError(requests.HTTPError):
+	"""Lỗi HTTP của client async; kế thừa requests.HTTPError để phân loại lỗi như client sync"""
+
+
+def _classify_async_error(error: BaseException) -> str:
+	if AIOHTTP_AVAILABLE and isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+		return ERROR_RETRYABLE
+	if isinstance(error, asyncio.TimeoutError):
+		return ERROR_RETRYABLE
+	return classify_error(error)
+
+
+_BODY_END = object()
+
+
+async def _iterate_body(body: StreamingBase64JsonBody):
+	# Đọc file + base64 từng chunk trong executor để upload không chặn các coroutine khác trên loop
+	loop = asyncio.get_running_loop()
+	chunks = iter(body)
+	try:
+		while True:
+			chunk = await loop.run_in_executor(None, next, chunks, _BODY_END)
+			if chunk is _BODY_END:
+				break
+			yield chunk
+	finally:
+		chunks.close()
+
+
+class AsyncApiClient:
+	"""Bản coroutine của các hàm trong api.py cho một account: một connection pool, retry/giới hạn tốc độ dùng chung với client sync"""
+
+	def __init__(self, account_key: Optional[str] = None, proxy: Optional[Dict[str, str]] = None, max_connections: int = DEFAULT_MAX_CONNECTIONS, poll_interval: float = DEFAULT_POLL_INTERVAL, token_provider: Optional[Callable[[], Optional[str]]] = None):
+		if not AIOHTTP_AVAILABLE:
+			raise RuntimeError("Cần cài aiohttp để dùng client async: pip install aiohttp")
+		self.account_key = account_key
+		self.proxy = proxy
+		self.max_connections = max_connections
+		self.poll_interval = poll_interval
+		self.token_provider = token_provider  # Hàm sync trả về token mới nhất cho poller, tùy chọn
+		self._session: Optional["aiohttp.ClientSession"] = None
+		self._pending_status: Dict[str, Dict[str, Any]] = {}  # operation_name -> {"scene_id", "future", "deadline"}
+		self._poll_token: Optional[str] = None
+		self._poll_task: Optional[asyncio.Task] = None
+		self._poll_wakeup: Optional[asyncio.Event] = None
+
+	async def __aenter__(self) -> "AsyncApiClient":
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb) -> None:
+		await self.close()
+
+	def _get_session(self) -> "aiohttp.ClientSession":
+		if self._session is None or self._session.closed:
+			connector = aiohttp.TCPConnector(limit=self.max_connections, ssl=False)
+			timeout = aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=300)
+			self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+		return self._session
+
+	async def close(self) -> None:
+		if self._poll_task is not None and not self._poll_task.done():
+			self._poll_task.cancel()
+		for entry in list(self._pending_status.values()):
+			if not entry["future"].done():
+				entry["future"].set_exception(RuntimeError("Client đã đóng"))
+		self._pending_status.clear()
+		if self._session is not None and not self._session.closed:
+			await self._session.close()
+		self._session = None
+
+	def _proxy_url(self, attempt: int = 0) -> Optional[str]:
+		# Giống client sync: lần thử lại thì bỏ proxy
+		if not self.proxy or attempt > 0:
+			return None
+		return self.proxy.get("https") or self.proxy.get("http")
+
+	async def _pace(self, credential: Optional[str]) -> None:
+		wait = get_rate_limiter(resolve_account_key(self.account_key, credential)).reserve()
+		if wait > 0:
+			await asyncio.sleep(wait)
+
+	@staticmethod
+	async def _raise_for_status(resp: "aiohttp.ClientResponse") -> None:
+		if resp.status >= 400:
+			text = await resp.text(errors="replace")
+			raise AsyncHTTPError(
+				f"{resp.status} Error for url: {resp.url}",
+				response=_AsyncResponseInfo(resp.status, dict(resp.headers), text)
+			)
+
+	async def _retry(self, func: Callable[[int], Any], label: str, max_attempts: Optional[int] = None, classify: Callable[[BaseException], str] = _classify_async_error, token: Optional[str] = None) -> Any:
+		"""Bản async của RetryPolicy.call: cùng cấu hình, cùng phân loại lỗi, chờ bằng asyncio.sleep"""
+		policy = get_retry_policy()
+		attempts = max_attempts if max_attempts is not None else policy.max_attempts
+		if not policy.enabled:
+			attempts = 1
+		attempts = max(1, attempts)
+
+		for attempt in range(attempts):
+			try:
+				return await func(attempt)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				kind = classify(e)
+				response = getattr(e, "response", None)
+				if token and kind == ERROR_AUTH and response is not None and response.status_code == 401:
+					invalidate_access_token(token=token)
+				if kind in (ERROR_AUTH, ERROR_PERMANENT):
+					print(f"❌ {label} lỗi {kind}, không thử lại: {str(e)[:200]}")
+					raise
+				if attempt == attempts - 1:
+					print(f"❌ {label}: đã thử {attempts} lần nhưng vẫn lỗi: {str(e)[:200]}")
+					raise
+				delay = policy.delay_for(e, kind, attempt)
+				print(f"🔄 {label} lỗi {kind} (lần {attempt + 1}/{attempts}): {str(e)[:100]}")
+				print(f"⏳ Thử lại sau {delay:.1f} giây...")
+				await asyncio.sleep(delay)
+
+	async def post_json(self, url: str, payload: Any, token: str, max_attempts: Optional[int] = None) -> Dict[str, Any]:
+		"""POST JSON (dict) hoặc StreamingBase64JsonBody và trả về JSON"""
+		headers = get_api_headers(token)
+
+		async def attempt_post(attempt: int) -> Dict[str, Any]:
+			await self._pace(token)
+			if isinstance(payload, StreamingBase64JsonBody):
+				data = _iterate_body(payload)
+				request_headers = dict(headers, **{"Content-Length": str(len(payload))})
+			else:
+				data = json.dumps(payload)
+				request_headers = headers
+			async with self._get_session().post(url, data=data, headers=request_headers, proxy=self._proxy_url(attempt)) as resp:
+				await self._raise_for_status(resp)
+				return await resp.json(content_type=None)
+
+		return await self._retry(attempt_post, f"POST {url.rsplit('/', 1)[-1]}", max_attempts, token=token)
+
+	async def generate_video(self, token: str, prompt: str, project_id: str, model_key: str = "veo_3_0_t2v_fast_ultra", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None) -> Tuple[Dict[str, Any], str]:
+		return await self._generate(GENERATE_URL, token, prompt, project_id, model_key, aspect_ratio, seed)
+
+	async def generate_video_from_image(self, token: str, prompt: str, media_id: str, project_id: str, model_key: str = "veo_3_i2v_s_fast_ultra", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None) -> Tuple[Dict[str, Any], str]:
+		return await self._generate(GENERATE_IMAGE_URL, token, prompt, project_id, model_key, aspect_ratio, seed, media_id)
+
+	async def _generate(self, url: str, token: str, prompt: str, project_id: str, model_key: str, aspect_ratio: str, seed: Optional[int], media_id: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+		scene_id = str(uuid.uuid4())
+		payload = {
+			"clientContext": {
+				"projectId": project_id,
+				"tool": "PINHOLE",
+				"userPaygateTier": "PAYGATE_TIER_TWO",
+			},
+			"requests": [_build_generate_request(prompt, model_key, aspect_ratio, _resolve_seed(seed), scene_id, media_id)]
+		}
+		response = await self.post_json(url, payload, token)
+		return response, scene_id
+
+	async def upscale_video(self, token: str, video_media_id: str, project_id: str, scale: str = "1080p", aspect_ratio: str = "VIDEO_ASPECT_RATIO_LANDSCAPE", seed: Optional[int] = None) -> Tuple[Dict[str, Any], str]:
+		scene_id = str(uuid.uuid4())
+		payload = _build_upscale_payload(video_media_id, scale, aspect_ratio, _resolve_seed(seed), scene_id)
+		response = await self.post_json(UPSCALE_URL, payload, token)
+		return response, scene_id
+
+	async def upload_image(self, token: str, image_path: str) -> str:
+		"""Upload image (body stream base64 từng chunk) và trả về mediaGenerationId"""
+		if not os.path.exists(image_path):
+			raise FileNotFoundError(f"Không tìm thấy file image: {image_path}")
+		envelope = {
+			"imageInput": {
+				"aspectRatio": IMAGE_UPLOAD_ASPECT_RATIO,
+				"isUserUploaded": True,
+				"mimeType": get_image_mime_type(image_path),
+				"rawImageBytes": StreamingBase64JsonBody.PLACEHOLDER
+			},
+			"clientContext": {
+				"sessionId": f";{int(time.time() * 1000)}",
+				"tool": "ASSET_MANAGER"
+			}
+		}
+		response = await self.post_json(UPLOAD_IMAGE_URL, StreamingBase64JsonBody(envelope, image_path), token)
+		media_gen_id = response.get("mediaGenerationId", {}).get("mediaGenerationId")
+		if not media_gen_id:
+			raise ValueError("Không tìm thấy mediaGenerationId trong phản hồi upload")
+		return media_gen_id
+
+	async def poll_status(self, token: str, operation_name: str, scene_id: str, interval_sec: float = 3.0, timeout_sec: int = 1200, model_key: Optional[str] = None) -> Dict[str, Any]:
+		"""Poll một operation tới khi xong (cùng kết quả/exception như api.poll_status)"""
+		loop = asyncio.get_running_loop()
+		timing = get_poll_timing()
+		deadline = loop.time() + timeout_sec
+		started = last_check = time.time()
+		last_status = None
+		await asyncio.sleep(timing.next_delay(model_key, 0, interval_sec))
+		while loop.time() < deadline:
+			payload = {"operations": [{"operation": {"name": operation_name}, "sceneId": scene_id}]}
+			resp = await self.post_json(CHECK_URL, payload, token)
+			ops = resp.get("operations", [])
+			if not ops:
+				raise ValueError("Phản hồi status không có operations")
+			status = ops[0].get("status")
+			if status != last_status:
+				print(f"Status: {status}")
+				last_status = status
+			now = time.time()
+			if status == STATUS_SUCCESSFUL:
+				timing.record(model_key, completion_estimate(started, last_check, now))
+				return resp
+			if status in STATUS_FAILED:
+				raise RuntimeError(f"Media generation thất bại: {json.dumps(resp, ensure_ascii=False)}")
+			last_check = now
+			await asyncio.sleep(timing.next_delay(model_key, now - started, interval_sec))
+		raise TimeoutError("Hết thời gian chờ media generation")
+
+	async def wait_status(self, token: str, operation_name: str, scene_id: str, timeout_sec: float = 1200, model_key: Optional[str] = None, started_at: Optional[float] = None) -> Dict[str, Any]:
+		"""Chờ operation xong qua poller batch của client: các operation tới hẹn được check chung một request
+
+		model_key/started_at: như BatchStatusPoller.watch, để hẹn lần check theo thời gian hoàn thành đã quan sát
+		(operation resume có started_at không được ghi vào thống kê)
+		"""
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		now = time.time()
+		started = min(started_at, now) if started_at else now
+		self._poll_token = token
+		self._pending_status[operation_name] = {
+			"scene_id": scene_id,
+			"future": future,
+			"deadline": now + timeout_sec,
+			"last_status": None,
+			"model_key": model_key,
+			"started": started,
+			"last_check": started,
+			"next_check": now + get_poll_timing().next_delay(model_key, now - started, self.poll_interval),
+			"record_timing": started_at is None,
+		}
+		if self._poll_wakeup is None:
+			self._poll_wakeup = asyncio.Event()
+		self._poll_wakeup.set()
+		if self._poll_task is None or self._poll_task.done():
+			self._poll_task = asyncio.ensure_future(self._poll_loop())
+		try:
+			return await future
+		finally:
+			# Job bị cancel thì bỏ operation khỏi batch
+			self._pending_status.pop(operation_name, None)
+
+	async def _poll_loop(self) -> None:
+		loop = asyncio.get_running_loop()
+		timing = get_poll_timing()
+		while self._pending_status:
+			# Chỉ check các operation đã tới hẹn; operation mới đăng ký sẽ đánh thức vòng lặp để hẹn lại
+			now = time.time()
+			batch = [
+				(name, entry) for name, entry in self._pending_status.items()
+				if entry["next_check"] <= now or entry["deadline"] <= now
+			]
+			if not batch:
+				wake_at = min(min(e["next_check"], e["deadline"]) for e in self._pending_status.values())
+				self._poll_wakeup.clear()
+				try:
+					await asyncio.wait_for(self._poll_wakeup.wait(), wake_at - now)
+				except asyncio.TimeoutError:
+					pass
+				continue
+
+			token = self._poll_token
+			if self.token_provider is not None:
+				try:
+					token = await loop.run_in_executor(None, self.token_provider) or token
+				except Exception as e:
+					print(f"⚠ Không lấy được token mới cho poller {self.account_key}: {e}")
+
+			for i in range(0, len(batch), POLL_MAX_BATCH):
+				await self._check_status_batch(token, batch[i:i + POLL_MAX_BATCH])
+
+			now = time.time()
+			for name, entry in batch:
+				if now >= entry["deadline"] and not entry["future"].done():
+					entry["future"].set_exception(TimeoutError("Hết thời gian chờ media generation"))
+				entry["last_check"] = now
+				entry["next_check"] = now + timing.next_delay(entry["model_key"], now - entry["started"], self.poll_interval)
+
+	async def _check_status_batch(self, token: str, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+		payload = {
+			"operations": [
+				{"operation": {"name": name}, "sceneId": entry["scene_id"]}
+				for name, entry in batch
+			]
+		}
+		try:
+			# Tick sau sẽ tự poll lại nên không retry trong cùng một tick
+			resp = await self.post_json(CHECK_URL, payload, token, max_attempts=1)
+		except asyncio.CancelledError:
+			raise
+		except requests.HTTPError as e:
+			status_code = e.response.status_code if e.response is not None else None
+			if status_code == 401 and self.token_provider is not None:
+				print(f"⚠ Token hết hạn khi poll ({self.account_key}), sẽ thử lại với token mới")
+			elif status_code in (401, 403):
+				for _, entry in batch:
+					if not entry["future"].done():
+						entry["future"].set_exception(e)
+			else:
+				print(f"⚠ Lỗi poll batch {len(batch)} operations: {e}")
+			return
+		except Exception as e:
+			print(f"⚠ Lỗi poll batch {len(batch)} operations: {e}")
+			return
+
+		ops_by_name = {}
+		ops_by_scene = {}
+		for op in resp.get("operations", []):
+			ops_by_name[op.get("operation", {}).get("name")] = op
+			ops_by_scene[op.get("sceneId")] = op
+
+		for name, entry in batch:
+			op = ops_by_name.get(name) or ops_by_scene.get(entry["scene_id"])
+			if op is None or entry["future"].done():
+				continue
+			status = op.get("status")
+			if status != entry["last_status"]:
+				print(f"Status [{entry['scene_id'][:8]}]: {status}")
+				entry["last_status"] = status
+			status_json = {"operations": [op]}
+			if status == STATUS_SUCCESSFUL:
+				if entry["record_timing"]:
+					get_poll_timing().record(entry["model_key"], completion_estimate(entry["started"], entry["last_check"], time.time()))
+				entry["future"].set_result(status_json)
+			elif status in STATUS_FAILED:
+				entry["future"].set_exception(RuntimeError(f"Media generation thất bại: {json.dumps(status_json, ensure_ascii=False)}"))
+
+	async def get_encoded_video(self, token: str, media_id: str) -> Optional[str]:
+		"""Lấy encodedVideo từ mediaId sau khi upscale"""
+		url = f"https://aisandbox-pa.googleapis.com/v1/media/{media_id}?clientContext.tool=PINHOLE"
+		headers = get_api_headers(token)
+
+		async def attempt_get(attempt: int) -> Dict[str, Any]:
+			await self._pace(token)
+			async with self._get_session().get(url, headers=headers, proxy=self._proxy_url()) as resp:
+				await self._raise_for_status(resp)
+				return await resp.json(content_type=None)
+
+		try:
+			data = await self._retry(attempt_get, "Lấy encodedVideo", token=token)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			print(f"❌ Lỗi lấy encodedVideo: {e}")
+			return None
+		return data.get("video", {}).get("encodedVideo")
+
+	async def download_encoded_video_stream(self, token: str, media_id: str, output_path: str, chunk_size: int = 256 * 1024) -> int:
+		"""Stream encodedVideo và decode base64 thẳng ra file. Trả về số byte đã ghi"""
+		url = f"https://aisandbox-pa.googleapis.com/v1/media/{media_id}?clientContext.tool=PINHOLE"
+		headers = get_api_headers(token)
+		temp_path = output_path + ".part"
+
+		async def attempt_stream(attempt: int) -> int:
+			await self._pace(token)
+			async with self._get_session().get(url, headers=headers, proxy=self._proxy_url()) as resp:
+				await self._raise_for_status(resp)
+				with open(temp_path, "wb") as f:
+					decoder = _EncodedVideoStreamDecoder(f)
+					async for chunk in resp.content.iter_chunked(chunk_size):
+						decoder.feed(chunk)
+						if decoder.done:
+							break
+			if not decoder.done:
+				raise ValueError("Không tìm thấy encodedVideo trong response")
+			os.replace(temp_path, output_path)
+			return decoder.bytes_written
+
+		try:
+			return await self._retry(attempt_stream, "Tải encodedVideo", token=token)
+		except BaseException:
+			if os.path.exists(temp_path):
+				try:
+					os.remove(temp_path)
+				except OSError:
+					pass
+			raise
+
+	async def http_download_mp4(self, url: str, output_path: str, max_attempts: int = DOWNLOAD_MAX_ATTEMPTS) -> None:
+		"""Tải mp4 qua file .part rồi rename; lỗi giữa chừng thì resume bằng Range từ số byte đã có"""
+		headers = get_browser_headers()
+		headers["Accept-Encoding"] = "identity"
+		temp_path = output_path + ".part"
+
+		async def attempt_download(attempt: int) -> None:
+			offset = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
+			request_headers = dict(headers)
+			if offset:
+				request_headers["Range"] = f"bytes={offset}-"
+			async with self._get_session().get(url, headers=request_headers, proxy=self._proxy_url()) as resp:
+				await self._raise_for_status(resp)
+				if resp.status != 206:
+					offset = 0  # Server bỏ qua Range, tải lại từ đầu
+				total_size = None
+				content_range = resp.headers.get("Content-Range", "")
+				if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+					total_size = int(content_range.rsplit("/", 1)[1])
+				elif resp.status == 200 and resp.headers.get("Content-Length", "").isdigit():
+					total_size = int(resp.headers["Content-Length"])
+				with open(temp_path, "ab" if offset else "wb") as f:
+					async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+						f.write(chunk)
+
+			size = os.path.getsize(temp_path)
+			if total_size and size != total_size:
+				if size > total_size:
+					os.remove(temp_path)
+				raise IOError(f"Kích thước file không khớp: {size}/{total_size} bytes")
+			os.replace(temp_path, output_path)
+
+		def classify(error: BaseException) -> str:
+			# Tải thiếu/đứt giữa chừng thì resume được; link hết hạn (403/404) thì không
+			if not isinstance(error, requests.RequestException) and isinstance(error, IOError):
+				return ERROR_RETRYABLE
+			return _classify_async_error(error)
+
+		await self._retry(attempt_download, "Tải video", max_attempts, classify)
+
+
+class AsyncVideoJobRunner:
+	"""Chạy toàn bộ lượt tạo video trên một event loop: hàng đợi chung, mỗi account giữ tối đa
+	`max_in_flight` video, account lỗi xác thực thì trả job về hàng đợi cho account khác"""
+
+	def __init__(self, config: Dict[str, Any], accounts: List[Dict[str, Any]], max_in_flight: int, upload_cache: Optional[UploadCache] = None, on_status: Optional[Callable[[str], None]] = None, on_result: Optional[Callable[[str, Tuple], None]] = None, journal: Optional[JobJournal] = None):
+		self.config = config
+		self.journal = journal
+		self.accounts = accounts
+		self.max_in_flight = max(1, max_in_flight)
+		self.upload_cache = upload_cache or UploadCache()
+		self.on_status = on_status
+		self.on_result = on_result  # on_result(account_name, (stt, prompt, success, result))
+		self.retired_accounts = set()
+		self._loop: Optional[asyncio.AbstractEventLoop] = None
+		self._tasks: List[asyncio.Task] = []
+		self._stopped = threading.Event()
+		self._in_flight = 0  # Số job đang chạy (có thể bị trả về hàng đợi nếu account lỗi xác thực)
+		self._work_changed: Optional[asyncio.Condition] = None
+
+	def _status(self, message: str) -> None:
+		if self.on_status:
+			try:
+				self.on_status(message)
+			except Exception:
+				pass
+
+	def _record(self, job_key: Optional[str], stt: int, state: str, detail: Optional[str] = None, **fields) -> None:
+		if self.journal is None or job_key is None:
+			return
+		try:
+			self.journal.record(job_key, state, detail, **fields)
+		except Exception as e:
+			print(f"⚠ Không ghi được journal STT {stt}: {e}")
+
+	def run(self, prompts: List[Tuple[int, str, Optional[str]]], resume_queues: Optional[Dict[str, deque]] = None) -> List[Tuple]:
+		"""Chạy đồng bộ (gọi từ thread xử lý), trả về danh sách kết quả.
+
+		resume_queues: {account_name: deque(prompt)} các job còn operation dở trên account đó (từ journal)
+		"""
+		return asyncio.run(self.run_async(prompts, resume_queues))
+
+	def stop(self) -> None:
+		"""Dừng từ thread khác: cancel mọi job đang chạy"""
+		self._stopped.set()
+		if self._loop is not None:
+			self._loop.call_soon_threadsafe(self._cancel_all)
+
+	def _cancel_all(self) -> None:
+		for task in self._tasks:
+			task.cancel()
+
+	async def run_async(self, prompts: List[Tuple[int, str, Optional[str]]], resume_queues: Optional[Dict[str, deque]] = None) -> List[Tuple]:
+		self._loop = asyncio.get_running_loop()
+		queue = deque(prompts)
+		self._resume_queues = dict(resume_queues or {})
+		self._in_flight = 0
+		self._work_changed = asyncio.Condition()
+		results: List[Tuple] = []
+		clients = {}
+		try:
+			for account in self.accounts:
+				account_name = account.get("name", "Unknown")
+				cookie = account.get("cookie")
+				clients[account_name] = AsyncApiClient(
+					account_name, parse_proxy(account.get("proxy", "")),
+					token_provider=lambda cookie=cookie, account_name=account_name: get_access_token(cookie, account_key=account_name)
+				)
+				for _ in range(self.max_in_flight):
+					self._tasks.append(asyncio.ensure_future(self._worker(account, clients[account_name], queue, results)))
+			await asyncio.gather(*self._tasks, return_exceptions=True)
+		finally:
+			for client in clients.values():
+				await client.close()
+
+		if queue and not self._stopped.is_set():
+			# Không còn account nào dùng được cho các job còn lại
+			while queue:
+				stt, prompt, image_path = queue.popleft()
+				results.append((stt, prompt, False, "Không còn tài khoản hợp lệ để xử lý"))
+		return results
+
+	def _has_pending_work(self) -> bool:
+		"""Còn job đang chạy hoặc job resume của account còn hoạt động: các job này có thể quay lại hàng đợi chung"""
+		if self._in_flight:
+			return True
+		return any(resume_queue for name, resume_queue in self._resume_queues.items() if name not in self.retired_accounts)
+
+	async def _next_job(self, account_name: str, queue: deque) -> Optional[Tuple[int, str, Optional[str]]]:
+		"""Lấy job kế tiếp; hàng đợi rỗng nhưng còn job đang chạy thì chờ thay vì thoát ngay"""
+		async with self._work_changed:
+			while account_name not in self.retired_accounts and not self._stopped.is_set():
+				# Ưu tiên job còn operation dở của chính account này
+				resume_queue = self._resume_queues.get(account_name)
+				if resume_queue:
+					prompt_data = resume_queue.popleft()
+				elif queue:
+					prompt_data = queue.popleft()
+				elif self._has_pending_work():
+					await self._work_changed.wait()
+					continue
+				else:
+					return None
+				self._in_flight += 1
+				return prompt_data
+			return None
+
+	async def _job_done(self) -> None:
+		async with self._work_changed:
+			self._in_flight -= 1
+			self._work_changed.notify_all()
+
+	async def _worker(self, account: Dict[str, Any], client: AsyncApiClient, queue: deque, results: List[Tuple]) -> None:
+		account_name = account.get("name", "Unknown")
+		while True:
+			prompt_data = await self._next_job(account_name, queue)
+			if prompt_data is None:
+				return
+			stt, prompt, image_path = prompt_data
+			try:
+				result = await self._process_job(account, client, prompt_data)
+			except asyncio.CancelledError:
+				results.append((stt, prompt, False, STOPPED_MESSAGE))
+				self._in_flight -= 1
+				raise
+			except AccountAuthError as e:
+				# Account hết hiệu lực: ngừng nhận job mới, trả job về đầu hàng đợi cho worker của account khác
+				if account_name not in self.retired_accounts:
+					self.retired_accounts.add(account_name)
+					queue.extend(self._resume_queues.pop(account_name, []))
+					self._status(f"🔒 {account_name} lỗi xác thực, chuyển job còn lại sang tài khoản khác: {str(e)}")
+				queue.appendleft(prompt_data)
+				await self._job_done()
+				return
+			await self._job_done()
+			results.append(result)
+			if self.on_result:
+				self.on_result(account_name, result)
+
+	async def _process_job(self, account: Dict[str, Any], client: AsyncApiClient, prompt_data: Tuple[int, str, Optional[str]]) -> Tuple:
+		stt, prompt, image_path = prompt_data
+		account_name = account.get("name", "Unknown")
+		cookie = account.get("cookie")
+		loop = asyncio.get_running_loop()
+		output_filename = create_short_filename(stt, prompt)
+		output_path = job_output_path(self.config, stt, prompt)
+		media_id = None
+		cache_hit = False
+
+		job_key = None
+		resume = None
+		if self.journal is not None:
+			job_key = JobJournal.job_key(stt, prompt, output_path)
+			entry = self.journal.get(job_key)
+			if JobJournal.is_verified(entry):
+				self._status(f"STT {stt}: ⏭️ Đã có video hoàn chỉnh từ lần chạy trước, bỏ qua")
+				return (stt, prompt, True, output_filename)
+			if JobJournal.is_resumable(entry) and entry.get("account") == account_name:
+				resume = entry
+			else:
+				self._record(job_key, stt, STATE_QUEUED, stt=stt, prompt=prompt, image_path=image_path,
+							 account=account_name, output_path=output_path, error=None)
+		try:
+			if not cookie or cookie.startswith("YOUR_COOKIE_HERE"):
+				raise AccountAuthError(f"Cookie không hợp lệ cho {account_name}")
+			# Cache token là sync (single-flight giữa các thread), chạy trong executor để không chặn loop
+			token = await loop.run_in_executor(None, lambda: get_access_token(cookie, account_key=account_name))
+			if not token:
+				raise AccountAuthError(f"Không thể lấy token từ {account_name} - Cookie có thể đã hết hạn")
+
+			if resume is not None and resume["state"] == STATE_UPSCALE_SUBMITTED and resume.get("upscale_operation_name"):
+				# Operation upscale của lần chạy trước: chờ tiếp, lỗi thì không còn response generate để tải 720p
+				self._status(f"STT {stt}: ♻️ Tiếp tục chờ upscale từ lần chạy trước với {account_name}...")
+				if not await self._upscale(client, token, cookie, account_name, stt, None, output_path, job_key, (resume["upscale_operation_name"], resume["upscale_scene_id"], resume.get("updated_at"))):
+					raise RuntimeError("Upscale từ lần chạy trước thất bại")
+				return self._finish_job(job_key, stt, prompt, account_name, output_filename, output_path)
+
+			if resume is not None:
+				self._status(f"STT {stt}: ♻️ Tiếp tục chờ operation từ lần chạy trước với {account_name}...")
+				op_name, scene_id = resume["operation_name"], resume["scene_id"]
+				model_key, submitted_at = resume.get("model_key"), resume.get("updated_at")
+			elif image_path and os.path.exists(image_path):
+				self._status(f"STT {stt}: 📤 Uploading image với {account_name}...")
+				# Hash file + cache chạy trong executor; bản thân upload vẫn chạy trên event loop
+				media_id, cache_hit = await loop.run_in_executor(None, lambda: self.upload_cache.get_or_upload(
+					account_name, image_path, get_image_mime_type(image_path), IMAGE_UPLOAD_ASPECT_RATIO,
+					lambda: asyncio.run_coroutine_threadsafe(client.upload_image(token, image_path), loop).result()
+				))
+				if cache_hit:
+					self._status(f"STT {stt}: ♻️ Dùng lại image đã upload (cache)")
+				self._record(job_key, stt, STATE_UPLOADED, image_media_id=media_id)
+
+			if resume is None:
+				model_key = select_model_key(self.config["aspect_ratio"], media_id is not None)
+				self._status(f"STT {stt}: 🎬 Generating video với {account_name}...")
+				if media_id:
+					gen_resp, scene_id = await client.generate_video_from_image(token, prompt, media_id, self.config["project_id"], model_key, self.config["aspect_ratio"], self.config.get("seed"))
+				else:
+					gen_resp, scene_id = await client.generate_video(token, prompt, self.config["project_id"], model_key, self.config["aspect_ratio"], self.config.get("seed"))
+				op_name, submitted_at = extract_op_name(gen_resp), None
+				self._record(job_key, stt, STATE_SUBMITTED, operation_name=op_name, scene_id=scene_id, model_key=model_key)
+
+			self._status(f"STT {stt}: ⏳ Checking generation status với {account_name}...")
+			status_resp = await client.wait_status(token, op_name, scene_id, GENERATE_TIMEOUT_SEC, model_key, submitted_at)
+			self._record(job_key, stt, STATE_GENERATED)
+			self._status(f"STT {stt}: ✅ Status: SUCCESSFUL với {account_name} - đang tải...")
+
+			upscaled = False
+			if self.config.get("use_upscale", False):
+				upscaled = await self._upscale(client, token, cookie, account_name, stt, status_resp, output_path, job_key)
+			if not upscaled:
+				self._status(f"STT {stt}: 📥 Downloading video từ {account_name}...")
+				await client.http_download_mp4(extract_fife_url(status_resp), output_path)
+
+			# Xóa media sau khi tải video xong (nếu có image và không còn job/cache nào dùng)
+			if media_id:
+				release_media_id, media_id = media_id, None
+				if not self.upload_cache.release(release_media_id):
+					self._status(f"STT {stt}: ♻️ Giữ media trong cache để tái sử dụng")
+				elif await loop.run_in_executor(None, lambda: delete_media([release_media_id], cookie, account_key=account_name)):
+					self._status(f"STT {stt}: 🧹 Đã xóa media sau khi tải xong")
+				else:
+					self._status(f"STT {stt}: ⚠️ Không thể xóa media")
+
+			return self._finish_job(job_key, stt, prompt, account_name, output_filename, output_path)
+		except (asyncio.CancelledError, AccountAuthError):
+			raise
+		except Exception as e:
+			if classify_error(e) == ERROR_AUTH:
+				raise AccountAuthError(f"{account_name}: {str(e)}") from e
+			if media_id and cache_hit and is_media_missing_error(e):
+				self.upload_cache.invalidate(media_id)
+			self._record(job_key, stt, STATE_FAILED, str(e), error=str(e))
+			self._status(f"STT {stt}: ❌ Lỗi với {account_name}: {str(e)}")
+			return (stt, prompt, False, str(e))
+		finally:
+			# Job dừng giữa chừng vẫn phải trả lại media cho cache
+			if media_id:
+				self.upload_cache.release(media_id, delete=False)
+
+	def _finish_job(self, job_key: Optional[str], stt: int, prompt: str, account_name: str, output_filename: str, output_path: str) -> Tuple:
+		verify_output_video(output_path)
+		self._record(job_key, stt, STATE_DONE, output_path=output_path, output_size=os.path.getsize(output_path), error=None)
+		self._status(f"STT {stt}: ✅ Hoàn thành với {account_name}: {output_filename}")
+		return (stt, prompt, True, output_filename)
+
+	async def _upscale(self, client: AsyncApiClient, token: str, cookie: str, account_name: str, stt: int, status_resp: Optional[Dict[str, Any]], output_path: str, job_key: Optional[str] = None, resume_op: Optional[Tuple[str, str, Optional[float]]] = None) -> bool:
+		"""Upscale 1080p; trả về False (để tải bản 720p) nếu upscale lỗi. resume_op: (operation, scene_id, submitted_at) upscale còn dở"""
+		self._status(f"STT {stt}: 🔄 Upscaling to 1080p...")
+		try:
+			if resume_op is not None:
+				upscale_op_name, upscale_scene_id, submitted_at = resume_op
+			else:
+				video_media_id = extract_video_media_id(status_resp)
+				if not video_media_id:
+					raise ValueError("Không thể lấy mediaId từ video generation response")
+				upscale_resp, upscale_scene_id = await client.upscale_video(token, video_media_id, self.config["project_id"], "1080p", self.config["aspect_ratio"], self.config.get("seed"))
+				upscale_op_name, submitted_at = extract_op_name(upscale_resp), None
+				self._record(job_key, stt, STATE_UPSCALE_SUBMITTED, video_media_id=video_media_id,
+							 upscale_operation_name=upscale_op_name, upscale_scene_id=upscale_scene_id)
+			self._status(f"STT {stt}: ⏳ Waiting for upscale...")
+			upscale_status_resp = await client.wait_status(token, upscale_op_name, upscale_scene_id, UPSCALE_TIMEOUT_SEC, upscale_model_key("1080p"), submitted_at)
+			upscale_media_id = extract_upscale_media_id(upscale_status_resp)
+			if not upscale_media_id:
+				raise ValueError("Không thể lấy mediaId từ upscale response")
+			self._status(f"STT {stt}: 📥 Downloading upscaled video...")
+			await client.download_encoded_video_stream(token, upscale_media_id, output_path)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			self._status(f"STT {stt}: ⚠️ Upscale failed: {str(e)}")
+			self._status(f"STT {stt}: ✅ Video generated at 720p")
+			return False
+
+		# Chỉ xóa upscale media (video media gốc giữ lại)
+		loop = asyncio.get_running_loop()
+		if await loop.run_in_executor(None, lambda: delete_media([upscale_media_id], cookie, account_key=account_name)):
+			self._status(f"STT {stt}: 🧹 Đã xóa upscale media")
+		else:
+			self._status(f"STT {stt}: ⚠️ Không thể xóa upscale media")
+		self._status(f"STT {stt}: ✅ Upscaled to 1080p!")
+		return True
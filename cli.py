@@ -0,0 +1,166 @@
+"""Chạy tạo video không cần giao diện (server Linux không có màn hình)
+
+    python -m cli --input prompts.xlsx --accounts accounts.json --output-dir output --workers 5
+
+Mỗi sự kiện được in ra stdout thành một dòng JSON ({"event": ..., ...}); log của thư viện chuyển sang stderr.
+Exit code: 0 tất cả thành công, 1 có video thất bại, 2 lỗi đầu vào/key/tài khoản, 130 bị dừng (Ctrl+C).
+"""
+import sys
+import os
+import json
+import time
+import signal
+import argparse
+import threading
+
+from api import API_AUTH_ENDPOINT, _load_config, read_excel_prompts
+from core import VideoProcessingCore, aspect_ratio_from_text, filter_valid_accounts
+from auth.device_key import check_key_online, get_device_id
+from config_manager import ConfigManager
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_STOPPED = 130
+
+
+class EventWriter:
+    """Ghi sự kiện dạng JSON lines (mỗi dòng một object, flush ngay để process khác đọc theo thời gian thực)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps(dict(event=event, time=round(time.time(), 3), **fields), ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Veo3 AI video generator (headless)")
+    parser.add_argument("--input", required=True, help="File Excel/CSV: cột STT, PROMPT, IMAGE_PATH (tùy chọn)")
+    parser.add_argument("--accounts", default="accounts.json", help="File tài khoản (mặc định: accounts.json)")
+    parser.add_argument("--output-dir", default="output", help="Thư mục lưu video (mặc định: output)")
+    parser.add_argument("--workers", type=int, default=5, help="Số video chạy song song trên mỗi tài khoản (mặc định: 5)")
+    parser.add_argument("--aspect-ratio", choices=["16:9", "9:16"], default="16:9")
+    parser.add_argument("--resolution", choices=["720p", "1080p"], default="720p", help="1080p: upscale (chỉ với 16:9)")
+    parser.add_argument("--project-id", help="Mặc định lấy từ config.json")
+    parser.add_argument("--seed", type=int, help="Mặc định lấy từ config.json")
+    parser.add_argument("--require-image", action="store_true", help="Mọi dòng phải có image hợp lệ")
+    parser.add_argument("--auto-merge", metavar="FILE", help="Ghép dần các video theo STT vào FILE ngay khi tạo xong")
+    parser.add_argument("--key", help="KEY bản quyền; mặc định dùng key đã lưu từ giao diện")
+    return parser
+
+
+def check_license(key=None):
+    """Kiểm tra KEY giống khi mở giao diện (key đã lưu còn mới thì không cần hỏi server), trả về (ok, message)"""
+    if key:
+        success, message, _ = check_key_online(key, API_AUTH_ENDPOINT)
+        return success, message
+
+    config_manager = ConfigManager()
+    device_id = get_device_id()[0]
+    saved_key, saved_key_info = config_manager.get_saved_api_key(device_id)
+    if not saved_key or not saved_key_info:
+        return False, "Chưa có KEY đã lưu, dùng --key hoặc đăng nhập một lần trên giao diện"
+    if config_manager.is_key_expired_locally(device_id):
+        config_manager.clear_api_key()
+        return False, "KEY đã hết hạn"
+    if config_manager.should_refresh_key(device_id, force_refresh_hours=24):
+        success, message, info = check_key_online(saved_key, API_AUTH_ENDPOINT)
+        if not success:
+            config_manager.clear_api_key()
+            return False, message
+        config_manager.save_api_key(saved_key, device_id, info, remember=True)
+    return True, "KEY hợp lệ"
+
+
+def load_accounts(accounts_file):
+    with open(accounts_file, "r", encoding="utf-8") as f:
+        accounts = json.load(f)
+    if not isinstance(accounts, list):
+        raise ValueError("File tài khoản phải là danh sách")
+    return accounts
+
+
+def run(args, events):
+    ok, message = check_license(args.key)
+    if not ok:
+        events.emit("error", message=f"KEY không hợp lệ: {message}")
+        return EXIT_USAGE
+
+    try:
+        accounts = load_accounts(args.accounts)
+        # read_excel_prompts gọi exit() khi file lỗi
+        prompts = read_excel_prompts(args.input, args.require_image)
+    except (OSError, ValueError, SystemExit) as e:
+        events.emit("error", message=f"Lỗi đọc đầu vào: {e}")
+        return EXIT_USAGE
+    if not prompts:
+        events.emit("error", message="Không có prompt nào để xử lý")
+        return EXIT_USAGE
+
+    valid_accounts = filter_valid_accounts(accounts, log=lambda message: events.emit("status", message=message))
+    if not valid_accounts:
+        events.emit("error", message="Không có tài khoản nào hợp lệ")
+        return EXIT_USAGE
+
+    file_config = _load_config()
+    aspect_ratio = aspect_ratio_from_text(args.aspect_ratio)
+    config = {
+        "project_id": args.project_id or file_config.get("project_id", ""),
+        "seed": args.seed if args.seed is not None else file_config.get("seed", 0),
+        "max_workers": args.workers,
+        "output_dir": args.output_dir,
+        "aspect_ratio": aspect_ratio,
+        # Chỉ cho phép upscale 1080p khi aspect ratio là 16:9 (landscape)
+        "use_upscale": args.resolution == "1080p" and aspect_ratio == "VIDEO_ASPECT_RATIO_LANDSCAPE",
+        "auto_merge_path": args.auto_merge,
+    }
+    os.makedirs(config["output_dir"], exist_ok=True)
+
+    core = VideoProcessingCore(
+        prompts, valid_accounts, config, args.workers,
+        on_progress=lambda progress, message: events.emit("progress", progress=progress, message=message),
+        on_status=lambda message: events.emit("status", message=message),
+        on_result=lambda account, result: events.emit(
+            "result", stt=result[0], account=account, success=result[2], result=result[3]
+        ),
+    )
+
+    def on_interrupt(signum, frame):
+        events.emit("status", message="⏹️ Đang dừng, chờ các video đang chạy kết thúc stage hiện tại...")
+        core.stop_processing()
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    signal.signal(signal.SIGTERM, on_interrupt)
+
+    events.emit("start", total=len(prompts), accounts=len(valid_accounts), workers=args.workers, output_dir=config["output_dir"])
+    results = core.run()
+    successful = sum(1 for r in results if r[2])
+    events.emit(
+        "done", total=len(prompts), successful=successful, failed=len(results) - successful,
+        stopped=core.should_stop, failed_stt=[r[0] for r in results if not r[2]]
+    )
+    if core.should_stop:
+        return EXIT_STOPPED
+    return EXIT_OK if successful == len(prompts) else EXIT_FAILED
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # stdout chỉ dành cho sự kiện JSON, mọi print() của thư viện chuyển sang stderr
+    events = EventWriter(sys.stdout)
+    sys.stdout = sys.stderr
+    try:
+        return run(args, events)
+    except Exception as e:
+        events.emit("error", message=str(e))
+        return EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from api import (
+    AccountAuthError, clear_generate_submitters, close_http_sessions, delete_media,
+    get_access_token, stop_status_pollers,
+)
+from upload_cache import UploadCache
+from pipeline import GenerationPipeline, STOPPED_MESSAGE, job_output_path
+from video_merge import IncrementalMerger
+from job_journal import JobJournal
+from async_api import AsyncVideoJobRunner, async_client_enabled
+
+
+NO_ACCOUNT_MESSAGE = "Không còn tài khoản hợp lệ để xử lý"
+ACCOUNT_CHECK_WORKERS = 8
+
+
+def aspect_ratio_from_text(aspect_ratio_text):
+    """"9:16" -> portrait, còn lại landscape (giống combo box Aspect Ratio)"""
+    if aspect_ratio_text == "9:16":
+        return "VIDEO_ASPECT_RATIO_PORTRAIT"
+    return "VIDEO_ASPECT_RATIO_LANDSCAPE"
+
+
+def _check_account_token(account, force_refresh=False):
+    cookie = account.get("cookie", "")
+    if not cookie or cookie.startswith("YOUR_COOKIE_HERE"):
+        return None
+    return get_access_token(cookie, account_key=account.get("name", "Unknown"), force_refresh=force_refresh)
+
+
+def filter_valid_accounts(accounts, log=print, force_refresh=False):
+    """Lấy token thử cho các tài khoản (song song), trả về các tài khoản dùng được
+
+    log() chỉ được gọi trên thread gọi hàm, theo đúng thứ tự tài khoản.
+    force_refresh=True để bỏ qua cache token và hỏi lại server (cookie bị thu hồi sẽ hiện là lỗi ngay).
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(ACCOUNT_CHECK_WORKERS, len(accounts)))) as executor:
+        tokens = list(executor.map(lambda account: _check_account_token(account, force_refresh), accounts))
+
+    valid_accounts = []
+    for account, token in zip(accounts, tokens):
+        cookie = account.get("cookie", "")
+        name = account.get("name", "Unknown")
+
+        if not cookie or cookie.startswith("YOUR_COOKIE_HERE"):
+            log(f"⚠️ {name}: Cookie không hợp lệ")
+            continue
+
+        if token:
+            valid_accounts.append(account)
+            log(f"✅ {name}: Token hợp lệ")
+        else:
+            log(f"❌ {name}: Không thể lấy token - Cookie có thể đã hết hạn")
+    return valid_accounts
+
+
+class VideoProcessingCore:
+    """Xử lý một lượt video (không phụ thuộc Qt): hàng đợi prompt chung, phân job cho các account, pipeline/async runner
+
+    on_progress(progress, message) và on_status(message) được gọi từ thread đang chạy run().
+    Truyền upload_cache/journal và release_shared=False khi nhiều lượt chạy nối tiếp trong cùng process (daemon)
+    để giữ cache, poller và connection pool giữa các lượt.
+    """
+
+    def __init__(self, prompts, accounts_data, config, max_workers=5, on_progress=None, on_status=None, on_result=None,
+                 upload_cache=None, journal=None, release_shared=True):
+        self.prompts = prompts
+        self.accounts_data = accounts_data
+        self.config = config
+        self.max_workers = max_workers
+        self.on_progress = on_progress or (lambda progress, message: None)
+        self.on_status = on_status or (lambda message: None)
+        self.on_result = on_result  # on_result(account_name, result) khi mỗi video xong
+        self.processed_count = 0
+        self.total_count = len(prompts)
+        self.current_account_index = 0  # For account rotation
+
+        # Hàng đợi prompt dùng chung: luồng rảnh của account nào cũng lấy job kế tiếp
+        self.account_slots = self.build_account_slots()
+        self.job_queue = deque(prompts)
+        self.retired_accounts = set()  # Account lỗi xác thực giữa chừng, không nhận job mới
+
+        # Cache mediaId của image đã upload (cùng ảnh dùng cho nhiều prompt chỉ upload một lần)
+        self.upload_cache = upload_cache or UploadCache()
+
+        # Journal SQLite: STT đã xong thì bỏ qua, operation còn dở từ lần trước thì poll tiếp trên đúng account
+        self.owns_journal = journal is None
+        self.journal = journal or JobJournal()
+        self.release_shared = release_shared
+        self.resume_queues = self.collect_resumable_jobs()
+
+        # Pipeline theo stage (upload/submit/poll/download) dùng suốt lượt chạy
+        self.pipeline = GenerationPipeline(config, self.upload_cache, status_callback=self.on_status, journal=self.journal)
+        self.async_runner = None  # Chỉ dùng khi bật client async
+
+        # Ghép dần video theo STT ngay khi các STT nhỏ hơn xong (config["auto_merge_path"])
+        self.merger = self.build_merger()
+
+        self.should_stop = False
+
+    def build_merger(self):
+        merge_path = self.config.get("auto_merge_path")
+        if not merge_path:
+            return None
+        merger = IncrementalMerger(sorted(p[0] for p in self.prompts), merge_path, log=self.on_status)
+        if not merger.available:
+            self.on_status("⚠️ Không tìm thấy ffmpeg, tắt ghép video tự động")
+            merger.finish()
+            return None
+        return merger
+
+    def stop_processing(self):
+        """Dừng quá trình xử lý"""
+        self.should_stop = True
+        self.pipeline.stop()
+        if self.async_runner:
+            self.async_runner.stop()
+
+    def build_account_slots(self):
+        """Số luồng tối đa của mỗi tài khoản (prompt không chia trước mà lấy từ hàng đợi chung)"""
+        slots = {}
+        for i, account in enumerate(self.accounts_data or []):
+            account_name = account.get("name", f"Account {i+1}")
+            slots[account_name] = {
+                'account': account,
+                'threads': self.max_workers,
+                'account_index': i
+            }
+        return slots
+
+    def collect_resumable_jobs(self):
+        """Tách các prompt còn operation đang chạy từ lần trước ra hàng đợi riêng của account đã tạo operation"""
+        resume_queues = {}
+        remaining = deque()
+        for prompt_data in self.job_queue:
+            stt, prompt, image_path = prompt_data
+            entry = self.journal.get(JobJournal.job_key(stt, prompt, job_output_path(self.config, stt, prompt)))
+            if JobJournal.is_resumable(entry) and entry.get("account") in self.account_slots:
+                resume_queues.setdefault(entry["account"], deque()).append(prompt_data)
+            else:
+                remaining.append(prompt_data)
+        self.job_queue = remaining
+        return resume_queues
+
+    def retire_account(self, account_name, reason):
+        """Account lỗi xác thực: ngừng giao job mới, job resume của account đó phải generate lại ở account khác"""
+        if account_name in self.retired_accounts:
+            return
+        self.retired_accounts.add(account_name)
+        self.job_queue.extend(self.resume_queues.pop(account_name, []))
+        self.on_status(f"🔒 {account_name} lỗi xác thực, chuyển job còn lại sang tài khoản khác: {reason}")
+
+    def fill_account_slots(self, in_flight):
+        """Các account còn dùng được lấy job (ưu tiên job resume của chính account) cho tới khi hết luồng rảnh"""
+        running = {}
+        for account_name, _ in in_flight.values():
+            running[account_name] = running.get(account_name, 0) + 1
+
+        for account_name, data in self.account_slots.items():
+            if account_name in self.retired_accounts:
+                continue
+            resume_queue = self.resume_queues.get(account_name)
+            while running.get(account_name, 0) < data['threads'] and (resume_queue or self.job_queue) and not self.should_stop:
+                prompt_data = resume_queue.popleft() if resume_queue else self.job_queue.popleft()
+                future = self.pipeline.submit(prompt_data, data['account'])
+                in_flight[future] = (account_name, prompt_data)
+                running[account_name] = running.get(account_name, 0) + 1
+
+    def get_next_account(self):
+        """Lấy tài khoản tiếp theo để xoay vòng"""
+        if not self.accounts_data:
+            return None
+
+        account = self.accounts_data[self.current_account_index]
+        self.current_account_index = (self.current_account_index + 1) % len(self.accounts_data)
+        return account
+
+    def process_single_video(self, prompt_data):
+        """Xử lý một video đơn lẻ với auto account rotation"""
+        stt, prompt, image_path = prompt_data
+        account_data = self.get_next_account()
+        if not account_data:
+            return (stt, prompt, False, "Không có tài khoản nào khả dụng")
+        return self.process_video_with_specific_account(prompt_data, account_data)
+
+    def process_video_with_specific_account(self, prompt_data, account_data):
+        """Xử lý video với tài khoản cụ thể: đưa vào pipeline theo stage và chờ kết quả"""
+        stt, prompt, image_path = prompt_data
+        if self.should_stop:
+            return (stt, prompt, False, "Đã dừng bởi người dùng")
+        return self.pipeline.submit(prompt_data, account_data).result()
+
+    def on_job_finished(self, account_name, result):
+        """Cập nhật progress theo từng video hoàn thành"""
+        self.processed_count += 1
+        progress = int(10 + (self.processed_count / self.total_count) * 85)
+        icon = "✅" if result[2] else "❌"
+        self.on_progress(
+            progress,
+            f"{icon} STT {result[0]} ({account_name}) ({self.processed_count}/{self.total_count})"
+        )
+        if self.on_result is not None:
+            self.on_result(account_name, result)
+        if self.merger is not None and result[3] != STOPPED_MESSAGE:
+            # Video dừng giữa chừng để lại khoảng trống, lần chạy sau ghép tiếp từ checkpoint
+            stt, prompt, success, _ = result
+            self.merger.add(stt, job_output_path(self.config, stt, prompt) if success else None)
+
+    def run_pipeline_jobs(self):
+        """Chạy các job qua pipeline theo stage (thread pool), trả về danh sách kết quả"""
+        results = []
+
+        # Mỗi account giữ tối đa `threads` video đang chạy trong pipeline,
+        # video nào xong thì account đó lấy ngay job kế tiếp trong hàng đợi chung
+        in_flight = {}  # future -> (account_name, prompt_data)
+
+        try:
+            self.fill_account_slots(in_flight)
+
+            while in_flight and not self.should_stop:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    account_name, prompt_data = in_flight.pop(future)
+                    stt, prompt, image_path = prompt_data
+
+                    try:
+                        result = future.result()
+                    except AccountAuthError as e:
+                        # Account hết hiệu lực: trả job về đầu hàng đợi cho account khác
+                        self.retire_account(account_name, str(e))
+                        self.job_queue.appendleft(prompt_data)
+                        continue
+                    except Exception as e:
+                        result = (stt, prompt, False, str(e))
+                    results.append(result)
+                    self.on_job_finished(account_name, result)
+
+                # Luồng vừa rảnh (của bất kỳ account nào) lấy ngay job kế tiếp
+                self.fill_account_slots(in_flight)
+
+            if self.should_stop:
+                # Job đang chạy dừng ở stage kế tiếp của pipeline, job chưa bắt đầu bị bỏ
+                self.job_queue.clear()
+                self.resume_queues.clear()
+            elif self.job_queue:
+                # Không còn account nào dùng được cho các job còn lại
+                while self.job_queue:
+                    stt, prompt, image_path = self.job_queue.popleft()
+                    results.append((stt, prompt, False, NO_ACCOUNT_MESSAGE))
+                self.on_progress(95, "❌ Tất cả tài khoản đều lỗi xác thực, các video còn lại bị bỏ qua")
+
+        finally:
+            self.pipeline.shutdown(wait=False)
+
+        return results
+
+    def run_async_jobs(self):
+        """Chạy các job trên một event loop bằng client async (bật trong config.json, cần aiohttp)"""
+        self.async_runner = AsyncVideoJobRunner(
+            self.config, self.accounts_data, self.max_workers, self.upload_cache,
+            on_status=self.on_status, on_result=self.on_job_finished, journal=self.journal
+        )
+        prompts, self.job_queue = list(self.job_queue), deque()
+        resume_queues, self.resume_queues = self.resume_queues, {}
+        results = self.async_runner.run(prompts, resume_queues)
+        if len(results) > self.processed_count and not self.should_stop:
+            self.on_progress(95, "❌ Tất cả tài khoản đều lỗi xác thực, các video còn lại bị bỏ qua")
+        return results
+
+    def run(self):
+        """Chạy cả lượt, trả về danh sách (stt, prompt, success, result) theo STT"""
+        try:
+            account_count = len(self.accounts_data)
+
+            self.on_progress(5, f"🚀 Bắt đầu xử lý {self.total_count} video với {self.max_workers} luồng/tài khoản và {account_count} tài khoản...")
+            self.on_progress(8, f"📊 Hàng đợi chung: {len(self.job_queue)} prompts, {len(self.account_slots)} tài khoản tự lấy job khi rảnh")
+
+            if async_client_enabled():
+                self.on_progress(9, "⚡ Dùng client async: mọi video chạy trên một event loop")
+                results = self.run_async_jobs()
+            else:
+                results = self.run_pipeline_jobs()
+
+            # Sắp xếp results theo STT
+            results.sort(key=lambda x: x[0])
+
+            # Thống kê kết quả
+            successful = sum(1 for r in results if r[2])
+            failed = len(results) - successful
+
+            if self.merger is not None:
+                merger, self.merger = self.merger, None
+                self.on_progress(98, "🔗 Đang hoàn tất file ghép...")
+                try:
+                    merged_path = merger.finish()
+                    if merged_path:
+                        self.on_progress(99, f"🎬 File ghép: {merged_path}")
+                except Exception as e:
+                    self.on_progress(99, f"⚠️ Lỗi ghép video tự động: {str(e)}")
+
+            self.on_progress(100, f"✅ Hoàn thành! Thành công: {successful}/{len(results)} video")
+            if failed > 0:
+                self.on_progress(100, f"⚠️ Có {failed} video thất bại")
+
+            return results
+        finally:
+            # Tối ưu: Cleanup resources
+            self.job_queue.clear()
+            # Xóa trên server các image đã hết hạn trong cache upload
+            cookies_by_account = {a.get("name", "Unknown"): a.get("cookie") for a in self.accounts_data}
+            self.upload_cache.purge_evicted(
+                lambda account, media_ids: delete_media(media_ids, cookies_by_account.get(account), account_key=account)
+            )
+            # Dừng poller và đóng các connection pool dùng chung của lượt chạy
+            if self.release_shared:
+                stop_status_pollers()
+                clear_generate_submitters()
+                close_http_sessions()
+            if self.merger is not None:
+                # Lỗi giữa lượt: dừng thread ghép, checkpoint giữ nguyên để lần sau ghép tiếp
+                try:
+                    self.merger.finish()
+                except Exception:
+                    pass
+            if self.owns_journal:
+                self.journal.close()
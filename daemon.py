@@ -0,0 +1,495 @@
+"""Service chạy lâu dài với HTTP/JSON API cục bộ để gửi và theo dõi các batch prompt
+
+    python -m daemon --port 8765 --accounts accounts.json
+
+Tài khoản được kiểm tra một lần khi khởi động (và khi file tài khoản thay đổi / quá hạn kiểm tra),
+token, poller, connection pool, cache upload và journal được giữ lại giữa các batch.
+
+    GET  /health
+    GET  /accounts                    tài khoản đang dùng được
+    POST /accounts/refresh            kiểm tra lại tài khoản
+    POST /batches                     {"prompts": [{"stt", "prompt", "image_path"}], "output_dir", "aspect_ratio",
+                                       "resolution", "workers", "auto_merge_path"} -> {"batch_id"}
+    GET  /batches                     danh sách batch
+    GET  /batches/<id>                trạng thái batch và từng STT
+    GET  /batches/<id>/events?since=N stream sự kiện (JSON lines) tới khi batch kết thúc
+    POST /batches/<id>/cancel         hủy batch (đang chờ hoặc đang chạy)
+    GET  /batches/<id>/outputs/<stt>  tải file video của STT
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import queue
+import signal
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from api import (
+    _load_config, clear_generate_submitters, close_http_sessions, stop_status_pollers,
+)
+from core import VideoProcessingCore, aspect_ratio_from_text, filter_valid_accounts
+from pipeline import job_output_path
+from upload_cache import UploadCache
+from job_journal import JobJournal
+from cli import check_license, load_accounts
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+ACCOUNT_RECHECK_SEC = 30 * 60  # Kiểm tra lại tài khoản trước batch nếu lần kiểm tra trước đã quá lâu
+MAX_FINISHED_BATCHES = 100  # Chỉ giữ thông tin của các batch đã xong gần nhất
+EVENT_STREAM_KEEPALIVE_SEC = 15
+
+BATCH_QUEUED = "queued"
+BATCH_RUNNING = "running"
+BATCH_DONE = "done"
+BATCH_CANCELLED = "cancelled"
+BATCH_FAILED = "failed"
+
+_STT_MESSAGE = re.compile(r"^STT (\d+):")
+
+
+class Batch:
+    """Một lần gửi prompt: trạng thái từng STT và danh sách sự kiện để client stream"""
+
+    def __init__(self, batch_id, prompts, config, workers):
+        self.batch_id = batch_id
+        self.prompts = prompts
+        self.config = config
+        self.workers = workers
+        self.state = BATCH_QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+        self.error = None
+        self.core = None
+        self.cancel_requested = False
+        self.jobs = OrderedDict(
+            (stt, {"stt": stt, "prompt": prompt, "state": "queued", "message": None, "account": None, "output": None})
+            for stt, prompt, image_path in prompts
+        )
+        self._events = []
+        self._closed = False  # Đã ghi sự kiện "done", stream có thể đóng
+        self._cond = threading.Condition()
+
+    def emit(self, event, **fields):
+        with self._cond:
+            self._events.append(dict(event=event, seq=len(self._events), time=round(time.time(), 3), **fields))
+            self._cond.notify_all()
+
+    def close(self, **fields):
+        """Ghi sự kiện "done" cuối cùng"""
+        with self._cond:
+            self.emit("done", **fields)
+            self._closed = True
+
+    def events_since(self, seq, timeout):
+        """(các sự kiện từ seq trở đi, đã hết sự kiện); chờ tối đa timeout giây nếu chưa có sự kiện mới"""
+        with self._cond:
+            if seq >= len(self._events) and not self._closed:
+                self._cond.wait(timeout)
+            events = self._events[seq:]
+            return events, self._closed
+
+    @property
+    def finished(self):
+        return self.state in (BATCH_DONE, BATCH_CANCELLED, BATCH_FAILED)
+
+    def on_status(self, message):
+        match = _STT_MESSAGE.match(message)
+        if match:
+            job = self.jobs.get(int(match.group(1)))
+            if job is not None and job["state"] == "queued":
+                job["state"] = "running"
+            if job is not None:
+                job["message"] = message
+        self.emit("status", message=message)
+
+    def on_result(self, account_name, result):
+        stt, prompt, success, detail = result
+        job = self.jobs.get(stt)
+        if job is not None:
+            job.update(state="done" if success else "failed", account=account_name, message=detail)
+            if success:
+                job["output"] = job_output_path(self.config, stt, prompt)
+        self.emit("result", stt=stt, account=account_name, success=success, result=detail)
+
+    def to_dict(self, include_jobs=False):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job["state"]] = counts.get(job["state"], 0) + 1
+        data = {
+            "batch_id": self.batch_id,
+            "state": self.state,
+            "total": len(self.jobs),
+            "counts": counts,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if include_jobs:
+            data["jobs"] = list(self.jobs.values())
+        return data
+
+
+class VideoDaemon:
+    """Giữ pool tài khoản đã kiểm tra và chạy các batch lần lượt trên một thread riêng"""
+
+    def __init__(self, accounts_file, max_workers=5):
+        self.accounts_file = accounts_file
+        self.max_workers = max_workers
+        self.valid_accounts = []
+        self._accounts_checked_at = 0
+        self._accounts_mtime = None
+        self._accounts_lock = threading.Lock()
+
+        # Dùng chung cho mọi batch (cùng file với giao diện/CLI)
+        self.upload_cache = UploadCache()
+        self.journal = JobJournal()
+
+        self.batches = OrderedDict()  # batch_id -> Batch
+        self._batches_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run_batches, name="daemon-batches", daemon=True)
+
+    def start(self):
+        self.refresh_accounts()
+        self._worker.start()
+
+    def shutdown(self):
+        """Dừng batch đang chạy, đóng tài nguyên dùng chung"""
+        self._stopped.set()
+        with self._batches_lock:
+            batches = list(self.batches.values())
+        for batch in batches:
+            self.cancel_batch(batch.batch_id)
+        self._queue.put(None)
+        self._worker.join(timeout=30)
+        stop_status_pollers()
+        clear_generate_submitters()
+        close_http_sessions()
+        self.journal.close()
+
+    # --- Tài khoản ---
+
+    def refresh_accounts(self):
+        """Đọc lại file tài khoản và lấy token thử cho từng tài khoản"""
+        with self._accounts_lock:
+            accounts = load_accounts(self.accounts_file)
+            self.valid_accounts = filter_valid_accounts(accounts, force_refresh=True)
+            self._accounts_checked_at = time.time()
+            self._accounts_mtime = os.path.getmtime(self.accounts_file)
+            return list(self.valid_accounts)
+
+    def get_accounts(self):
+        """Tài khoản dùng được; chỉ kiểm tra lại khi file thay đổi hoặc lần kiểm tra trước đã quá lâu"""
+        with self._accounts_lock:
+            stale = time.time() - self._accounts_checked_at > ACCOUNT_RECHECK_SEC
+            try:
+                changed = os.path.getmtime(self.accounts_file) != self._accounts_mtime
+            except OSError:
+                changed = False
+            if not stale and not changed:
+                return list(self.valid_accounts)
+        return self.refresh_accounts()
+
+    # --- Batch ---
+
+    def submit_batch(self, body):
+        prompts = parse_prompts(body.get("prompts"))
+        file_config = _load_config()
+        aspect_ratio = aspect_ratio_from_text(body.get("aspect_ratio", "16:9"))
+        config = {
+            "project_id": body.get("project_id") or file_config.get("project_id", ""),
+            "seed": body.get("seed", file_config.get("seed", 0)),
+            "output_dir": body.get("output_dir") or "output",
+            "aspect_ratio": aspect_ratio,
+            # Chỉ cho phép upscale 1080p khi aspect ratio là 16:9 (landscape)
+            "use_upscale": body.get("resolution") == "1080p" and aspect_ratio == "VIDEO_ASPECT_RATIO_LANDSCAPE",
+            "auto_merge_path": body.get("auto_merge_path"),
+        }
+        workers = int(body.get("workers") or self.max_workers)
+        config["max_workers"] = workers
+
+        batch = Batch(uuid.uuid4().hex[:12], prompts, config, workers)
+        with self._batches_lock:
+            self.batches[batch.batch_id] = batch
+            self._prune_batches()
+        batch.emit("queued", total=len(prompts))
+        self._queue.put(batch)
+        return batch
+
+    def get_batch(self, batch_id):
+        with self._batches_lock:
+            return self.batches.get(batch_id)
+
+    def list_batches(self):
+        with self._batches_lock:
+            return list(self.batches.values())
+
+    def cancel_batch(self, batch_id):
+        batch = self.get_batch(batch_id)
+        if batch is None:
+            return None
+        batch.cancel_requested = True
+        if batch.core is not None:
+            batch.core.stop_processing()
+        return batch
+
+    def _prune_batches(self):
+        finished = [b.batch_id for b in self.batches.values() if b.finished]
+        for batch_id in finished[:max(0, len(finished) - MAX_FINISHED_BATCHES)]:
+            del self.batches[batch_id]
+
+    def _run_batches(self):
+        while not self._stopped.is_set():
+            batch = self._queue.get()
+            if batch is None:
+                break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        if batch.cancel_requested:
+            self._finish_batch(batch, BATCH_CANCELLED)
+            return
+        try:
+            accounts = self.get_accounts()
+            if not accounts:
+                raise RuntimeError("Không có tài khoản nào hợp lệ")
+            os.makedirs(batch.config["output_dir"], exist_ok=True)
+            batch.core = VideoProcessingCore(
+                batch.prompts, accounts, batch.config, batch.workers,
+                on_progress=lambda progress, message: batch.emit("progress", progress=progress, message=message),
+                on_status=batch.on_status, on_result=batch.on_result,
+                upload_cache=self.upload_cache, journal=self.journal, release_shared=False
+            )
+            if batch.cancel_requested:
+                batch.core.stop_processing()
+            batch.state = BATCH_RUNNING
+            batch.emit("start", accounts=len(accounts), workers=batch.workers)
+            batch.core.run()
+            self._finish_batch(batch, BATCH_CANCELLED if batch.cancel_requested else BATCH_DONE)
+        except Exception as e:
+            batch.error = str(e)
+            self._finish_batch(batch, BATCH_FAILED)
+
+    def _finish_batch(self, batch, state):
+        for job in batch.jobs.values():
+            if job["state"] in ("queued", "running"):
+                job["state"] = "cancelled" if state == BATCH_CANCELLED else "failed"
+        batch.finished_at = time.time()
+        batch.state = state
+        batch.close(**batch.to_dict())
+
+
+def parse_prompts(items):
+    """[{"stt", "prompt", "image_path"}] -> [(stt, prompt, image_path)]; ValueError nếu dữ liệu sai"""
+    if not isinstance(items, list) or not items:
+        raise ValueError("prompts phải là danh sách không rỗng")
+    prompts = []
+    seen = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not str(item.get("prompt") or "").strip():
+            raise ValueError(f"prompts[{index}] thiếu prompt")
+        try:
+            stt = int(item.get("stt", index + 1))
+        except (TypeError, ValueError):
+            raise ValueError(f"prompts[{index}] có STT không hợp lệ")
+        if stt in seen:
+            raise ValueError(f"STT {stt} bị trùng")
+        seen.add(stt)
+        image_path = item.get("image_path") or None
+        if image_path and not os.path.exists(image_path):
+            raise ValueError(f"STT {stt}: File image không tồn tại: {image_path}")
+        prompts.append((stt, str(item["prompt"]).strip(), image_path))
+    return prompts
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    server_version = "Veo3AIDaemon/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def daemon(self):
+        return self.server.video_daemon
+
+    def log_message(self, format, *args):
+        print(f"[daemon] {self.address_string()} {format % args}", file=sys.stderr)
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {"error": message})
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def _authorized(self):
+        token = self.server.auth_token
+        if not token or self.headers.get("Authorization") == f"Bearer {token}":
+            return True
+        self._send_error(401, "Unauthorized")
+        return False
+
+    def _route(self):
+        parsed = urlparse(self.path)
+        parts = [p for p in parsed.path.split("/") if p]
+        return parts, parse_qs(parsed.query)
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts, query = self._route()
+        if parts == ["health"]:
+            self._send_json(200, {"status": "ok", "accounts": len(self.daemon.valid_accounts)})
+        elif parts == ["accounts"]:
+            self._send_json(200, {"accounts": [a.get("name", "Unknown") for a in self.daemon.valid_accounts]})
+        elif parts == ["batches"]:
+            self._send_json(200, {"batches": [b.to_dict() for b in self.daemon.list_batches()]})
+        elif len(parts) >= 2 and parts[0] == "batches":
+            batch = self.daemon.get_batch(parts[1])
+            if batch is None:
+                self._send_error(404, "Không tìm thấy batch")
+            elif len(parts) == 2:
+                self._send_json(200, batch.to_dict(include_jobs=True))
+            elif parts[2:] == ["events"]:
+                self._stream_events(batch, int(query.get("since", ["0"])[0]))
+            elif len(parts) == 4 and parts[2] == "outputs":
+                self._send_output(batch, parts[3])
+            else:
+                self._send_error(404, "Not found")
+        else:
+            self._send_error(404, "Not found")
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        parts, _ = self._route()
+        try:
+            body = self._read_json()
+        except (ValueError, UnicodeDecodeError):
+            self._send_error(400, "Body không phải JSON hợp lệ")
+            return
+        if parts == ["batches"]:
+            try:
+                batch = self.daemon.submit_batch(body)
+            except ValueError as e:
+                self._send_error(400, str(e))
+                return
+            self._send_json(202, {"batch_id": batch.batch_id, "total": len(batch.jobs)})
+        elif parts == ["accounts", "refresh"]:
+            try:
+                accounts = self.daemon.refresh_accounts()
+            except (OSError, ValueError) as e:
+                self._send_error(500, f"Không đọc được file tài khoản: {e}")
+                return
+            self._send_json(200, {"accounts": [a.get("name", "Unknown") for a in accounts]})
+        elif len(parts) == 3 and parts[0] == "batches" and parts[2] == "cancel":
+            batch = self.daemon.cancel_batch(parts[1])
+            if batch is None:
+                self._send_error(404, "Không tìm thấy batch")
+            else:
+                self._send_json(202, batch.to_dict())
+        else:
+            self._send_error(404, "Not found")
+
+    def _stream_events(self, batch, since):
+        """Chunked JSON lines: gửi sự kiện mới ngay khi có, dòng trống để giữ kết nối, đóng khi batch kết thúc"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        seq = max(0, since)
+        try:
+            while True:
+                events, closed = batch.events_since(seq, EVENT_STREAM_KEEPALIVE_SEC)
+                data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events) or "\n"
+                chunk = data.encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+                seq += len(events)
+                if closed:
+                    break
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _send_output(self, batch, stt):
+        try:
+            job = batch.jobs.get(int(stt))
+        except ValueError:
+            job = None
+        if job is None:
+            self._send_error(404, "Không tìm thấy STT trong batch")
+            return
+        output = job.get("output")
+        if job["state"] != "done" or not output or not os.path.isfile(output):
+            self._send_error(409, f"STT {stt} chưa có video ({job['state']})")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(os.path.getsize(output)))
+        self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(output)}"')
+        self.end_headers()
+        with open(output, "rb") as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m daemon", description="Veo3 AI video generator (HTTP API)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--accounts", default="accounts.json", help="File tài khoản (mặc định: accounts.json)")
+    parser.add_argument("--workers", type=int, default=5, help="Số video song song mỗi tài khoản nếu batch không chỉ định")
+    parser.add_argument("--key", help="KEY bản quyền; mặc định dùng key đã lưu từ giao diện")
+    parser.add_argument("--auth-token", default=os.environ.get("VEO3_DAEMON_TOKEN"), help="Yêu cầu header Authorization: Bearer <token>")
+    args = parser.parse_args(argv)
+
+    ok, message = check_license(args.key)
+    if not ok:
+        print(f"❌ KEY không hợp lệ: {message}", file=sys.stderr)
+        return 2
+
+    video_daemon = VideoDaemon(args.accounts, args.workers)
+    video_daemon.start()
+    server = ThreadingHTTPServer((args.host, args.port), DaemonRequestHandler)
+    server.daemon_threads = True
+    server.video_daemon = video_daemon
+    server.auth_token = args.auth_token
+
+    def on_signal(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    print(f"🚀 Daemon đang chạy tại http://{args.host}:{args.port} với {len(video_daemon.valid_accounts)} tài khoản hợp lệ", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        video_daemon.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,744 @@
+"""Chạy phân tán: một coordinator giữ hàng đợi job và journal, nhiều worker (máy khác hoặc cùng máy) lease job
+
+    python -m distributed --auth-token SECRET coordinator --input prompts.xlsx --output-dir output --host 0.0.0.0 --port 8766
+    python -m distributed --auth-token SECRET worker --coordinator http://10.0.0.5:8766 --accounts accounts_a.json --workers 5
+
+Coordinator mặc định chỉ nghe trên 127.0.0.1; mở ra mạng thì bắt buộc có token (hoặc VEO3_CLUSTER_TOKEN).
+
+Worker đăng ký các tài khoản của mình, lease job theo số luồng rảnh, gửi heartbeat để gia hạn lease
+và báo kết quả (kèm upload file video về coordinator). Lease của worker chết (hết hạn không heartbeat)
+trả job về hàng đợi. Mỗi dòng stdout là một sự kiện JSON như CLI.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import socket
+import signal
+import argparse
+import ipaddress
+import threading
+from collections import OrderedDict
+from concurrent.futures import wait, FIRST_COMPLETED
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+from api import AccountAuthError, _load_config, read_excel_prompts
+from core import VideoProcessingCore, aspect_ratio_from_text, filter_valid_accounts
+from pipeline import job_output_path
+from job_journal import JobJournal, STATE_QUEUED, STATE_DONE, STATE_FAILED
+from cli import EventWriter, EXIT_OK, EXIT_FAILED, EXIT_USAGE, EXIT_STOPPED, check_license, load_accounts
+
+
+DEFAULT_COORDINATOR_PORT = 8766
+DEFAULT_COORDINATOR_JOURNAL = "coordinator_journal.db"
+LEASE_SEC = 90  # Lease hết hạn nếu worker không heartbeat trong khoảng này
+HEARTBEAT_SEC = 15
+MAX_LEASE_ATTEMPTS = 3  # Số lần lease hết hạn tối đa trước khi coordinator đánh dấu job thất bại
+IDLE_POLL_SEC = 5  # Worker rảnh hỏi lại coordinator sau khoảng này
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_ATTEMPTS = 3  # Số lần thử upload video về coordinator trước khi trả job lại hàng đợi
+UPLOAD_RETRY_SEC = 5
+REQUEST_TIMEOUT = (10, 60)
+
+JOB_PENDING = "pending"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+LEASE_LOST_MESSAGE = "Lease hết hạn, job đã được giao cho worker khác"
+
+
+# --- Coordinator ---
+
+class Coordinator:
+    """Hàng đợi job dùng chung: lease theo worker, gia hạn bằng heartbeat, lease hết hạn thì trả về hàng đợi"""
+
+    def __init__(self, prompts, config, journal_file=DEFAULT_COORDINATOR_JOURNAL, lease_sec=LEASE_SEC, on_event=None):
+        self.config = config
+        self.lease_sec = lease_sec
+        self.on_event = on_event or (lambda event, **fields: None)
+        self.journal = JobJournal(journal_file)
+        self.workers = {}  # worker_id -> {"accounts", "capacity", "host", "last_seen"}
+        self.jobs = OrderedDict()
+        self._cond = threading.Condition()
+
+        for stt, prompt, image_path in prompts:
+            output_path = job_output_path(config, stt, prompt)
+            job_key = JobJournal.job_key(stt, prompt, output_path)
+            job = {
+                "stt": stt, "prompt": prompt, "image_path": image_path, "job_key": job_key,
+                "state": JOB_PENDING, "worker": None, "lease_expires": None, "attempts": 0,
+                "account": None, "result": None, "output": output_path,
+            }
+            if JobJournal.is_verified(self.journal.get(job_key)):
+                # Coordinator khởi động lại: STT đã có video hoàn chỉnh thì không giao nữa
+                job.update(state=JOB_DONE, result=os.path.basename(output_path))
+            else:
+                self.journal.record(job_key, STATE_QUEUED, stt=stt, prompt=prompt, image_path=image_path,
+                                    output_path=output_path, error=None)
+            self.jobs[stt] = job
+
+    def _expire_leases_locked(self, now):
+        for job in self.jobs.values():
+            if job["state"] == JOB_LEASED and job["lease_expires"] <= now:
+                worker_id = job["worker"]
+                if job["attempts"] >= MAX_LEASE_ATTEMPTS:
+                    error = f"Lease hết hạn {job['attempts']} lần (worker cuối: {worker_id})"
+                    job.update(state=JOB_FAILED, worker=None, lease_expires=None, result=error)
+                    self.journal.record(job["job_key"], STATE_FAILED, error, error=error)
+                    self.on_event("result", stt=job["stt"], worker=worker_id, success=False, result=error)
+                else:
+                    job.update(state=JOB_PENDING, worker=None, lease_expires=None)
+                    self.journal.record(job["job_key"], STATE_QUEUED, f"lease của {worker_id} hết hạn")
+                    self.on_event("requeued", stt=job["stt"], worker=worker_id)
+                self._cond.notify_all()
+
+    def register(self, worker_id, accounts, capacity, host):
+        with self._cond:
+            self.workers[worker_id] = {"accounts": accounts, "capacity": capacity, "host": host, "last_seen": time.time()}
+        self.on_event("worker_registered", worker=worker_id, accounts=accounts, capacity=capacity, host=host)
+        return {"config": self.config, "lease_sec": self.lease_sec, "heartbeat_sec": HEARTBEAT_SEC}
+
+    def heartbeat(self, worker_id, held):
+        """Gia hạn lease của các STT worker còn giữ; trả về các STT worker đã mất lease"""
+        now = time.time()
+        lost = []
+        with self._cond:
+            if worker_id in self.workers:
+                self.workers[worker_id]["last_seen"] = now
+            self._expire_leases_locked(now)
+            for stt in held:
+                job = self.jobs.get(stt)
+                if job is not None and job["state"] == JOB_LEASED and job["worker"] == worker_id:
+                    job["lease_expires"] = now + self.lease_sec
+                else:
+                    lost.append(stt)
+            return {"lost": lost, "finished": self.finished}
+
+    def lease(self, worker_id, max_jobs):
+        now = time.time()
+        leased = []
+        with self._cond:
+            if worker_id in self.workers:
+                self.workers[worker_id]["last_seen"] = now
+            self._expire_leases_locked(now)
+            for job in self.jobs.values():
+                if len(leased) >= max_jobs:
+                    break
+                if job["state"] == JOB_PENDING:
+                    job.update(state=JOB_LEASED, worker=worker_id, lease_expires=now + self.lease_sec)
+                    job["attempts"] += 1
+                    leased.append({"stt": job["stt"], "prompt": job["prompt"], "image_path": job["image_path"]})
+            finished = self.finished
+        for item in leased:
+            self.on_event("leased", stt=item["stt"], worker=worker_id)
+        return {"jobs": leased, "finished": finished}
+
+    def release(self, worker_id, stts):
+        """Worker trả lại job chưa chạy (hết tài khoản dùng được / dừng)"""
+        with self._cond:
+            for stt in stts:
+                job = self.jobs.get(stt)
+                if job is not None and job["state"] == JOB_LEASED and job["worker"] == worker_id:
+                    job["attempts"] -= 1
+                    job.update(state=JOB_PENDING, worker=None, lease_expires=None)
+                    self.on_event("requeued", stt=stt, worker=worker_id)
+            self._cond.notify_all()
+
+    def report(self, worker_id, stt, success, result, account=None, output_size=None, uploaded=False):
+        with self._cond:
+            job = self.jobs.get(stt)
+            if job is None or job["state"] in (JOB_DONE, JOB_FAILED):
+                return {"accepted": False}
+            if job["worker"] != worker_id and not success:
+                # Lease đã chuyển sang worker khác: bỏ qua kết quả lỗi của worker cũ
+                return {"accepted": False}
+            if success:
+                output = job["output"] if uploaded else f"{worker_id}:{result}"
+                job.update(state=JOB_DONE, worker=worker_id, lease_expires=None, account=account, result=result, output=output)
+                fields = {"output_size": output_size} if uploaded else {}
+                self.journal.record(job["job_key"], STATE_DONE, f"worker {worker_id}", account=account, error=None, **fields)
+            else:
+                job.update(state=JOB_FAILED, lease_expires=None, account=account, result=result)
+                self.journal.record(job["job_key"], STATE_FAILED, f"worker {worker_id}", account=account, error=result)
+            self._cond.notify_all()
+        self.on_event("result", stt=stt, worker=worker_id, account=account, success=success, result=result)
+        return {"accepted": True}
+
+    def output_path(self, stt):
+        job = self.jobs.get(stt)
+        return job["output"] if job is not None else None
+
+    def is_leased_to(self, stt, worker_id):
+        """Job đang được lease cho worker_id (chỉ worker đó được upload video của job)"""
+        with self._cond:
+            job = self.jobs.get(stt)
+            return job is not None and job["state"] == JOB_LEASED and job["worker"] == worker_id
+
+    def image_path(self, stt):
+        job = self.jobs.get(stt)
+        return job["image_path"] if job is not None else None
+
+    @property
+    def finished(self):
+        return all(job["state"] in (JOB_DONE, JOB_FAILED) for job in self.jobs.values())
+
+    def wait_finished(self, stop_event, poll_sec=1.0):
+        """Chờ tới khi mọi job xong/thất bại (hoặc bị dừng); lease hết hạn được xử lý trong lúc chờ"""
+        with self._cond:
+            while not self.finished and not stop_event.is_set():
+                self._expire_leases_locked(time.time())
+                self._cond.wait(poll_sec)
+            return self.finished
+
+    def status(self):
+        with self._cond:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["state"]] = counts.get(job["state"], 0) + 1
+            return {
+                "counts": counts,
+                "finished": self.finished,
+                "workers": {worker_id: dict(info) for worker_id, info in self.workers.items()},
+                "jobs": [{k: v for k, v in job.items() if k != "job_key"} for job in self.jobs.values()],
+            }
+
+
+_WORKER_PATH = re.compile(r"^/workers/([\w.-]+)/(register|heartbeat|lease|release|results)$")
+_JOB_PATH = re.compile(r"^/jobs/(\d+)/(image|output)$")
+
+
+class CoordinatorRequestHandler(BaseHTTPRequestHandler):
+    server_version = "Veo3AICoordinator/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def coordinator(self):
+        return self.server.coordinator
+
+    def log_message(self, format, *args):
+        print(f"[coordinator] {self.address_string()} {format % args}", file=sys.stderr)
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        token = self.server.auth_token
+        if not token or self.headers.get("Authorization") == f"Bearer {token}":
+            return True
+        self._send_json(401, {"error": "Unauthorized"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        path = urlparse(self.path).path
+        match = _JOB_PATH.match(path)
+        if path == "/status":
+            self._send_json(200, self.coordinator.status())
+        elif match and match.group(2) == "image":
+            image_path = self.coordinator.image_path(int(match.group(1)))
+            if not image_path or not os.path.isfile(image_path):
+                self._send_json(404, {"error": "Không có image"})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.path.getsize(image_path)))
+            self.end_headers()
+            with open(image_path, "rb") as f:
+                while True:
+                    chunk = f.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_PUT(self):
+        """Worker upload video của STT (ghi file tạm rồi rename)"""
+        if not self._authorized():
+            return
+        match = _JOB_PATH.match(urlparse(self.path).path)
+        if not match or match.group(2) != "output":
+            self._send_json(404, {"error": "Not found"})
+            return
+        stt = int(match.group(1))
+        worker_id = self.headers.get("X-Worker-Id")
+        output_path = self.coordinator.output_path(stt)
+        if output_path is None:
+            self._send_json(404, {"error": "Không tìm thấy STT"})
+            return
+        if not self.coordinator.is_leased_to(stt, worker_id):
+            # Job đã xong/lease đã chuyển sang worker khác: không ghi đè video
+            self._send_json(409, {"error": "Job không được lease cho worker này"})
+            return
+        remaining = int(self.headers.get("Content-Length") or 0)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        temp_path = f"{output_path}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            with open(temp_path, "wb") as f:
+                while remaining > 0:
+                    chunk = self.rfile.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise ConnectionError("Upload bị ngắt giữa chừng")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            if not self.coordinator.is_leased_to(stt, worker_id):
+                raise PermissionError("Lease đã hết hạn trong lúc upload")
+            os.replace(temp_path, output_path)
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            self._send_json(409 if isinstance(e, PermissionError) else 500, {"error": str(e)})
+            return
+        self._send_json(200, {"size": os.path.getsize(output_path)})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        match = _WORKER_PATH.match(urlparse(self.path).path)
+        if not match:
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length).decode("utf-8")) if length else {}
+        except (ValueError, UnicodeDecodeError):
+            self._send_json(400, {"error": "Body không phải JSON hợp lệ"})
+            return
+
+        worker_id, action = match.groups()
+        coordinator = self.coordinator
+        if action == "register":
+            data = coordinator.register(worker_id, body.get("accounts", []), int(body.get("capacity", 1)), body.get("host"))
+        elif action == "heartbeat":
+            data = coordinator.heartbeat(worker_id, [int(stt) for stt in body.get("held", [])])
+        elif action == "lease":
+            data = coordinator.lease(worker_id, max(0, int(body.get("max_jobs", 1))))
+        elif action == "release":
+            coordinator.release(worker_id, [int(stt) for stt in body.get("stts", [])])
+            data = {"released": True}
+        else:
+            data = coordinator.report(
+                worker_id, int(body["stt"]), bool(body.get("success")), body.get("result"),
+                account=body.get("account"), output_size=body.get("output_size"), uploaded=bool(body.get("uploaded"))
+            )
+        self._send_json(200, data)
+
+
+def is_loopback_host(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def run_coordinator(args, events):
+    if not args.auth_token and not is_loopback_host(args.host):
+        # Coordinator phát image và nhận video ghi vào ổ đĩa: không mở ra mạng khi chưa có token
+        events.emit("error", message="Cần --auth-token (hoặc VEO3_CLUSTER_TOKEN) khi coordinator lắng nghe ngoài localhost")
+        return EXIT_USAGE
+    try:
+        prompts = read_excel_prompts(args.input, args.require_image)
+    except (OSError, ValueError, SystemExit) as e:
+        events.emit("error", message=f"Lỗi đọc đầu vào: {e}")
+        return EXIT_USAGE
+    if not prompts:
+        events.emit("error", message="Không có prompt nào để xử lý")
+        return EXIT_USAGE
+
+    file_config = _load_config()
+    aspect_ratio = aspect_ratio_from_text(args.aspect_ratio)
+    config = {
+        "project_id": args.project_id or file_config.get("project_id", ""),
+        "seed": args.seed if args.seed is not None else file_config.get("seed", 0),
+        "output_dir": args.output_dir,
+        "aspect_ratio": aspect_ratio,
+        # Chỉ cho phép upscale 1080p khi aspect ratio là 16:9 (landscape)
+        "use_upscale": args.resolution == "1080p" and aspect_ratio == "VIDEO_ASPECT_RATIO_LANDSCAPE",
+    }
+    os.makedirs(config["output_dir"], exist_ok=True)
+
+    coordinator = Coordinator(prompts, config, journal_file=args.journal, lease_sec=args.lease_sec, on_event=events.emit)
+    server = ThreadingHTTPServer((args.host, args.port), CoordinatorRequestHandler)
+    server.daemon_threads = True
+    server.coordinator = coordinator
+    server.auth_token = args.auth_token
+    threading.Thread(target=server.serve_forever, name="coordinator-http", daemon=True).start()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    events.emit("start", role="coordinator", total=len(prompts), address=f"http://{args.host}:{args.port}")
+    try:
+        finished = coordinator.wait_finished(stop_event)
+        # Để worker kịp nhận "finished" qua lease/heartbeat trước khi đóng server
+        if finished:
+            time.sleep(min(HEARTBEAT_SEC, IDLE_POLL_SEC) + 1)
+    finally:
+        server.shutdown()
+        server.server_close()
+        coordinator.journal.close()
+
+    status = coordinator.status()
+    failed_stt = [job["stt"] for job in status["jobs"] if job["state"] != JOB_DONE]
+    events.emit("done", total=len(prompts), successful=status["counts"].get(JOB_DONE, 0),
+                failed=len(failed_stt), stopped=not finished, failed_stt=failed_stt)
+    if not finished:
+        return EXIT_STOPPED
+    return EXIT_FAILED if failed_stt else EXIT_OK
+
+
+# --- Worker ---
+
+class CoordinatorClient:
+    """Gọi API của coordinator (không đi qua proxy/rate limit của tài khoản)"""
+
+    def __init__(self, base_url, worker_id, auth_token=None):
+        self.base_url = base_url.rstrip("/")
+        self.worker_id = worker_id
+        self.session = requests.Session()
+        if auth_token:
+            self.session.headers["Authorization"] = f"Bearer {auth_token}"
+
+    def _post(self, action, payload):
+        resp = self.session.post(f"{self.base_url}/workers/{self.worker_id}/{action}", json=payload, timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()
+
+    def register(self, accounts, capacity):
+        return self._post("register", {"accounts": accounts, "capacity": capacity, "host": socket.gethostname()})
+
+    def heartbeat(self, held):
+        return self._post("heartbeat", {"held": held})
+
+    def lease(self, max_jobs):
+        return self._post("lease", {"max_jobs": max_jobs})
+
+    def release(self, stts):
+        return self._post("release", {"stts": stts})
+
+    def report(self, stt, success, result, account, output_size=None, uploaded=False):
+        return self._post("results", {
+            "stt": stt, "success": success, "result": result, "account": account,
+            "output_size": output_size, "uploaded": uploaded,
+        })
+
+    def download_image(self, stt, target_path):
+        with self.session.get(f"{self.base_url}/jobs/{stt}/image", stream=True, timeout=REQUEST_TIMEOUT) as resp:
+            resp.raise_for_status()
+            temp_path = target_path + ".part"
+            with open(temp_path, "wb") as f:
+                for chunk in resp.iter_content(UPLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(temp_path, target_path)
+
+    def upload_output(self, stt, file_path):
+        with open(file_path, "rb") as f:
+            resp = self.session.put(
+                f"{self.base_url}/jobs/{stt}/output", data=f,
+                headers={"Content-Length": str(os.path.getsize(file_path)), "Content-Type": "video/mp4", "X-Worker-Id": self.worker_id},
+                timeout=REQUEST_TIMEOUT
+            )
+        resp.raise_for_status()
+        return resp.json()
+
+
+class LeasedProcessingCore(VideoProcessingCore):
+    """VideoProcessingCore lấy job từ coordinator thay vì danh sách prompt cố định
+
+    Giữ cách phân job của lượt chạy thường (mỗi account tối đa `threads` video, account lỗi xác thực
+    thì job chuyển sang account khác), chỉ khác là hàng đợi được nạp thêm bằng lease khi có luồng rảnh.
+    """
+
+    def __init__(self, client, accounts_data, config, max_workers, image_dir, upload_outputs=True, on_event=None):
+        self.client = client
+        self.image_dir = image_dir
+        self.upload_outputs = upload_outputs
+        self.on_event = on_event or (lambda event, **fields: None)
+        self.coordinator_finished = False
+        self._held = set()  # STT đang giữ lease (trong hàng đợi local hoặc đang chạy)
+        self._held_lock = threading.Lock()
+        self._idle = threading.Event()
+        super().__init__(
+            [], accounts_data, config, max_workers,
+            on_status=lambda message: self.on_event("status", message=message)
+        )
+
+    def held_stts(self):
+        with self._held_lock:
+            return sorted(self._held)
+
+    def _drop_held(self, stts):
+        with self._held_lock:
+            self._held.difference_update(stts)
+
+    def stop_processing(self):
+        super().stop_processing()
+        self._idle.set()
+
+    def free_slots(self, in_flight):
+        active = [name for name in self.account_slots if name not in self.retired_accounts]
+        capacity = sum(self.account_slots[name]['threads'] for name in active)
+        return max(0, capacity - len(in_flight) - len(self.job_queue))
+
+    def lease_jobs(self, in_flight):
+        """Lease thêm job cho đủ số luồng rảnh của các account còn dùng được"""
+        free = self.free_slots(in_flight)
+        if free <= 0 or self.should_stop:
+            return
+        data = self.client.lease(free)
+        self.coordinator_finished = data.get("finished", False)
+        for item in data.get("jobs", []):
+            stt, prompt, image_path = item["stt"], item["prompt"], item.get("image_path")
+            with self._held_lock:
+                self._held.add(stt)
+            try:
+                image_path = self.local_image(stt, image_path)
+            except Exception as e:
+                # Lỗi mạng tạm thời: trả lease để lần lease sau (hoặc worker khác) thử lại
+                self.release_jobs([stt], f"STT {stt}: ⚠️ Không tải được image từ coordinator, trả job lại: {e}")
+                continue
+            self.job_queue.append((stt, prompt, image_path))
+
+    def local_image(self, stt, image_path):
+        """Image không có trên máy worker thì tải từ coordinator"""
+        if not image_path or os.path.exists(image_path):
+            return image_path
+        os.makedirs(self.image_dir, exist_ok=True)
+        target_path = os.path.join(self.image_dir, f"{stt}_{os.path.basename(image_path)}")
+        if not os.path.exists(target_path):
+            self.client.download_image(stt, target_path)
+        return target_path
+
+    def release_jobs(self, stts, message):
+        """Trả lease về coordinator để job được lease lại; lỗi mạng thì để lease tự hết hạn"""
+        self.on_event("status", message=message)
+        try:
+            self.client.release(stts)
+        except requests.RequestException as e:
+            self.on_event("status", message=f"⚠️ Không trả được job cho coordinator (lease sẽ tự hết hạn): {e}")
+        self._drop_held(stts)
+
+    def upload_output(self, stt, prompt):
+        """Upload video về coordinator, thử lại khi lỗi mạng; trả về kích thước file, None nếu không upload được"""
+        output_path = job_output_path(self.config, stt, prompt)
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                return self.client.upload_output(stt, output_path)["size"]
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 409:
+                    # Lease đã chuyển sang worker khác: không thử lại
+                    self.on_event("status", message=f"STT {stt}: ⚠️ {LEASE_LOST_MESSAGE}")
+                    return None
+                error = e
+            except (OSError, ValueError, requests.RequestException) as e:
+                error = e
+            self.on_event("status", message=f"STT {stt}: ⚠️ Upload video về coordinator lỗi ({attempt}/{UPLOAD_ATTEMPTS}): {error}")
+            if attempt < UPLOAD_ATTEMPTS and not self.should_stop:
+                time.sleep(UPLOAD_RETRY_SEC * attempt)
+        return None
+
+    def report(self, account_name, result):
+        stt, prompt, success, detail = result
+        output_size = None
+        uploaded = False
+        if success and self.upload_outputs:
+            output_size = self.upload_output(stt, prompt)
+            if output_size is None:
+                # Coordinator không có video thì không tính là xong: trả job để chạy lại
+                self.release_jobs([stt], f"STT {stt}: ⚠️ Không upload được video về coordinator, trả job lại hàng đợi")
+                self.on_event("result", stt=stt, account=account_name, success=False, result=detail, uploaded=False)
+                return
+            uploaded = True
+        try:
+            self.client.report(stt, success, detail, account_name, output_size, uploaded)
+        except Exception as e:
+            self.on_event("status", message=f"STT {stt}: ⚠️ Không báo được kết quả cho coordinator: {e}")
+        self._drop_held([stt])
+        self.on_event("result", stt=stt, account=account_name, success=success, result=detail, uploaded=uploaded)
+
+    def on_job_finished(self, account_name, result):
+        self.processed_count += 1
+        self.report(account_name, result)
+
+    def run_leased_jobs(self):
+        """Lease -> chạy -> báo kết quả cho tới khi coordinator hết job hoặc worker bị dừng"""
+        in_flight = {}  # future -> (account_name, prompt_data)
+        try:
+            while not self.should_stop:
+                try:
+                    self.lease_jobs(in_flight)
+                except requests.RequestException as e:
+                    self.on_event("status", message=f"⚠️ Không lease được job từ coordinator: {e}")
+                self.fill_account_slots(in_flight)
+
+                if not in_flight:
+                    if self.job_queue:
+                        # Còn job nhưng mọi account đều lỗi xác thực
+                        self.on_event("status", message="❌ Tất cả tài khoản đều lỗi xác thực, trả job về coordinator")
+                        break
+                    if self.coordinator_finished:
+                        break
+                    self._idle.wait(IDLE_POLL_SEC)
+                    continue
+
+                done, _ = wait(list(in_flight), timeout=IDLE_POLL_SEC, return_when=FIRST_COMPLETED)
+                for future in done:
+                    account_name, prompt_data = in_flight.pop(future)
+                    stt, prompt, image_path = prompt_data
+                    try:
+                        result = future.result()
+                    except AccountAuthError as e:
+                        self.retire_account(account_name, str(e))
+                        self.job_queue.appendleft(prompt_data)
+                        continue
+                    except Exception as e:
+                        result = (stt, prompt, False, str(e))
+                    if self.should_stop and not result[2]:
+                        # Job dừng giữa chừng: trả về coordinator thay vì báo thất bại
+                        continue
+                    self.on_job_finished(account_name, result)
+
+            if in_flight:
+                # Bị dừng: chờ các job đang chạy kết thúc ở stage kế tiếp
+                for future, (account_name, prompt_data) in list(in_flight.items()):
+                    try:
+                        result = future.result()
+                    except Exception:
+                        continue
+                    if result[2]:
+                        self.on_job_finished(account_name, result)
+        finally:
+            self.pipeline.shutdown(wait=False)
+            leftover = self.held_stts()
+            if leftover:
+                try:
+                    self.client.release(leftover)
+                except requests.RequestException as e:
+                    self.on_event("status", message=f"⚠️ Không trả được job cho coordinator (lease sẽ tự hết hạn): {e}")
+                self._drop_held(leftover)
+            self.journal.close()
+        return self.processed_count
+
+
+def run_worker(args, events):
+    ok, message = check_license(args.key)
+    if not ok:
+        events.emit("error", message=f"KEY không hợp lệ: {message}")
+        return EXIT_USAGE
+    try:
+        accounts = load_accounts(args.accounts)
+    except (OSError, ValueError) as e:
+        events.emit("error", message=f"Lỗi đọc file tài khoản: {e}")
+        return EXIT_USAGE
+    valid_accounts = filter_valid_accounts(accounts, log=lambda message: events.emit("status", message=message))
+    if not valid_accounts:
+        events.emit("error", message="Không có tài khoản nào hợp lệ")
+        return EXIT_USAGE
+
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    client = CoordinatorClient(args.coordinator, worker_id, args.auth_token)
+    account_names = [a.get("name", "Unknown") for a in valid_accounts]
+    try:
+        registration = client.register(account_names, args.workers * len(valid_accounts))
+    except requests.RequestException as e:
+        events.emit("error", message=f"Không kết nối được coordinator: {e}")
+        return EXIT_USAGE
+
+    # Cấu hình chạy do coordinator quyết định, chỉ thư mục output là của worker
+    config = dict(registration["config"], output_dir=args.output_dir, max_workers=args.workers)
+    os.makedirs(config["output_dir"], exist_ok=True)
+    core = LeasedProcessingCore(
+        client, valid_accounts, config, args.workers,
+        image_dir=os.path.join(args.output_dir, "_images"), upload_outputs=not args.no_upload, on_event=events.emit
+    )
+
+    stop_heartbeat = threading.Event()
+
+    def heartbeat_loop():
+        while not stop_heartbeat.wait(registration.get("heartbeat_sec", HEARTBEAT_SEC)):
+            try:
+                data = client.heartbeat(core.held_stts())
+            except requests.RequestException as e:
+                events.emit("status", message=f"⚠️ Heartbeat lỗi: {e}")
+                continue
+            if data.get("lost"):
+                # Job vẫn chạy tiếp; coordinator nhận video nếu chưa worker nào xong trước
+                events.emit("status", message=f"⚠️ Mất lease STT {data['lost']}")
+
+    def on_signal(signum, frame):
+        events.emit("status", message="⏹️ Đang dừng worker, job chưa xong sẽ được trả về coordinator...")
+        core.stop_processing()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    events.emit("start", role="worker", worker=worker_id, accounts=account_names, workers=args.workers)
+    heartbeat_thread = threading.Thread(target=heartbeat_loop, name="worker-heartbeat", daemon=True)
+    heartbeat_thread.start()
+    try:
+        processed = core.run_leased_jobs()
+    finally:
+        stop_heartbeat.set()
+    events.emit("done", worker=worker_id, processed=processed, stopped=core.should_stop)
+    return EXIT_STOPPED if core.should_stop else EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m distributed", description="Veo3 AI video generator (phân tán)")
+    parser.add_argument("--auth-token", default=os.environ.get("VEO3_CLUSTER_TOKEN"), help="Token dùng chung giữa coordinator và worker")
+    sub = parser.add_subparsers(dest="role", required=True)
+
+    coordinator = sub.add_parser("coordinator", help="Giữ hàng đợi job và journal")
+    coordinator.add_argument("--input", required=True, help="File Excel/CSV: cột STT, PROMPT, IMAGE_PATH (tùy chọn)")
+    coordinator.add_argument("--output-dir", default="output", help="Thư mục nhận video từ worker")
+    coordinator.add_argument("--host", default="127.0.0.1", help="Mở cho máy khác (vd. 0.0.0.0) thì bắt buộc có --auth-token")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_COORDINATOR_PORT)
+    coordinator.add_argument("--journal", default=DEFAULT_COORDINATOR_JOURNAL)
+    coordinator.add_argument("--lease-sec", type=int, default=LEASE_SEC)
+    coordinator.add_argument("--aspect-ratio", choices=["16:9", "9:16"], default="16:9")
+    coordinator.add_argument("--resolution", choices=["720p", "1080p"], default="720p")
+    coordinator.add_argument("--project-id")
+    coordinator.add_argument("--seed", type=int)
+    coordinator.add_argument("--require-image", action="store_true")
+
+    worker = sub.add_parser("worker", help="Đăng ký tài khoản, lease và xử lý job")
+    worker.add_argument("--coordinator", required=True, help="URL coordinator, vd. http://10.0.0.5:8766")
+    worker.add_argument("--accounts", default="accounts.json")
+    worker.add_argument("--output-dir", default="worker_output")
+    worker.add_argument("--workers", type=int, default=5, help="Số video song song mỗi tài khoản")
+    worker.add_argument("--worker-id")
+    worker.add_argument("--no-upload", action="store_true", help="Không upload video về coordinator (dùng chung ổ đĩa)")
+    worker.add_argument("--key", help="KEY bản quyền; mặc định dùng key đã lưu từ giao diện")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    events = EventWriter(sys.stdout)
+    sys.stdout = sys.stderr
+    try:
+        if args.role == "coordinator":
+            return run_coordinator(args, events)
+        return run_worker(args, events)
+    except Exception as e:
+        events.emit("error", message=str(e))
+        return EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
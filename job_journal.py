@@ -0,0 +1,110 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+DEFAULT_JOURNAL_FILE = "job_journal.db"
+
+# Trạng thái của một STT trong journal
+STATE_QUEUED = "QUEUED"
+STATE_UPLOADED = "UPLOADED"
+STATE_SUBMITTED = "SUBMITTED"  # Đã có operation trên server (đã tốn credit)
+STATE_GENERATED = "GENERATED"
+STATE_UPSCALE_SUBMITTED = "UPSCALE_SUBMITTED"
+STATE_DONE = "DONE"
+STATE_FAILED = "FAILED"
+
+# Các trạng thái còn operation đang chạy trên server: lần chạy sau poll tiếp thay vì generate lại
+RESUMABLE_STATES = (STATE_SUBMITTED, STATE_GENERATED, STATE_UPSCALE_SUBMITTED)
+
+JOB_FIELDS = (
+    "stt", "prompt", "image_path", "account", "state", "operation_name", "scene_id", "model_key",
+    "image_media_id", "video_media_id", "upscale_operation_name", "upscale_scene_id",
+    "output_path", "output_size", "error", "updated_at",
+)
+
+
+class JobJournal:
+    """Journal SQLite ghi lại từng bước của mỗi STT để resume sau khi app crash/bị dừng"""
+
+    def __init__(self, db_file=DEFAULT_JOURNAL_FILE):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            # WAL: ghi từng transition xuống đĩa ngay mà không khóa người đọc
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_key TEXT PRIMARY KEY, stt INTEGER, prompt TEXT, image_path TEXT, account TEXT, "
+                "state TEXT, operation_name TEXT, scene_id TEXT, model_key TEXT, "
+                "image_media_id TEXT, video_media_id TEXT, upscale_operation_name TEXT, upscale_scene_id TEXT, "
+                "output_path TEXT, output_size INTEGER, error TEXT, updated_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS transitions ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, job_key TEXT, state TEXT, detail TEXT, created_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_transitions_job ON transitions (job_key)")
+
+    @staticmethod
+    def job_key(stt, prompt, output_path):
+        """Key của job: cùng STT nhưng prompt/thư mục output khác thì là job khác"""
+        digest = hashlib.sha256(f"{prompt}\x00{os.path.abspath(output_path)}".encode("utf-8")).hexdigest()[:16]
+        return f"{stt}:{digest}"
+
+    def get(self, job_key):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_key = ?", (job_key,)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, job_key, state, detail=None, **fields):
+        """Ghi trạng thái mới của job (upsert) và thêm một dòng transition"""
+        unknown = set(fields) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f"Trường journal không hợp lệ: {', '.join(sorted(unknown))}")
+        now = time.time()
+        fields = dict(fields, state=state, updated_at=now)
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO jobs (job_key, {columns}) VALUES (?, {placeholders}) "
+                f"ON CONFLICT(job_key) DO UPDATE SET {updates}",
+                (job_key, *fields.values())
+            )
+            self._conn.execute(
+                "INSERT INTO transitions (job_key, state, detail, created_at) VALUES (?, ?, ?, ?)",
+                (job_key, state, detail, now)
+            )
+
+    def history(self, job_key):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, detail, created_at FROM transitions WHERE job_key = ? ORDER BY id", (job_key,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def is_verified(entry):
+        """Job đã xong và file output còn nguyên (đúng kích thước đã ghi khi tải xong)"""
+        if not entry or entry.get("state") != STATE_DONE:
+            return False
+        output_path = entry.get("output_path")
+        if not output_path or not os.path.isfile(output_path):
+            return False
+        size = os.path.getsize(output_path)
+        return size > 0 and (not entry.get("output_size") or size == entry["output_size"])
+
+    @staticmethod
+    def is_resumable(entry):
+        return bool(entry and entry.get("state") in RESUMABLE_STATES and entry.get("operation_name"))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
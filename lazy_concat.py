@@ -0,0 +1,140 @@
+import bisect
+
+import numpy as np
+from moviepy.editor import VideoFileClip, AudioFileClip, VideoClip, AudioClip
+
+from mp4_probe import MP4_EXTENSIONS, probe_mp4
+
+
+AUDIO_FPS = 44100
+AUDIO_CHANNELS = 2
+
+
+def _clip_info(path):
+    """(duration, (width, height), fps, has_audio) - đọc box MP4 nếu được, không thì mở clip rồi đóng ngay"""
+    if path.lower().endswith(MP4_EXTENSIONS):
+        try:
+            info = probe_mp4(path)
+            if info["video"] and info["duration"] and info["fps"]:
+                return info["duration"], (info["width"], info["height"]), info["fps"], info["has_audio"]
+        except (OSError, ValueError):
+            pass
+    clip = VideoFileClip(path)
+    try:
+        return clip.duration, tuple(clip.size), clip.fps, clip.audio is not None
+    finally:
+        clip.close()
+
+
+class _Cursor:
+    """Giữ tối đa một clip mở; chuyển sang clip khác thì đóng clip cũ (reader ffmpeg + buffer)"""
+
+    def __init__(self, opener):
+        self.opener = opener
+        self.index = None
+        self.clip = None
+
+    def get(self, index):
+        if index != self.index:
+            self.close()
+            self.clip = self.opener(index)
+            self.index = index
+        return self.clip
+
+    def close(self):
+        if self.clip is not None:
+            try:
+                self.clip.close()
+            except Exception:
+                pass
+        self.clip = None
+        self.index = None
+
+
+class LazyConcatenation:
+    """Nối nhiều video như concatenate_videoclips nhưng chỉ mở clip đang được ghi
+
+    write_videofile đọc audio rồi video theo thứ tự thời gian, nên mỗi luồng chỉ cần một clip mở
+    tại một thời điểm: bộ nhớ và số tiến trình ffmpeg không tăng theo số clip.
+    Frame khác kích thước clip đầu được đặt giữa khung (cắt hoặc viền đen).
+    """
+
+    def __init__(self, video_paths, log=print):
+        self.paths = []
+        self.starts = []
+        self.has_audio = []
+        duration = 0.0
+        size = None
+        fps = 0
+        for i, path in enumerate(video_paths):
+            try:
+                clip_duration, clip_size, clip_fps, clip_audio = _clip_info(path)
+            except Exception as e:
+                log(f"⚠️ Lỗi load video {i+1}: {str(e)}")
+                continue
+            self.paths.append(path)
+            self.starts.append(duration)
+            self.has_audio.append(clip_audio)
+            duration += clip_duration
+            size = size or clip_size
+            fps = max(fps, clip_fps or 0)
+        self.duration = duration
+        self.size = size
+        self.fps = fps
+        self._video = _Cursor(lambda i: VideoFileClip(self.paths[i], audio=False))
+        self._audio = _Cursor(lambda i: AudioFileClip(self.paths[i], fps=AUDIO_FPS))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _index_at(self, t):
+        return max(0, bisect.bisect_right(self.starts, t) - 1)
+
+    def _fit(self, frame):
+        """Đặt frame vào giữa khung self.size"""
+        width, height = self.size
+        if frame.shape[0] == height and frame.shape[1] == width:
+            return frame
+        canvas = np.zeros((height, width, 3), dtype=frame.dtype)
+        src_h, src_w = min(height, frame.shape[0]), min(width, frame.shape[1])
+        src_y, src_x = (frame.shape[0] - src_h) // 2, (frame.shape[1] - src_w) // 2
+        dst_y, dst_x = (height - src_h) // 2, (width - src_w) // 2
+        canvas[dst_y:dst_y + src_h, dst_x:dst_x + src_w] = frame[src_y:src_y + src_h, src_x:src_x + src_w, :3]
+        return canvas
+
+    def _make_frame(self, t):
+        index = self._index_at(t)
+        return self._fit(self._video.get(index).get_frame(t - self.starts[index]))
+
+    def _make_audio_frame(self, t):
+        scalar = np.isscalar(t)
+        tt = np.atleast_1d(np.asarray(t, dtype=float))
+        out = np.zeros((len(tt), AUDIO_CHANNELS))
+        indices = np.maximum(np.searchsorted(self.starts, tt, side="right") - 1, 0)
+        for index in np.unique(indices):
+            if not self.has_audio[index]:
+                continue
+            mask = indices == index
+            try:
+                frames = np.asarray(self._audio.get(index).get_frame(tt[mask] - self.starts[index]))
+            except Exception:
+                # Clip không đọc được audio thì để im lặng đoạn đó
+                self.has_audio[index] = False
+                continue
+            if frames.ndim == 1:
+                frames = frames[:, None]
+            out[mask] = frames[:, :AUDIO_CHANNELS] if frames.shape[1] >= AUDIO_CHANNELS else np.repeat(frames[:, :1], AUDIO_CHANNELS, axis=1)
+        return out[0] if scalar else out
+
+    def build(self):
+        """VideoClip đọc lười; gọi close() sau khi write_videofile xong"""
+        clip = VideoClip(make_frame=self._make_frame, duration=self.duration)
+        clip.size = self.size
+        clip.fps = self.fps
+        if any(self.has_audio):
+            clip = clip.set_audio(AudioClip(make_frame=self._make_audio_frame, duration=self.duration, fps=AUDIO_FPS))
+        return clip
+
+    def close(self):
+        self._video.close()
+        self._audio.close()
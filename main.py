@@ -2,10 +2,8 @@ import sys
 import os
 import json
 import re
-import time
 import urllib3
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QTabWidget, QWidget, 
                              QVBoxLayout, QHBoxLayout, QPushButton, 
                              QTableWidget, QTableWidgetItem, QLabel, QLineEdit, 
@@ -17,6 +15,9 @@ from PyQt5.QtGui import QFont
 import pandas as pd
 import requests
 from api import *
+from core import VideoProcessingCore, filter_valid_accounts
+from video_merge import StreamCopyMerger
+from mp4_probe import MP4_EXTENSIONS, probe_mp4, describe as describe_mp4
 
 # Tắt warnings về SSL certificate
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -24,6 +25,7 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # Import các thư viện ghép video thay thế
 try:
     from moviepy.editor import VideoFileClip, concatenate_videoclips
+    from lazy_concat import LazyConcatenation
     MOVIEPY_AVAILABLE = True
 except ImportError:
     MOVIEPY_AVAILABLE = False
@@ -31,10 +33,14 @@ except ImportError:
 try:
     import cv2
     import numpy as np
+    from opencv_merge import OpenCvMerger
     OPENCV_AVAILABLE = True
 except ImportError:
     OPENCV_AVAILABLE = False
 
+# Quá số clip này thì MoviePy mở lười từng clip (mở hết cùng lúc sẽ cạn file descriptor/RAM)
+MOVIEPY_EAGER_MAX_CLIPS = 20
+
 def create_styled_messagebox(parent, title, message, icon=QMessageBox.Information):
     """Tạo QMessageBox với styling đơn giản"""
     msg = QMessageBox(parent)
@@ -305,12 +311,28 @@ class VideoMergeThread(QThread):
                     self.log_updated.emit(f"❌ Video {i+1} không tồn tại: {video_path}")
                     self.finished.emit(False, f"Video {i+1} không tồn tại: {video_path}")
                     return
+                if video_path.lower().endswith(MP4_EXTENSIONS):
+                    # Đọc box MP4 (không decode) để loại sớm file hỏng/tải dở
+                    try:
+                        info = probe_mp4(video_path)
+                    except (OSError, ValueError) as e:
+                        self.log_updated.emit(f"❌ Video {i+1} bị lỗi: {e}")
+                        self.finished.emit(False, f"Video {i+1} bị lỗi hoặc chưa tải xong: {video_path}")
+                        return
+                    if not info["video"]:
+                        self.finished.emit(False, f"Video {i+1} không có track video: {video_path}")
+                        return
+                    self.log_updated.emit(f"🎞️ Video {i+1}: {describe_mp4(info)}")
             
             self.log_updated.emit("✅ Tất cả video files hợp lệ")
             self.progress_updated.emit(30, "Đang ghép video...")
             
-            # Sử dụng MoviePy để ghép video (phương pháp chính)
-            success = self._merge_with_moviepy()
+            # Nối ở mức container (không encode lại) khi có ffmpeg, chỉ encode lại video lệch thông số
+            success = self._merge_with_stream_copy()
+            
+            if not success:
+                # Fallback: MoviePy encode lại toàn bộ
+                success = self._merge_with_moviepy()
             
             if not success:
                 # Fallback: Sử dụng OpenCV nếu MoviePy thất bại
@@ -328,12 +350,34 @@ class VideoMergeThread(QThread):
             self.log_updated.emit(f"❌ Lỗi: {error_msg}")
             self.finished.emit(False, f"Lỗi: {error_msg}")
     
+    def _merge_with_stream_copy(self):
+        """Ghép video bằng ffmpeg stream copy (nhanh, giữ nguyên chất lượng và audio)"""
+        merger = StreamCopyMerger(self.video_paths, self.output_path, log=self.log_updated.emit, progress=self.progress_updated.emit)
+        if not merger.available:
+            self.log_updated.emit("⚠️ Không tìm thấy ffmpeg, dùng phương pháp encode lại...")
+            return False
+        
+        try:
+            reencoded = merger.merge()
+            if reencoded:
+                self.log_updated.emit(f"ℹ️ Đã encode lại {reencoded} video khác thông số")
+            self.progress_updated.emit(100, "Hoàn thành!")
+            self.log_updated.emit("✅ Ghép video thành công!")
+            self.finished.emit(True, f"Đã ghép video thành công!\nFile: {self.output_path}")
+            return True
+        except Exception as e:
+            self.log_updated.emit(f"⚠️ Lỗi ghép video (stream copy): {str(e)}")
+            return False
+    
     def _merge_with_moviepy(self):
         """Ghép video sử dụng MoviePy"""
         if not MOVIEPY_AVAILABLE:
             self.log_updated.emit("⚠️ Không thể ghép video, bỏ qua...")
             return False
         
+        if len(self.video_paths) > MOVIEPY_EAGER_MAX_CLIPS:
+            return self._merge_with_moviepy_lazy()
+        
         try:
             self.log_updated.emit("🎬 Đang ghép video...")
             
@@ -407,42 +451,54 @@ class VideoMergeThread(QThread):
                 pass
             return False
     
+    def _merge_with_moviepy_lazy(self):
+        """Ghép video bằng MoviePy, chỉ mở clip đang được ghi (bộ nhớ không tăng theo số clip)"""
+        concatenation = None
+        try:
+            self.log_updated.emit(f"🎬 Đang ghép {len(self.video_paths)} video (mở lần lượt từng video)...")
+            concatenation = LazyConcatenation(self.video_paths, log=self.log_updated.emit)
+            if not len(concatenation):
+                self.log_updated.emit("❌ Không có video nào có thể load!")
+                return False
+            self.log_updated.emit(f"✅ Đã đọc thông tin {len(concatenation)}/{len(self.video_paths)} video")
+            
+            self.log_updated.emit("💾 Đang xuất video...")
+            self.progress_updated.emit(70, "Đang xuất video...")
+            output_dir = os.path.dirname(self.output_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            
+            final_clip = concatenation.build()
+            final_clip.write_videofile(self.output_path,
+                                     codec='libx264',
+                                     audio_codec='aac',
+                                     temp_audiofile='temp-audio.m4a',
+                                     remove_temp=True,
+                                     verbose=False,
+                                     logger=None)
+            
+            self.progress_updated.emit(100, "Hoàn thành!")
+            self.log_updated.emit("✅ Ghép video thành công!")
+            self.finished.emit(True, f"Đã ghép video thành công!\nFile: {self.output_path}")
+            return True
+        
+        except Exception as e:
+            self.log_updated.emit(f"❌ Lỗi ghép video: {str(e)}")
+            return False
+        finally:
+            if concatenation is not None:
+                concatenation.close()
+    
     def _merge_with_opencv(self):
-        """Ghép video sử dụng OpenCV"""
+        """Ghép video sử dụng OpenCV (decode song song, resize/letterbox, giữ audio nếu có ffmpeg)"""
         if not OPENCV_AVAILABLE:
             self.log_updated.emit("⚠️ Không thể ghép video, bỏ qua...")
             return False
         
         try:
             self.log_updated.emit("🎬 Đang ghép video...")
-            
-            # Lấy thông tin video đầu tiên
-            cap = cv2.VideoCapture(self.video_paths[0])
-            fps = int(cap.get(cv2.CAP_PROP_FPS))
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            cap.release()
-            
-            # Tạo video writer
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(self.output_path, fourcc, fps, (width, height))
-            
-            # Ghép từng video
-            for i, video_path in enumerate(self.video_paths):
-                self.log_updated.emit(f"📹 Đang xử lý video {i+1}/{len(self.video_paths)}...")
-                # Cập nhật progress dựa trên số video đã xử lý
-                progress = 30 + (i + 1) * 60 // len(self.video_paths)
-                self.progress_updated.emit(progress, f"Đang xử lý video {i+1}/{len(self.video_paths)}...")
-                
-                cap = cv2.VideoCapture(video_path)
-                while True:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    out.write(frame)
-                cap.release()
-            
-            out.release()
+            merger = OpenCvMerger(self.video_paths, self.output_path, log=self.log_updated.emit, progress=self.progress_updated.emit)
+            merger.merge()
             self.progress_updated.emit(100, "Hoàn thành!")
             self.log_updated.emit("✅ Ghép video thành công!")
             self.finished.emit(True, f"Đã ghép video thành công!\nFile: {self.output_path}")
@@ -961,615 +1017,28 @@ class AddCookieDialog(QDialog):
         }
 
 class VideoProcessingThread(QThread):
-    """Thread để xử lý video không block UI với parallel processing và auto account distribution"""
+    """Thread để xử lý video không block UI - logic xử lý nằm trong core.VideoProcessingCore"""
     progress_updated = pyqtSignal(int, str)  # progress, message
     status_updated = pyqtSignal(str)  # status message for log
     finished = pyqtSignal(list)  # results
     
     def __init__(self, prompts, accounts_data, config, max_workers=5):
         super().__init__()
-        self.prompts = prompts
-        self.accounts_data = accounts_data  # Changed to support multiple accounts
-        self.config = config
-        self.max_workers = max_workers
-        self.processed_count = 0
-        self.total_count = len(prompts)
-        self.current_account_index = 0  # For account rotation
-        
-        # Tối ưu hóa: Chia đều prompts cho các tài khoản
-        self.account_prompts_distribution = self.distribute_prompts_to_accounts()
-        
-        # Tối ưu: Connection pooling và timeout settings
-        self.session_config = {
-            'timeout': (10, 30),  # Connect timeout, read timeout
-            'max_retries': 3,
-            'backoff_factor': 0.3
-        }
-        
-        # Thêm flag để kiểm soát việc dừng
-        self.should_stop = False
-        self.executor = None
+        self.core = VideoProcessingCore(
+            prompts, accounts_data, config, max_workers,
+            on_progress=self.progress_updated.emit, on_status=self.status_updated.emit
+        )
     
     def stop_processing(self):
         """Dừng quá trình xử lý"""
-        self.should_stop = True
-        if self.executor:
-            self.executor.shutdown(wait=False)
-        
-    def distribute_prompts_to_accounts(self):
-        """Chia prompts cho các tài khoản theo batch tuần tự"""
-        if not self.accounts_data or not self.prompts:
-            return {}
-        
-        account_count = len(self.accounts_data)
-        prompt_count = len(self.prompts)
-        thread_count = self.max_workers
-        
-        # Tạo các batch prompts cho mỗi account
-        # Mỗi account sẽ xử lý prompts theo thứ tự: 1,2,3 → 10,11,12 → 19,20,21...
-        distribution = {}
-        
-        for i, account in enumerate(self.accounts_data):
-            account_name = account.get("name", f"Account {i+1}")
-            
-            # Tạo danh sách prompts cho account này (theo thứ tự tuần tự)
-            account_prompts = []
-            for j in range(i, prompt_count, account_count):
-                account_prompts.append(self.prompts[j])
-            
-            distribution[account_name] = {
-                'account': account,
-                'threads': thread_count,
-                'prompts': account_prompts,
-                'count': len(account_prompts),
-                'account_index': i
-            }
-        
-        return distribution
-    
-    def process_account_prompts(self, account_data, threads_for_account, account_prompts):
-        """Xử lý prompts được gán cho account này theo batch tuần tự"""
-        account_results = []
-        
-        # Chia prompts thành các batch theo số luồng
-        batch_size = threads_for_account
-        total_prompts = len(account_prompts)
-        
-        for batch_start in range(0, total_prompts, batch_size):
-            if self.should_stop:
-                break
-                
-            batch_end = min(batch_start + batch_size, total_prompts)
-            batch_prompts = account_prompts[batch_start:batch_end]
-            
-            # Tạo ThreadPoolExecutor cho batch này
-            batch_executor = ThreadPoolExecutor(max_workers=len(batch_prompts))
-            
-            try:
-                # Tạo tasks cho batch hiện tại
-                future_to_prompt = {}
-                
-                for prompt_data in batch_prompts:
-                    if self.should_stop:
-                        break
-                    future = batch_executor.submit(self.process_video_with_specific_account, prompt_data, account_data)
-                    future_to_prompt[future] = prompt_data
-                
-                # Xử lý kết quả batch hiện tại
-                for future in as_completed(future_to_prompt):
-                    if self.should_stop:
-                        # Cancel các future còn lại
-                        for f in future_to_prompt:
-                            f.cancel()
-                        break
-                        
-                    prompt_data = future_to_prompt[future]
-                    
-                    try:
-                        result = future.result()
-                        account_results.append(result)
-                    except Exception as e:
-                        stt, prompt, image_path = prompt_data
-                        account_results.append((stt, prompt, False, str(e)))
-                        
-            finally:
-                batch_executor.shutdown(wait=False)
-        
-        return account_results
-        
-    def get_next_account(self):
-        """Lấy tài khoản tiếp theo để xoay vòng"""
-        if not self.accounts_data:
-            return None
-        
-        account = self.accounts_data[self.current_account_index]
-        self.current_account_index = (self.current_account_index + 1) % len(self.accounts_data)
-        return account
-    
-    def process_single_video(self, prompt_data):
-        """Xử lý một video đơn lẻ với auto account rotation"""
-        stt, prompt, image_path = prompt_data
-        
-        
-        try:
-            # Lấy tài khoản tiếp theo để xoay vòng
-            account_data = self.get_next_account()
-            if not account_data:
-                return (stt, prompt, False, "Không có tài khoản nào khả dụng")
-            
-            # Lấy token từ cookie của tài khoản được chọn
-            cookie_header_value = account_data["cookie"]
-            account_name = account_data.get("name", "Unknown")
-            
-            # Lấy proxy từ account data
-            proxy_str = account_data.get("proxy", "").strip()
-            proxy = None
-            if proxy_str:
-                proxy = {
-                    'http': proxy_str,
-                    'https': proxy_str
-                }
-            
-            # Kiểm tra cookie có hợp lệ không
-            if not cookie_header_value or cookie_header_value.startswith("YOUR_COOKIE_HERE"):
-                return (stt, prompt, False, f"Cookie không hợp lệ cho {account_name}")
-            
-            token = fetch_access_token_from_session(cookie_header_value)
-            
-            if not token:
-                return (stt, prompt, False, f"Không thể lấy token từ {account_name} - Cookie có thể đã hết hạn")
-            
-            # Tạo output filename
-            output_filename = create_short_filename(stt, prompt)
-            output_path = os.path.join(self.config["output_dir"], output_filename)
-            
-            # Generate video - Auto-select model based on image presence and aspect ratio
-            # Always generate at 720p first, then upscale if needed
-            if image_path and os.path.exists(image_path):
-                print("Vào video rồi nè cu hề")
-                # Image-to-video: Select model based on aspect ratio (always 720p)
-                if self.config["aspect_ratio"] == "VIDEO_ASPECT_RATIO_PORTRAIT":
-                    model_key = "veo_3_i2v_s_fast_portrait_ultra"
-                else:  # LANDSCAPE
-                    model_key = "veo_3_i2v_s_fast_ultra"
-                    
-                self.status_updated.emit(f"STT {stt}: 📤 Uploading image...")
-                media_id = upload_image(token, image_path, proxy)
-                self.status_updated.emit(f"STT {stt}: 🎬 Generating video from image...")
-                gen_resp, scene_id = generate_video_from_image(
-                    token, prompt, media_id, 
-                    self.config["project_id"], 
-                    model_key,
-                    self.config["aspect_ratio"],
-                    self.config.get("seed"),
-                    proxy
-                )
-            else:
-                print("Vào text rồi nè cu hề")
-                # Text-to-video: Select model based on aspect ratio (always 720p)
-                if self.config["aspect_ratio"] == "VIDEO_ASPECT_RATIO_PORTRAIT":
-                    model_key = "veo_3_1_t2v_fast_portrait_ultra"
-                else:  # LANDSCAPE
-                    model_key = "veo_3_1_t2v_fast_ultra"
-                    
-                self.status_updated.emit(f"STT {stt}: 🎬 Generating video...")
-                gen_resp, scene_id = generate_video(
-                    token, prompt, 
-                    self.config["project_id"], 
-                    model_key,
-                    self.config["aspect_ratio"],
-                    self.config.get("seed"),
-                    proxy
-                )
-            
-            
-            # Lấy mediaId từ generate response ngay sau khi generate
-            video_media_id = extract_video_media_id(gen_resp)
-            
-            # Poll status - sử dụng hàm poll_status từ main.py
-            op_name = extract_op_name(gen_resp)
-            self.status_updated.emit(f"STT {stt}: ⏳ Checking generation status...")
-            
-            try:
-                # poll_status sẽ tự động poll cho đến khi SUCCESSFUL hoặc FAILED
-                status_resp = poll_status(token, op_name, scene_id, interval_sec=2.0, timeout_sec=600, proxy=proxy)
-                self.status_updated.emit(f"STT {stt}: ✅ Status: SUCCESSFUL - Thành công, đang tải...")
-            except RuntimeError as e:
-                self.status_updated.emit(f"STT {stt}: ❌ Status: FAILED - Thất bại!")
-                return (stt, prompt, False, f"Generation failed: {str(e)}")
-            except TimeoutError as e:
-                self.status_updated.emit(f"STT {stt}: ⏰ Timeout - Hết thời gian chờ!")
-                return (stt, prompt, False, f"Timeout: {str(e)}")
-            except Exception as e:
-                self.status_updated.emit(f"STT {stt}: ❌ Lỗi polling: {str(e)}")
-                return (stt, prompt, False, f"Polling error: {str(e)}")
-            
-            # Download video (chỉ khi không có upscale)
-            if not self.config.get("use_upscale", False):
-                self.status_updated.emit(f"STT {stt}: 📥 Downloading video...")
-                fife_url = extract_fife_url(status_resp)
-                http_download_mp4(fife_url, output_path)
-            
-            # Upscale to 1080p if requested
-            if self.config.get("use_upscale", False):
-                self.status_updated.emit(f"STT {stt}: 🔄 Upscaling to 1080p...")
-                try:
-                    # Sử dụng video_media_id đã lấy từ gen_resp
-                    if not video_media_id:
-                        raise ValueError("Không có video_media_id để upscale")
-                    
-                    self.status_updated.emit(f"STT {stt}: 📤 Using video mediaId for upscaling")
-                    
-                    # Upscale video
-                    upscale_resp, upscale_scene_id = upscale_video(
-                        token, video_media_id, 
-                        self.config["project_id"], 
-                        "1080p",
-                        self.config["aspect_ratio"],
-                        self.config.get("seed"),
-                        proxy
-                    )
-                    
-                    # Poll upscale status
-                    upscale_op_name = extract_op_name(upscale_resp)
-                    self.status_updated.emit(f"STT {stt}: ⏳ Waiting for upscale...")
-                    upscale_status_resp = poll_status(token, upscale_op_name, upscale_scene_id, interval_sec=2.0, timeout_sec=600, proxy=proxy)
-                    
-                    # Lấy mediaId từ upscale response
-                    upscale_media_id = extract_upscale_media_id(upscale_status_resp)
-                    if not upscale_media_id:
-                        raise ValueError("Không thể lấy mediaId từ upscale response")
-                    
-                    # Lấy encodedVideo từ mediaId
-                    self.status_updated.emit(f"STT {stt}: 📥 Getting encoded video...")
-                    encoded_video = get_encoded_video(token, upscale_media_id, proxy)
-                    if not encoded_video:
-                        raise ValueError("Không thể lấy encodedVideo từ mediaId")
-                    
-                    # Tải video từ encodedVideo
-                    self.status_updated.emit(f"STT {stt}: 📥 Downloading upscaled video...")
-                    download_encoded_video(encoded_video, output_path)
-                    
-                    # Xóa upscale media sau khi upscale xong
-                    try:
-                        # Lấy cookie từ account hiện tại
-                        current_account = self.get_current_account()
-                        if current_account and current_account.get("cookie"):
-                            cookie_header_value = current_account["cookie"]
-                            # Chỉ xóa upscale media (video media gốc giữ lại)
-                            delete_success = delete_media([upscale_media_id], cookie_header_value)
-                            if delete_success:
-                                self.status_updated.emit(f"STT {stt}: 🧹 Đã xóa upscale media")
-                            else:
-                                self.status_updated.emit(f"STT {stt}: ⚠️ Không thể xóa upscale media")
-                    except Exception as e:
-                        self.status_updated.emit(f"STT {stt}: ⚠️ Lỗi xóa upscale media: {str(e)}")
-                    
-                    self.status_updated.emit(f"STT {stt}: ✅ Upscaled to 1080p!")
-                except Exception as e:
-                    self.status_updated.emit(f"STT {stt}: ⚠️ Upscale failed: {str(e)}")
-                    self.status_updated.emit(f"STT {stt}: ✅ Video generated at 720p")
-            
-            # Xóa media sau khi tải video xong (nếu có image)
-            if image_path and os.path.exists(image_path):
-                try:
-                    # Lấy cookie từ account hiện tại
-                    current_account = self.get_current_account()
-                    if current_account and current_account.get("cookie"):
-                        cookie_header_value = current_account["cookie"]
-                        # Xóa media đã upload
-                        delete_success = delete_media([media_id], cookie_header_value)
-                        if delete_success:
-                            self.status_updated.emit(f"STT {stt}: 🧹 Đã xóa media sau khi tải xong")
-                        else:
-                            self.status_updated.emit(f"STT {stt}: ⚠️ Không thể xóa media")
-                except Exception as e:
-                    self.status_updated.emit(f"STT {stt}: ⚠️ Lỗi xóa media: {str(e)}")
-            
-            self.status_updated.emit(f"STT {stt}: ✅ Hoàn thành: {output_filename}")
-            return (stt, prompt, True, output_filename)
-            
-        except Exception as e:
-            self.status_updated.emit(f"STT {stt}: ❌ Lỗi: {str(e)}")
-            return (stt, prompt, False, str(e))
-    
-    def process_video_with_specific_account(self, prompt_data, account_data):
-        """Xử lý video với tài khoản cụ thể (cho thuật toán chia tải tối ưu)"""
-        stt, prompt, image_path = prompt_data
-        account_name = account_data.get("name", "Unknown")
-        
-        
-        # Kiểm tra should_stop ngay từ đầu
-        if self.should_stop:
-            return (stt, prompt, False, "Đã dừng bởi người dùng")
-        
-        try:
-            # Lấy token từ cookie của tài khoản được chỉ định
-            cookie_header_value = account_data["cookie"]
-            
-            # Lấy proxy từ account data
-            proxy_str = account_data.get("proxy", "").strip()
-            proxy = None
-            if proxy_str:
-                proxy = {
-                    'http': proxy_str,
-                    'https': proxy_str
-                }
-            
-            # Kiểm tra cookie có hợp lệ không
-            if not cookie_header_value or cookie_header_value.startswith("YOUR_COOKIE_HERE"):
-                return (stt, prompt, False, f"Cookie không hợp lệ cho {account_name}")
-            
-            # Tối ưu: Cache token để tránh gọi API nhiều lần
-            cache_key = f"token_{hash(cookie_header_value)}"
-            if not hasattr(self, 'token_cache'):
-                self.token_cache = {}
-            
-            token = self.token_cache.get(cache_key)
-            if not token:
-                token = fetch_access_token_from_session(cookie_header_value)
-                if token:
-                    self.token_cache[cache_key] = token
-                else:
-                    return (stt, prompt, False, f"Không thể lấy token từ {account_name} - Cookie có thể đã hết hạn")
-            
-            # Tạo output filename
-            output_filename = create_short_filename(stt, prompt)
-            output_path = os.path.join(self.config["output_dir"], output_filename)
-            
-            # Generate video - Auto-select model based on image presence
-            if image_path and os.path.exists(image_path):
-                # Kiểm tra should_stop trước khi upload
-                if self.should_stop:
-                    return (stt, prompt, False, "Đã dừng bởi người dùng")
-                
-                # Image-to-video: Select model based on aspect ratio
-                if self.config["aspect_ratio"] == "VIDEO_ASPECT_RATIO_PORTRAIT":
-                    model_key = "veo_3_1_i2v_s_fast_portrait_ultra"
-                else:  # LANDSCAPE
-                    model_key = "veo_3_1_i2v_s_fast_ultra"
-                    
-                self.status_updated.emit(f"STT {stt}: 📤 Uploading image với {account_name}...")
-                media_id = upload_image(token, image_path, proxy)
-                
-                # Kiểm tra should_stop sau khi upload
-                if self.should_stop:
-                    return (stt, prompt, False, "Đã dừng bởi người dùng")
-                
-                self.status_updated.emit(f"STT {stt}: 🎬 Generating video from image với {account_name}...")
-                gen_resp, scene_id = generate_video_from_image(
-                    token, prompt, media_id, 
-                    self.config["project_id"], 
-                    model_key,
-                    self.config["aspect_ratio"],
-                    self.config.get("seed"),
-                    proxy
-                )
-            else:
-                # Kiểm tra should_stop trước khi generate
-                if self.should_stop:
-                    return (stt, prompt, False, "Đã dừng bởi người dùng")
-                
-                # Text-to-video: Select model based on aspect ratio
-                if self.config["aspect_ratio"] == "VIDEO_ASPECT_RATIO_PORTRAIT":
-                    model_key = "veo_3_1_t2v_fast_portrait_ultra"
-                else:  # LANDSCAPE
-                    model_key = "veo_3_1_t2v_fast_ultra"
-                    
-                self.status_updated.emit(f"STT {stt}: 🎬 Generating video với {account_name}...")
-                gen_resp, scene_id = generate_video(
-                    token, prompt, 
-                    self.config["project_id"], 
-                    model_key,
-                    self.config["aspect_ratio"],
-                    self.config.get("seed"),
-                    proxy
-                )
-         
-            # Poll status với retry logic tối ưu
-            op_name = extract_op_name(gen_resp)
-            self.status_updated.emit(f"STT {stt}: ⏳ Checking generation status với {account_name}...")
-            
-            # Tối ưu: Retry với exponential backoff
-            max_retries = 3
-            base_delay = 2.0
-            for attempt in range(max_retries):
-                try:
-                    status_resp = poll_status(token, op_name, scene_id, interval_sec=base_delay, timeout_sec=300, proxy=proxy)
-                    self.status_updated.emit(f"STT {stt}: ✅ Status: SUCCESSFUL với {account_name} - đang tải...")
-                    break
-                except RuntimeError as e:
-                    if attempt == max_retries - 1:
-                        self.status_updated.emit(f"STT {stt}: ❌ Status: FAILED với {account_name}!")
-                        return (stt, prompt, False, f"Generation failed: {str(e)}")
-                    else:
-                        self.status_updated.emit(f"STT {stt}: ⚠️ Retry {attempt + 1}/{max_retries} với {account_name}...")
-                        time.sleep(base_delay * (2 ** attempt))  # Exponential backoff
-                except TimeoutError as e:
-                    if attempt == max_retries - 1:
-                        self.status_updated.emit(f"STT {stt}: ⏰ Timeout với {account_name}!")
-                        return (stt, prompt, False, f"Timeout: {str(e)}")
-                    else:
-                        self.status_updated.emit(f"STT {stt}: ⚠️ Timeout, retry {attempt + 1}/{max_retries} với {account_name}...")
-                        time.sleep(base_delay * (2 ** attempt))
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        self.status_updated.emit(f"STT {stt}: ❌ Lỗi polling với {account_name}: {str(e)}")
-                        return (stt, prompt, False, f"Polling error: {str(e)}")
-                    else:
-                        self.status_updated.emit(f"STT {stt}: ⚠️ Lỗi polling, retry {attempt + 1}/{max_retries} với {account_name}...")
-                        time.sleep(base_delay * (2 ** attempt))
-            
-            # Download video (chỉ khi không có upscale)
-            if not self.config.get("use_upscale", False):
-                self.status_updated.emit(f"STT {stt}: 📥 Downloading video từ {account_name}...")
-                fife_url = extract_fife_url(status_resp)
-                http_download_mp4(fife_url, output_path)
-            
-            # Upscale to 1080p if requested
-            if self.config.get("use_upscale", False):
-                self.status_updated.emit(f"STT {stt}: 🔄 Upscaling to 1080p...")
-                try:
-                    # Lấy mediaId từ video generation response
-                    video_media_id = extract_video_media_id(status_resp)
-                    if not video_media_id:
-                        raise ValueError("Không thể lấy mediaId từ video generation response")
-                    
-                    self.status_updated.emit(f"STT {stt}: 📤 Using video mediaId for upscaling")
-                    
-                    # Upscale video
-                    upscale_resp, upscale_scene_id = upscale_video(
-                        token, video_media_id, 
-                        self.config["project_id"], 
-                        "1080p",
-                        self.config["aspect_ratio"],
-                        self.config.get("seed"),
-                        proxy
-                    )
-                    
-                    # Poll upscale status
-                    upscale_op_name = extract_op_name(upscale_resp)
-                    self.status_updated.emit(f"STT {stt}: ⏳ Waiting for upscale...")
-                    upscale_status_resp = poll_status(token, upscale_op_name, upscale_scene_id, interval_sec=2.0, timeout_sec=600, proxy=proxy)
-                    
-                    # Lấy mediaId từ upscale response
-                    upscale_media_id = extract_upscale_media_id(upscale_status_resp)
-                    if not upscale_media_id:
-                        raise ValueError("Không thể lấy mediaId từ upscale response")
-                    
-                    # Lấy encodedVideo từ mediaId
-                    self.status_updated.emit(f"STT {stt}: 📥 Getting encoded video...")
-                    encoded_video = get_encoded_video(token, upscale_media_id, proxy)
-                    if not encoded_video:
-                        raise ValueError("Không thể lấy encodedVideo từ mediaId")
-                    
-                    # Tải video từ encodedVideo
-                    self.status_updated.emit(f"STT {stt}: 📥 Downloading upscaled video...")
-                    download_encoded_video(encoded_video, output_path)
-                    
-                    # Xóa upscale media sau khi upscale xong
-                    try:
-                        # Chỉ xóa upscale media (video media gốc giữ lại)
-                        delete_success = delete_media([upscale_media_id], cookie_header_value)
-                        if delete_success:
-                            self.status_updated.emit(f"STT {stt}: 🧹 Đã xóa upscale media")
-                        else:
-                            self.status_updated.emit(f"STT {stt}: ⚠️ Không thể xóa upscale media")
-                    except Exception as e:
-                        self.status_updated.emit(f"STT {stt}: ⚠️ Lỗi xóa upscale media: {str(e)}")
-                    
-                    self.status_updated.emit(f"STT {stt}: ✅ Upscaled to 1080p!")
-                except Exception as e:
-                    self.status_updated.emit(f"STT {stt}: ⚠️ Upscale failed: {str(e)}")
-                    self.status_updated.emit(f"STT {stt}: ✅ Video generated at 720p")
-            
-            # Xóa media sau khi tải video xong (nếu có image)
-            if image_path and os.path.exists(image_path):
-                try:
-                    # Xóa media đã upload
-                    delete_success = delete_media([media_id], cookie_header_value)
-                    if delete_success:
-                        self.status_updated.emit(f"STT {stt}: 🧹 Đã xóa media sau khi tải xong")
-                    else:
-                        self.status_updated.emit(f"STT {stt}: ⚠️ Không thể xóa media")
-                except Exception as e:
-                    self.status_updated.emit(f"STT {stt}: ⚠️ Lỗi xóa media: {str(e)}")
-            else:
-                pass
-            
-            self.status_updated.emit(f"STT {stt}: ✅ Hoàn thành với {account_name}: {output_filename}")
-            return (stt, prompt, True, output_filename)
-            
-        except Exception as e:
-            self.status_updated.emit(f"STT {stt}: ❌ Lỗi với {account_name}: {str(e)}")
-            return (stt, prompt, False, str(e))
+        self.core.stop_processing()
     
     def run(self):
         try:
-            account_count = len(self.accounts_data)
-            
-            # Hiển thị thông tin chia tải theo batch tuần tự
-            distribution_info = []
-            for account_name, data in self.account_prompts_distribution.items():
-                distribution_info.append(f"{account_name}: {data['count']} prompts, {data['threads']} luồng/batch")
-            
-            distribution_text = " | ".join(distribution_info)
-            self.progress_updated.emit(5, f"🚀 Bắt đầu xử lý {self.total_count} video với {self.max_workers} luồng/batch và {account_count} tài khoản (tuần tự)...")
-            self.progress_updated.emit(8, f"📊 Chia batch tuần tự: {distribution_text}")
-            
-            # Xử lý song song với mỗi thread sử dụng một account riêng biệt
-            results = []
-            
-            # Tạo ThreadPoolExecutor với số luồng bằng số account
-            self.executor = ThreadPoolExecutor(max_workers=account_count)
-            
-            try:
-                # Tạo tasks cho mỗi account với số luồng tương ứng
-                future_to_account = {}
-                
-                for account_name, data in self.account_prompts_distribution.items():
-                    if self.should_stop:
-                        break
-                    
-                    account_data = data['account']
-                    threads_for_account = data['threads']
-                    account_prompts = data['prompts']
-                    
-                    # Tạo một task cho account này với số luồng riêng và prompts riêng
-                    future = self.executor.submit(self.process_account_prompts, account_data, threads_for_account, account_prompts)
-                    future_to_account[future] = account_name
-                
-                # Xử lý kết quả khi hoàn thành
-                for future in as_completed(future_to_account):
-                    if self.should_stop:
-                        # Cancel các future còn lại
-                        for f in future_to_account:
-                            f.cancel()
-                        break
-                        
-                    account_name = future_to_account[future]
-                    
-                    try:
-                        account_results = future.result()
-                        results.extend(account_results)
-                        self.processed_count += len(account_results)
-                        
-                        # Update progress
-                        progress = int(10 + (self.processed_count / self.total_count) * 85)
-                        self.progress_updated.emit(
-                            progress, 
-                            f"✅ Hoàn thành {account_name}: {len(account_results)} video ({self.processed_count}/{self.total_count})"
-                        )
-                        
-                    except Exception as e:
-                        self.progress_updated.emit(50, f"❌ Lỗi với {account_name}: {str(e)}")
-                        
-            finally:
-                # Shutdown executor
-                if self.executor:
-                    self.executor.shutdown(wait=False)
-                        
-            # Sắp xếp results theo STT
-            results.sort(key=lambda x: x[0])
-            
-            # Thống kê kết quả
-            successful = sum(1 for r in results if r[2])
-            failed = len(results) - successful
-            
-            self.progress_updated.emit(100, f"✅ Hoàn thành! Thành công: {successful}/{len(results)} video")
-            if failed > 0:
-                self.progress_updated.emit(100, f"⚠️ Có {failed} video thất bại")
-            
-            self.finished.emit(results)
-            
+            self.finished.emit(self.core.run())
         except Exception as e:
             self.progress_updated.emit(0, f"❌ Lỗi: {str(e)}")
             self.finished.emit([])
-        finally:
-            # Tối ưu: Cleanup resources
-            if hasattr(self, 'token_cache'):
-                self.token_cache.clear()
-            self.account_prompts_distribution.clear()
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -1831,6 +1300,10 @@ class MainWindow(QMainWindow):
         self.resolution_combo.setToolTip("720p: Generate trực tiếp\n1080p: Generate 720p rồi upscale lên 1080p")
         config_layout.addRow("Resolution:", self.resolution_combo)
         
+        self.auto_merge_check = QCheckBox("Tự động ghép video theo STT (merged.mp4)")
+        self.auto_merge_check.setToolTip("Nối dần từng video vào output/merged.mp4 ngay khi các STT trước đó đã xong")
+        config_layout.addRow("", self.auto_merge_check)
+        
         config_group.setLayout(config_layout)
         left_layout.addWidget(config_group)
         
@@ -3234,24 +2707,8 @@ class MainWindow(QMainWindow):
             
     def test_accounts(self):
         """Test tất cả tài khoản trước khi chạy"""
-        valid_accounts = []
-        
-        for account in self.accounts:
-            cookie = account.get("cookie", "")
-            name = account.get("name", "Unknown")
-            
-            if not cookie or cookie.startswith("YOUR_COOKIE_HERE"):
-                self.log_text.append(f"⚠️ {name}: Cookie không hợp lệ")
-                continue
-                
-            token = fetch_access_token_from_session(cookie)
-            if token:
-                valid_accounts.append(account)
-                self.log_text.append(f"✅ {name}: Token hợp lệ")
-            else:
-                self.log_text.append(f"❌ {name}: Không thể lấy token - Cookie có thể đã hết hạn")
-        
-        return valid_accounts
+        # Kiểm tra chủ động: lấy token mới thay vì token còn trong cache
+        return filter_valid_accounts(self.accounts, log=self.log_text.append, force_refresh=True)
 
     def test_accounts_ui(self):
         """Test tài khoản với UI feedback"""
@@ -3346,7 +2803,8 @@ class MainWindow(QMainWindow):
             "max_workers": self.max_workers_spin.value(),
             "output_dir": output_dir,
             "aspect_ratio": aspect_ratio,
-            "use_upscale": use_upscale
+            "use_upscale": use_upscale,
+            "auto_merge_path": os.path.join(output_dir, "merged.mp4") if self.auto_merge_check.isChecked() else None
         }
         
         # Create output directory
@@ -3715,6 +3173,11 @@ class MainWindow(QMainWindow):
                 file_type = "🖼️ Ảnh"
             elif file_ext in ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg']:
                 file_type = "🎥 Video"
+                if file_ext in MP4_EXTENSIONS:
+                    try:
+                        file_type += f" ({describe_mp4(probe_mp4(full_path))})"
+                    except (OSError, ValueError):
+                        file_type += " (lỗi)"
             elif file_ext in ['.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma', '.m4a']:
                 file_type = "🎵 Audio"
             elif file_ext in ['.pdf', '.doc', '.docx', '.txt', '.rtf', '.odt']:
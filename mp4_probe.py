@@ -0,0 +1,258 @@
+import os
+import mmap
+import struct
+from fractions import Fraction
+
+
+# Các đuôi file dùng cấu trúc box ISO-BMFF (MP4/MOV)
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.3gp')
+
+# Box chỉ chứa box con (đi xuống để tìm trak/stbl...)
+_CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf"}
+# Box index của sample table: chỉ ghi lại vị trí, không đọc hết nội dung
+_INDEX_BOXES = {b"stts", b"stsz", b"stz2", b"stsc", b"stco", b"co64", b"stss", b"ctts"}
+
+# Tên codec giống ffprobe để so sánh được với thông số lấy từ ffprobe
+_CODEC_NAMES = {
+    "avc1": "h264", "avc3": "h264", "hvc1": "hevc", "hev1": "hevc", "av01": "av1", "vp09": "vp9",
+    "mp4v": "mpeg4", "mp4a": "aac", "ac-3": "ac3", "ec-3": "eac3", "Opus": "opus", "fLaC": "flac",
+}
+_H264_PROFILES = {66: "Baseline", 77: "Main", 88: "Extended", 100: "High", 110: "High 10", 122: "High 4:2:2", 144: "High 4:4:4"}
+_CHROMA_FORMATS = {0: "gray", 1: "yuv420p", 2: "yuv422p", 3: "yuv444p"}
+
+
+class Mp4ParseError(ValueError):
+    """File không phải MP4/MOV hợp lệ (thiếu box, box cắt cụt...)"""
+
+
+def _iter_boxes(buf, start, end):
+    """Duyệt các box trong [start, end): yield (type, offset, header_size, size)"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise Mp4ParseError(f"Box {box_type!r} bị cắt cụt tại {offset}")
+            size = struct.unpack_from(">Q", buf, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset  # Box kéo dài tới hết file/box cha
+        if size < header_size or offset + size > end:
+            raise Mp4ParseError(f"Box {box_type!r} có kích thước không hợp lệ tại {offset}")
+        yield box_type, offset, header_size, size
+        offset += size
+
+
+def _full_box(buf, offset, header_size):
+    """(version, offset nội dung) của full box (version + flags)"""
+    return buf[offset + header_size], offset + header_size + 4
+
+
+def _parse_mvhd(buf, offset, header_size):
+    version, pos = _full_box(buf, offset, header_size)
+    if version == 1:
+        timescale, duration = struct.unpack_from(">IQ", buf, pos + 16)
+    else:
+        timescale, duration = struct.unpack_from(">II", buf, pos + 8)
+    return timescale, duration
+
+
+def _parse_tkhd(buf, offset, header_size, size):
+    version, pos = _full_box(buf, offset, header_size)
+    track_id = struct.unpack_from(">I", buf, pos + (16 if version == 1 else 8))[0]
+    # width/height (16.16) là 8 byte cuối của tkhd
+    width, height = struct.unpack_from(">II", buf, offset + size - 8)
+    return track_id, width >> 16, height >> 16
+
+
+def _parse_mdhd(buf, offset, header_size):
+    version, pos = _full_box(buf, offset, header_size)
+    if version == 1:
+        return struct.unpack_from(">IQ", buf, pos + 16)
+    return struct.unpack_from(">II", buf, pos + 8)
+
+
+def _parse_avcc(buf, pos, end, track):
+    """avcC: profile và (với profile High trở lên) chroma format / bit depth"""
+    if pos + 4 > end:
+        return
+    profile_idc = buf[pos + 1]
+    track["profile"] = _H264_PROFILES.get(profile_idc, str(profile_idc))
+    if profile_idc == 66 and buf[pos + 2] & 0x40:
+        track["profile"] = "Constrained Baseline"  # constraint_set1_flag, giống ffprobe
+    if profile_idc in (66, 77, 88):
+        track["pix_fmt"] = "yuv420p"
+        return
+    # Bỏ qua các SPS/PPS để tới phần mở rộng của profile High
+    p = pos + 5
+    sps_count = buf[p] & 0x1F
+    p += 1
+    for _ in range(sps_count):
+        p += 2 + struct.unpack_from(">H", buf, p)[0]
+    pps_count = buf[p]
+    p += 1
+    for _ in range(pps_count):
+        p += 2 + struct.unpack_from(">H", buf, p)[0]
+    if p + 3 <= end:
+        chroma = _CHROMA_FORMATS.get(buf[p] & 0x03, "yuv420p")
+        bit_depth = (buf[p + 1] & 0x07) + 8
+        track["pix_fmt"] = chroma if bit_depth == 8 else f"{chroma}{bit_depth}le"
+    else:
+        track["pix_fmt"] = "yuv420p"
+
+
+def _parse_stsd(buf, offset, header_size, size, track):
+    """Sample entry đầu tiên: codec, kích thước (video) hoặc sample rate/channels (audio)"""
+    _, pos = _full_box(buf, offset, header_size)
+    if struct.unpack_from(">I", buf, pos)[0] == 0:
+        return
+    entry_size, fourcc = struct.unpack_from(">I4s", buf, pos + 4)
+    entry = pos + 4
+    entry_end = min(entry + entry_size, offset + size)
+    fourcc = fourcc.decode("latin-1")
+    track["fourcc"] = fourcc
+    track["codec"] = _CODEC_NAMES.get(fourcc, fourcc)
+    if track["type"] == "video":
+        # VisualSampleEntry: 8 header + 6 reserved + 2 data_ref + 16 pre_defined/reserved -> width, height
+        track["width"], track["height"] = struct.unpack_from(">HH", buf, entry + 32)
+        for child_type, child_offset, child_header, child_size in _iter_boxes(buf, entry + 86, entry_end):
+            if child_type == b"avcC":
+                _parse_avcc(buf, child_offset + child_header, child_offset + child_size, track)
+    elif track["type"] == "audio":
+        # AudioSampleEntry: channelcount ở +24, samplerate (16.16) ở +32
+        track["channels"] = struct.unpack_from(">H", buf, entry + 24)[0]
+        track["sample_rate"] = struct.unpack_from(">I", buf, entry + 32)[0] >> 16
+
+
+def _parse_stts(buf, offset, header_size, track):
+    _, pos = _full_box(buf, offset, header_size)
+    entry_count = struct.unpack_from(">I", buf, pos)[0]
+    sample_count = 0
+    total_delta = 0
+    for i in range(entry_count):
+        count, delta = struct.unpack_from(">II", buf, pos + 4 + i * 8)
+        sample_count += count
+        total_delta += count * delta
+    track["sample_count"] = sample_count
+    if track["type"] == "video" and total_delta and track["timescale"]:
+        rate = Fraction(sample_count * track["timescale"], total_delta).limit_denominator(1001)
+        track["frame_rate"] = f"{rate.numerator}/{rate.denominator}"
+        track["fps"] = float(rate)
+
+
+def _parse_trak(buf, start, end):
+    track = {
+        "id": None, "type": None, "handler": None, "codec": None, "fourcc": None, "profile": None,
+        "width": None, "height": None, "pix_fmt": None, "timescale": None, "duration": None,
+        "sample_count": None, "frame_rate": None, "fps": None, "sample_rate": None, "channels": None,
+        "index": {},  # tên box index -> (offset, size) trong file
+    }
+    pending = []  # stsd/stts cần biết loại track và timescale (hdlr/mdhd) trước
+    stack = [(start, end)]
+    while stack:
+        box_start, box_end = stack.pop()
+        for box_type, offset, header_size, size in _iter_boxes(buf, box_start, box_end):
+            if box_type in _CONTAINER_BOXES:
+                stack.append((offset + header_size, offset + size))
+            elif box_type == b"tkhd":
+                track["id"], track["width"], track["height"] = _parse_tkhd(buf, offset, header_size, size)
+            elif box_type == b"mdhd":
+                track["timescale"], track["duration"] = _parse_mdhd(buf, offset, header_size)
+            elif box_type == b"hdlr":
+                handler = bytes(buf[offset + header_size + 8:offset + header_size + 12]).decode("latin-1")
+                track["handler"] = handler
+                track["type"] = {"vide": "video", "soun": "audio"}.get(handler, handler)
+            elif box_type in (b"stsd", b"stts"):
+                pending.append((box_type, offset, header_size, size))
+                track["index"][box_type.decode()] = (offset, size)
+            elif box_type in _INDEX_BOXES:
+                track["index"][box_type.decode()] = (offset, size)
+    for box_type, offset, header_size, size in pending:
+        if box_type == b"stsd":
+            _parse_stsd(buf, offset, header_size, size, track)
+        else:
+            _parse_stts(buf, offset, header_size, track)
+    return track
+
+
+def probe_mp4(path):
+    """Đọc thông tin MP4/MOV trực tiếp từ các box (không decode, không gọi ffmpeg)
+
+    Trả về dict: duration (giây), codec/width/height/fps của track video, has_audio, tracks,
+    vị trí các box top-level (ftyp/moov/mdat) và box index của từng track.
+    """
+    file_size = os.path.getsize(path)
+    if file_size < 8:
+        raise Mp4ParseError(f"File quá nhỏ: {path}")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        try:
+            return _probe_buffer(buf, file_size, path)
+        except struct.error as e:
+            raise Mp4ParseError(f"Box bị cắt cụt: {e}") from e
+
+
+def _probe_buffer(buf, file_size, path):
+    boxes = {}
+    info = {
+        "path": path, "size": file_size, "brand": None, "compatible_brands": [],
+        "duration": None, "timescale": None, "tracks": [], "boxes": boxes, "faststart": False,
+    }
+    moov = None
+    for box_type, offset, header_size, size in _iter_boxes(buf, 0, file_size):
+        name = box_type.decode("latin-1")
+        boxes.setdefault(name, (offset, size))
+        if box_type == b"ftyp":
+            info["brand"] = bytes(buf[offset + header_size:offset + header_size + 4]).decode("latin-1")
+            info["compatible_brands"] = [
+                bytes(buf[p:p + 4]).decode("latin-1")
+                for p in range(offset + header_size + 8, offset + size - 3, 4)
+            ]
+        elif box_type == b"moov":
+            moov = (offset, header_size, size)
+    if moov is None:
+        raise Mp4ParseError(f"Không có box moov (file chưa tải xong hoặc không phải MP4): {path}")
+    if "mdat" in boxes:
+        info["faststart"] = boxes["moov"][0] < boxes["mdat"][0]
+
+    moov_offset, moov_header, moov_size = moov
+    for box_type, offset, header_size, size in _iter_boxes(buf, moov_offset + moov_header, moov_offset + moov_size):
+        if box_type == b"mvhd":
+            info["timescale"], duration = _parse_mvhd(buf, offset, header_size)
+            info["duration"] = duration / info["timescale"] if info["timescale"] else None
+        elif box_type == b"trak":
+            info["tracks"].append(_parse_trak(buf, offset + header_size, offset + size))
+
+    video = next((t for t in info["tracks"] if t["type"] == "video"), None)
+    audio = next((t for t in info["tracks"] if t["type"] == "audio"), None)
+    info.update(
+        video=video, audio=audio, has_audio=audio is not None,
+        codec=video["codec"] if video else None,
+        width=video["width"] if video else None,
+        height=video["height"] if video else None,
+        fps=video["fps"] if video else None,
+    )
+    return info
+
+
+def is_valid_video(path):
+    """MP4/MOV có track video với ít nhất một frame"""
+    try:
+        info = probe_mp4(path)
+    except (OSError, ValueError):
+        return False
+    return bool(info["video"] and info["video"]["sample_count"])
+
+
+def describe(info):
+    """Mô tả ngắn: '8.0s, 1280x720, 24fps, h264 + audio'"""
+    parts = []
+    if info.get("duration") is not None:
+        parts.append(f"{info['duration']:.1f}s")
+    if info.get("width") and info.get("height"):
+        parts.append(f"{info['width']}x{info['height']}")
+    if info.get("fps"):
+        parts.append(f"{info['fps']:.3g}fps")
+    if info.get("codec"):
+        parts.append(info["codec"] + (" + audio" if info.get("has_audio") else ""))
+    return ", ".join(parts)
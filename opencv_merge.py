@@ -0,0 +1,180 @@
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from video_merge import find_ffmpeg, _run
+
+
+DEFAULT_FPS = 30.0
+QUEUE_FRAMES = 48  # Số frame tối đa mỗi video được decode trước (giới hạn RAM)
+AUDIO_RATE = 44100
+
+_END = object()
+
+
+def _clip_info(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise RuntimeError(f"Không mở được video: {path}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return (fps if fps > 0 else DEFAULT_FPS), width, height
+    finally:
+        cap.release()
+
+
+def letterbox(frame, width, height):
+    """Resize giữ tỉ lệ rồi thêm viền đen cho đủ width x height"""
+    src_h, src_w = frame.shape[:2]
+    if src_w == width and src_h == height:
+        return frame
+    scale = min(width / src_w, height / src_h)
+    new_w, new_h = max(1, round(src_w * scale)), max(1, round(src_h * scale))
+    resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    top, left = (height - new_h) // 2, (width - new_w) // 2
+    return cv2.copyMakeBorder(resized, top, height - new_h - top, left, width - new_w - left, cv2.BORDER_CONSTANT, value=(0, 0, 0))
+
+
+class OpenCvMerger:
+    """Ghép video bằng OpenCV theo kiểu producer/consumer
+
+    Các thread decoder đọc trước frame của những video kế tiếp (resize/letterbox, đổi fps bằng
+    lặp/bỏ frame) vào hàng đợi có giới hạn, trong khi thread gọi merge() encode lần lượt.
+    Audio của từng video được cắt đúng độ dài phần hình rồi ghép lại bằng ffmpeg (nếu có).
+    """
+
+    def __init__(self, video_paths, output_path, log=print, progress=None, decoder_workers=None, ffmpeg_path=None):
+        self.video_paths = list(video_paths)
+        self.output_path = output_path
+        self.log = log
+        self.progress = progress or (lambda value, message: None)
+        self.decoder_workers = decoder_workers or max(2, min(4, (os.cpu_count() or 2) - 1))
+        self.ffmpeg = ffmpeg_path or find_ffmpeg()
+        self._stop = threading.Event()
+        self._with_audio = set()  # index các video có audio thật (không phải đoạn im lặng)
+
+    def _put(self, frames, item):
+        while not self._stop.is_set():
+            try:
+                frames.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode(self, index, frames, fps, width, height, temp_dir):
+        """Decode một video vào hàng đợi; trả về số frame đã đưa ra (theo fps chuẩn)"""
+        emitted = 0
+        try:
+            path = self.video_paths[index]
+            cap = cv2.VideoCapture(path)
+            try:
+                src_fps = cap.get(cv2.CAP_PROP_FPS) or 0
+                src_fps = src_fps if src_fps > 0 else fps
+                src_index = 0
+                while not self._stop.is_set():
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    src_index += 1
+                    # Frame nguồn phủ tới thời điểm src_index/src_fps: lặp/bỏ frame cho khớp fps chuẩn
+                    target = round(src_index * fps / src_fps)
+                    if target <= emitted:
+                        continue
+                    frame = letterbox(frame, width, height)
+                    while emitted < target:
+                        if not self._put(frames, frame):
+                            return emitted
+                        emitted += 1
+            finally:
+                cap.release()
+            if emitted and self.ffmpeg:
+                self._extract_audio(index, emitted / fps, temp_dir)
+            self._put(frames, _END)
+        except Exception as e:
+            self._put(frames, e)
+        return emitted
+
+    def _extract_audio(self, index, duration, temp_dir):
+        """Cắt/đệm audio của video về đúng độ dài phần hình; video không có audio thì tạo đoạn im lặng"""
+        target_path = os.path.join(temp_dir, f"{index:05d}.wav")
+        common = ["-t", f"{duration:.6f}", "-ar", str(AUDIO_RATE), "-ac", "2", "-c:a", "pcm_s16le", target_path]
+        result = _run([self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+                       "-i", self.video_paths[index], "-vn", "-af", "apad"] + common)
+        if result.returncode != 0:
+            result = _run([self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+                           "-f", "lavfi", "-i", f"anullsrc=r={AUDIO_RATE}:cl=stereo"] + common)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.decode("utf-8", "replace").strip() or "Không tạo được audio")
+        else:
+            self._with_audio.add(index)
+
+    def merge(self):
+        """Ghép tất cả video vào output_path; raise nếu lỗi"""
+        fps, width, height = _clip_info(self.video_paths[0])
+        self.log(f"🎞️ Khung chuẩn: {width}x{height} @ {fps:.3f} fps, {self.decoder_workers} thread decode")
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        os.makedirs(output_dir, exist_ok=True)
+        self._stop.clear()
+        self._with_audio.clear()
+
+        with tempfile.TemporaryDirectory(prefix="merge_", dir=output_dir) as temp_dir:
+            video_only = os.path.join(temp_dir, "video.mp4")
+            writer = cv2.VideoWriter(video_only, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+            if not writer.isOpened():
+                raise RuntimeError("Không tạo được VideoWriter")
+            pool = ThreadPoolExecutor(max_workers=self.decoder_workers, thread_name_prefix="decode")
+            pending = {}  # index -> (queue, future)
+            total = len(self.video_paths)
+            try:
+                for i in range(total):
+                    # Luôn có decoder_workers video đang được decode trước
+                    for j in range(i, min(i + self.decoder_workers, total)):
+                        if j not in pending:
+                            frames = queue.Queue(maxsize=QUEUE_FRAMES)
+                            pending[j] = (frames, pool.submit(self._decode, j, frames, fps, width, height, temp_dir))
+                    frames, future = pending.pop(i)
+                    self.progress(30 + (i + 1) * 55 // total, f"Đang xử lý video {i+1}/{total}...")
+                    while True:
+                        item = frames.get()
+                        if item is _END:
+                            break
+                        if isinstance(item, Exception):
+                            raise item
+                        writer.write(item)
+                    future.result()
+            finally:
+                self._stop.set()
+                pool.shutdown(wait=True)
+                writer.release()
+
+            if not self._with_audio:
+                if not self.ffmpeg:
+                    self.log("⚠️ Không tìm thấy ffmpeg, video ghép sẽ không có audio")
+                os.replace(video_only, self.output_path)
+                return
+
+            self.log("🔊 Đang ghép audio...")
+            self.progress(90, "Đang ghép audio...")
+            list_file = os.path.join(temp_dir, "audio.txt")
+            with open(list_file, "w", encoding="utf-8") as f:
+                for i in range(total):
+                    # Video không ra frame nào thì không có đoạn audio (độ dài 0)
+                    if os.path.exists(os.path.join(temp_dir, f"{i:05d}.wav")):
+                        f.write(f"file '{i:05d}.wav'\n")
+            temp_output = os.path.join(temp_dir, "merged.mp4")
+            result = _run([
+                self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+                "-i", video_only, "-f", "concat", "-safe", "0", "-i", list_file,
+                "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-b:a", "192k",
+                "-movflags", "+faststart", temp_output,
+            ])
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.decode("utf-8", "replace").strip() or "ffmpeg ghép audio lỗi")
+            os.replace(temp_output, self.output_path)
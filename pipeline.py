@@ -0,0 +1,374 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from api import (
+    AccountAuthError, ERROR_AUTH, IMAGE_UPLOAD_ASPECT_RATIO,
+    classify_error, create_short_filename, delete_media, download_encoded_video_stream,
+    extract_fife_url, extract_op_name, extract_upscale_media_id, extract_video_media_id,
+    get_access_token, get_generate_submitter, get_image_mime_type, get_status_poller,
+    http_download_mp4, upload_image, upscale_model_key, upscale_video,
+)
+from upload_cache import UploadCache, is_media_missing_error
+from mp4_probe import probe_mp4
+from job_journal import (
+    JobJournal, STATE_QUEUED, STATE_UPLOADED, STATE_SUBMITTED, STATE_GENERATED,
+    STATE_UPSCALE_SUBMITTED, STATE_DONE, STATE_FAILED,
+)
+
+
+# Mỗi stage một pool riêng: số thread theo I/O thực sự đồng thời, không theo thời gian chờ GPU
+UPLOAD_WORKERS = 4
+SUBMIT_WORKERS = 8  # Submitter gom batch nên vài thread đủ cho nhiều account
+DOWNLOAD_WORKERS = 4  # Giới hạn theo băng thông
+GENERATE_TIMEOUT_SEC = 900
+UPSCALE_TIMEOUT_SEC = 600
+
+STOPPED_MESSAGE = "Đã dừng bởi người dùng"
+
+
+def select_model_key(aspect_ratio, with_image):
+    """Chọn model theo loại job (text/image) và aspect ratio"""
+    portrait = aspect_ratio == "VIDEO_ASPECT_RATIO_PORTRAIT"
+    if with_image:
+        return "veo_3_1_i2v_s_fast_portrait_ultra" if portrait else "veo_3_1_i2v_s_fast_ultra"
+    return "veo_3_1_t2v_fast_portrait_ultra" if portrait else "veo_3_1_t2v_fast_ultra"
+
+
+def job_output_path(config, stt, prompt):
+    return os.path.join(config["output_dir"], create_short_filename(stt, prompt))
+
+
+def verify_output_video(path):
+    """Kiểm tra video vừa tải có moov và track video với ít nhất một frame; raise ValueError nếu hỏng"""
+    info = probe_mp4(path)
+    if not info["video"] or not info["video"]["sample_count"]:
+        raise ValueError(f"Video tải về không có frame nào: {os.path.basename(path)}")
+    return info
+
+
+def parse_proxy(proxy_str):
+    proxy_str = (proxy_str or "").strip()
+    if not proxy_str:
+        return None
+    return {'http': proxy_str, 'https': proxy_str}
+
+
+class _Job:
+    """Trạng thái một video đi qua các stage của pipeline"""
+
+    def __init__(self, prompt_data, account_data):
+        self.stt, self.prompt, self.image_path = prompt_data
+        self.account_data = account_data
+        self.account_name = account_data.get("name", "Unknown")
+        self.cookie = account_data.get("cookie")
+        self.proxy = parse_proxy(account_data.get("proxy", ""))
+        self.future = Future()
+        self.token = None
+        self.poller = None
+        self.output_filename = create_short_filename(self.stt, self.prompt)
+        self.output_path = None
+        self.media_id = None  # mediaId image đã upload (giữ trong cache tới khi job xong)
+        self.cache_hit = False
+        self.status_resp = None
+        self.job_key = None
+        self.resume = None  # Bản ghi journal của operation còn chạy từ lần trước (poll tiếp, không generate lại)
+
+
+class GenerationPipeline:
+    """Pipeline tạo video theo stage: upload -> submit -> poll -> download/upscale -> dọn media.
+
+    Mỗi stage có pool và giới hạn đồng thời riêng; thời gian chờ generate không giữ thread nào
+    (poller batch của account gọi callback khi xong). submit() trả về Future với kết quả
+    (stt, prompt, success, result), hoặc AccountAuthError nếu account không còn dùng được.
+    Nếu có journal, mỗi bước được ghi lại để lần chạy sau bỏ qua STT đã xong và poll tiếp operation dở.
+    """
+
+    def __init__(self, config, upload_cache=None, status_callback=None,
+                 upload_workers=UPLOAD_WORKERS, submit_workers=SUBMIT_WORKERS, download_workers=DOWNLOAD_WORKERS,
+                 journal=None):
+        self.config = config
+        self.upload_cache = upload_cache or UploadCache()
+        self.status_callback = status_callback
+        self.journal = journal
+        self._upload_pool = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix="upload")
+        self._submit_pool = ThreadPoolExecutor(max_workers=submit_workers, thread_name_prefix="submit")
+        self._download_pool = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="download")
+        self._stop_event = threading.Event()
+
+    def _status(self, message):
+        if self.status_callback:
+            try:
+                self.status_callback(message)
+            except Exception:
+                pass
+
+    def submit(self, prompt_data, account_data):
+        """Đưa một prompt vào pipeline, trả về Future"""
+        job = _Job(prompt_data, account_data)
+        job.output_path = job_output_path(self.config, job.stt, job.prompt)
+        job.future.set_running_or_notify_cancel()  # Job chỉ kết thúc qua pipeline (stop), không cancel từ ngoài
+
+        if self.journal is not None:
+            job.job_key = JobJournal.job_key(job.stt, job.prompt, job.output_path)
+            entry = self.journal.get(job.job_key)
+            if JobJournal.is_verified(entry):
+                self._status(f"STT {job.stt}: ⏭️ Đã có video hoàn chỉnh từ lần chạy trước, bỏ qua")
+                job.future.set_result((job.stt, job.prompt, True, job.output_filename))
+                return job.future
+            if JobJournal.is_resumable(entry) and entry.get("account") == job.account_name:
+                job.resume = entry
+            else:
+                self._record(job, STATE_QUEUED, stt=job.stt, prompt=job.prompt, image_path=job.image_path,
+                             account=job.account_name, output_path=job.output_path, error=None)
+
+        self._schedule(self._upload_pool, job, self._stage_prepare)
+        return job.future
+
+    def stop(self):
+        """Dừng nhận việc mới; các job đang chạy kết thúc ở stage kế tiếp"""
+        self._stop_event.set()
+
+    def shutdown(self, wait=False):
+        self.stop()
+        for pool in (self._upload_pool, self._submit_pool, self._download_pool):
+            pool.shutdown(wait=wait)
+
+    def _schedule(self, pool, job, stage, *args):
+        if self._stop_event.is_set():
+            self._complete(job, (job.stt, job.prompt, False, STOPPED_MESSAGE))
+            return
+        try:
+            pool.submit(self._run_stage, job, stage, *args)
+        except RuntimeError:
+            # Pool đã shutdown
+            self._complete(job, (job.stt, job.prompt, False, STOPPED_MESSAGE))
+
+    def _run_stage(self, job, stage, *args):
+        if job.future.done():
+            return
+        if self._stop_event.is_set():
+            self._complete(job, (job.stt, job.prompt, False, STOPPED_MESSAGE))
+            return
+        try:
+            stage(job, *args)
+        except Exception as e:
+            self._fail(job, e)
+
+    def _record(self, job, state, detail=None, **fields):
+        if self.journal is None or job.job_key is None:
+            return
+        try:
+            self.journal.record(job.job_key, state, detail, **fields)
+        except Exception as e:
+            print(f"⚠ Không ghi được journal STT {job.stt}: {e}")
+
+    def _fail(self, job, error):
+        if self._stop_event.is_set():
+            # Người dùng dừng: giữ nguyên journal để lần sau poll tiếp operation, không tính là lỗi
+            self._complete(job, (job.stt, job.prompt, False, STOPPED_MESSAGE))
+            return
+        if isinstance(error, AccountAuthError) or classify_error(error) == ERROR_AUTH:
+            # Token/cookie bị từ chối: job được trả về hàng đợi cho account khác
+            self._release_media(job)
+            if not isinstance(error, AccountAuthError):
+                error = AccountAuthError(f"{job.account_name}: {str(error)}")
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        # mediaId lấy từ cache đã không còn trên server: bỏ khỏi cache để lần sau upload lại
+        if job.media_id and job.cache_hit and is_media_missing_error(error):
+            self.upload_cache.invalidate(job.media_id)
+        self._record(job, STATE_FAILED, str(error), error=str(error))
+        self._status(f"STT {job.stt}: ❌ Lỗi với {job.account_name}: {str(error)}")
+        self._complete(job, (job.stt, job.prompt, False, str(error)))
+
+    def _complete(self, job, result):
+        self._release_media(job)
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def _release_media(self, job):
+        # Job dừng giữa chừng vẫn phải trả lại media cho cache
+        if job.media_id:
+            media_id, job.media_id = job.media_id, None
+            self.upload_cache.release(media_id, delete=False)
+
+    # --- Stage 1: token + upload image (upload pool) ---
+
+    def _stage_prepare(self, job):
+        if not job.cookie or job.cookie.startswith("YOUR_COOKIE_HERE"):
+            raise AccountAuthError(f"Cookie không hợp lệ cho {job.account_name}")
+
+        # Token lấy qua cache dùng chung (single-flight theo account, tự làm mới trước khi hết hạn)
+        job.token = get_access_token(job.cookie, account_key=job.account_name)
+        if not job.token:
+            raise AccountAuthError(f"Không thể lấy token từ {job.account_name} - Cookie có thể đã hết hạn")
+
+        # Poller batch chung của account (tự lấy token mới từ cache khi token cũ hết hạn)
+        cookie, account_name = job.cookie, job.account_name
+        job.poller = get_status_poller(
+            account_name, job.proxy,
+            token_provider=lambda: get_access_token(cookie, account_key=account_name)
+        )
+
+        if job.resume is not None:
+            self._resume(job)
+            return
+
+        if job.image_path and os.path.exists(job.image_path):
+            self._status(f"STT {job.stt}: 📤 Uploading image với {job.account_name}...")
+            job.media_id, job.cache_hit = self.upload_cache.get_or_upload(
+                job.account_name, job.image_path, get_image_mime_type(job.image_path), IMAGE_UPLOAD_ASPECT_RATIO,
+                lambda: upload_image(job.token, job.image_path, job.proxy, account_key=job.account_name)
+            )
+            if job.cache_hit:
+                self._status(f"STT {job.stt}: ♻️ Dùng lại image đã upload (cache)")
+            self._record(job, STATE_UPLOADED, image_media_id=job.media_id)
+
+        self._schedule(self._submit_pool, job, self._stage_submit)
+
+    def _resume(self, job):
+        """Operation của lần chạy trước vẫn chạy trên server: poll tiếp thay vì generate lại"""
+        entry = job.resume
+        if entry["state"] == STATE_UPSCALE_SUBMITTED and entry.get("upscale_operation_name"):
+            self._status(f"STT {job.stt}: ♻️ Tiếp tục chờ upscale từ lần chạy trước với {job.account_name}...")
+            job.poller.watch(job.token, entry["upscale_operation_name"], entry["upscale_scene_id"], lambda result, error: self._on_upscaled(job, result, error), timeout_sec=UPSCALE_TIMEOUT_SEC,
+                             model_key=upscale_model_key("1080p"), started_at=entry.get("updated_at"))
+        else:
+            self._status(f"STT {job.stt}: ♻️ Tiếp tục chờ operation từ lần chạy trước với {job.account_name}...")
+            job.poller.watch(job.token, entry["operation_name"], entry["scene_id"], lambda result, error: self._on_generated(job, result, error), timeout_sec=GENERATE_TIMEOUT_SEC,
+                             model_key=entry.get("model_key"), started_at=entry.get("updated_at"))
+
+    # --- Stage 2: submit generate (submit pool, gom batch theo account) ---
+
+    def _stage_submit(self, job):
+        with_image = job.media_id is not None
+        model_key = select_model_key(self.config["aspect_ratio"], with_image)
+        submitter = get_generate_submitter(
+            job.account_name, self.config["project_id"], model_key,
+            self.config["aspect_ratio"], with_image=with_image, proxy=job.proxy
+        )
+        if with_image:
+            self._status(f"STT {job.stt}: 🎬 Generating video from image với {job.account_name}...")
+            gen_resp, scene_id = submitter.submit(job.token, job.prompt, job.media_id, self.config.get("seed"))
+        else:
+            self._status(f"STT {job.stt}: 🎬 Generating video với {job.account_name}...")
+            gen_resp, scene_id = submitter.submit(job.token, job.prompt, seed=self.config.get("seed"))
+        op_name = extract_op_name(gen_resp)
+        self._record(job, STATE_SUBMITTED, operation_name=op_name, scene_id=scene_id, model_key=model_key)
+
+        # Stage 3: poll - không giữ thread, poller gọi callback khi operation xong
+        self._status(f"STT {job.stt}: ⏳ Checking generation status với {job.account_name}...")
+        job.poller.watch(job.token, op_name, scene_id, lambda result, error: self._on_generated(job, result, error), timeout_sec=GENERATE_TIMEOUT_SEC, model_key=model_key)
+
+    def _on_generated(self, job, status_resp, error):
+        # Chạy trên thread poller: chỉ chuyển job sang stage kế tiếp
+        if error is not None:
+            if isinstance(error, TimeoutError):
+                self._status(f"STT {job.stt}: ⏰ Timeout với {job.account_name}!")
+            else:
+                self._status(f"STT {job.stt}: ❌ Status: FAILED với {job.account_name}!")
+            self._fail(job, error)
+            return
+        job.status_resp = status_resp
+        self._record(job, STATE_GENERATED)
+        self._status(f"STT {job.stt}: ✅ Status: SUCCESSFUL với {job.account_name} - đang tải...")
+        if self.config.get("use_upscale", False):
+            self._schedule(self._submit_pool, job, self._stage_upscale_submit)
+        else:
+            self._schedule(self._download_pool, job, self._stage_download)
+
+    # --- Stage 4a: tải video 720p (download pool) ---
+
+    def _stage_download(self, job):
+        self._status(f"STT {job.stt}: 📥 Downloading video từ {job.account_name}...")
+        http_download_mp4(extract_fife_url(job.status_resp), job.output_path, account_key=job.account_name)
+        self._stage_finish(job)
+
+    # --- Stage 4b: upscale 1080p (submit pool -> poller -> download pool) ---
+
+    def _stage_upscale_submit(self, job):
+        self._status(f"STT {job.stt}: 🔄 Upscaling to 1080p...")
+        try:
+            video_media_id = extract_video_media_id(job.status_resp)
+            if not video_media_id:
+                raise ValueError("Không thể lấy mediaId từ video generation response")
+            upscale_resp, upscale_scene_id = upscale_video(
+                job.token, video_media_id,
+                self.config["project_id"],
+                "1080p",
+                self.config["aspect_ratio"],
+                self.config.get("seed"),
+                job.proxy,
+                account_key=job.account_name
+            )
+            upscale_op_name = extract_op_name(upscale_resp)
+            self._record(job, STATE_UPSCALE_SUBMITTED, video_media_id=video_media_id,
+                         upscale_operation_name=upscale_op_name, upscale_scene_id=upscale_scene_id)
+            self._status(f"STT {job.stt}: ⏳ Waiting for upscale...")
+            job.poller.watch(job.token, upscale_op_name, upscale_scene_id, lambda result, error: self._on_upscaled(job, result, error), timeout_sec=UPSCALE_TIMEOUT_SEC, model_key=upscale_model_key("1080p"))
+        except Exception as e:
+            self._upscale_failed(job, e)
+
+    def _on_upscaled(self, job, upscale_status_resp, error):
+        if error is not None:
+            self._upscale_failed(job, error)
+            return
+        self._schedule(self._download_pool, job, self._stage_upscale_download, upscale_status_resp)
+
+    def _stage_upscale_download(self, job, upscale_status_resp):
+        try:
+            upscale_media_id = extract_upscale_media_id(upscale_status_resp)
+            if not upscale_media_id:
+                raise ValueError("Không thể lấy mediaId từ upscale response")
+            # Stream encodedVideo từ mediaId và decode thẳng ra file (không giữ cả video trong RAM)
+            self._status(f"STT {job.stt}: 📥 Downloading upscaled video...")
+            download_encoded_video_stream(job.token, upscale_media_id, job.output_path, job.proxy, account_key=job.account_name)
+        except Exception as e:
+            self._upscale_failed(job, e)
+            return
+
+        # Chỉ xóa upscale media (video media gốc giữ lại)
+        try:
+            if delete_media([upscale_media_id], job.cookie, account_key=job.account_name):
+                self._status(f"STT {job.stt}: 🧹 Đã xóa upscale media")
+            else:
+                self._status(f"STT {job.stt}: ⚠️ Không thể xóa upscale media")
+        except Exception as e:
+            self._status(f"STT {job.stt}: ⚠️ Lỗi xóa upscale media: {str(e)}")
+        self._status(f"STT {job.stt}: ✅ Upscaled to 1080p!")
+        self._stage_finish(job)
+
+    def _upscale_failed(self, job, error):
+        if job.status_resp is None:
+            # Resume từ bước upscale: không còn response generate để tải bản 720p
+            self._fail(job, error)
+            return
+        # Upscale lỗi thì vẫn giữ video 720p đã generate
+        self._status(f"STT {job.stt}: ⚠️ Upscale failed: {str(error)}")
+        self._status(f"STT {job.stt}: ✅ Video generated at 720p")
+        self._schedule(self._download_pool, job, self._stage_download)
+
+    # --- Stage 5: dọn media đã upload ---
+
+    def _stage_finish(self, job):
+        # File tải dở/hỏng (thiếu moov, không có frame) thì tính là lỗi thay vì đánh dấu DONE
+        verify_output_video(job.output_path)
+
+        # Xóa media sau khi tải video xong (nếu có image và không còn job/cache nào dùng)
+        if job.media_id:
+            media_id, job.media_id = job.media_id, None
+            try:
+                if not self.upload_cache.release(media_id):
+                    self._status(f"STT {job.stt}: ♻️ Giữ media trong cache để tái sử dụng")
+                elif delete_media([media_id], job.cookie, account_key=job.account_name):
+                    self._status(f"STT {job.stt}: 🧹 Đã xóa media sau khi tải xong")
+                else:
+                    self._status(f"STT {job.stt}: ⚠️ Không thể xóa media")
+            except Exception as e:
+                self._status(f"STT {job.stt}: ⚠️ Lỗi xóa media: {str(e)}")
+
+        self._record(job, STATE_DONE, output_path=job.output_path, output_size=os.path.getsize(job.output_path), error=None)
+        self._status(f"STT {job.stt}: ✅ Hoàn thành với {job.account_name}: {job.output_filename}")
+        self._complete(job, (job.stt, job.prompt, True, job.output_filename))
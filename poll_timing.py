@@ -0,0 +1,114 @@
+import json
+import os
+import random
+import threading
+
+
+DEFAULT_STATS_FILE = "poll_stats.json"
+DEFAULT_MAX_SAMPLES = 100  # Chỉ giữ các lần hoàn thành gần nhất để theo kịp thay đổi tốc độ server
+MIN_SAMPLES = 3  # Ít hơn số mẫu này thì poll đều như cũ
+MAX_INTERVAL = 15.0  # Khoảng cách tối đa giữa 2 lần check khi job đã trễ so với thường lệ
+JITTER = 0.1
+MAX_SAMPLE_SEC = 1200.0  # Dài hơn timeout poll thì không phải thời gian hoàn thành thật (vd. mốc submit sai)
+
+
+def percentile(sorted_values, fraction):
+    """Percentile nội suy tuyến tính trên danh sách đã sắp xếp"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * fraction
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+class PollTiming:
+    """Thống kê thời gian hoàn thành theo videoModelKey để chọn lúc poll status
+
+    Lần check đầu được dời tới gần p10 thời gian hoàn thành đã quan sát, sau đó khoảng cách
+    thu hẹp dần khi tới gần trung vị, và giãn dần khi job trễ hơn p90.
+    """
+
+    def __init__(self, stats_file=DEFAULT_STATS_FILE, max_samples=DEFAULT_MAX_SAMPLES):
+        self.stats_file = stats_file
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = self._load_stats()  # model_key -> [số giây từ lúc submit tới khi xong]
+
+    def _load_stats(self):
+        """Tải thống kê từ file"""
+        if os.path.exists(self.stats_file):
+            try:
+                with open(self.stats_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    return {
+                        key: [float(v) for v in values if 0 < float(v) <= MAX_SAMPLE_SEC][-self.max_samples:]
+                        for key, values in data.items() if isinstance(values, list)
+                    }
+            except Exception:
+                pass
+        return {}
+
+    def _save_stats(self):
+        """Lưu thống kê vào file (ghi file tạm rồi rename)"""
+        try:
+            temp_file = self.stats_file + ".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._samples, f, indent=2)
+            os.replace(temp_file, self.stats_file)
+            return True
+        except Exception:
+            return False
+
+    def record(self, model_key, duration):
+        """Ghi nhận một operation của model_key hoàn thành sau duration giây"""
+        if not model_key or duration <= 0 or duration > MAX_SAMPLE_SEC:
+            return
+        with self._lock:
+            samples = self._samples.setdefault(model_key, [])
+            samples.append(round(duration, 2))
+            del samples[:-self.max_samples]
+            self._save_stats()
+
+    def estimate(self, model_key):
+        """(p10, p50, p90) thời gian hoàn thành, None nếu chưa đủ mẫu"""
+        with self._lock:
+            samples = sorted(self._samples.get(model_key) or [])
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return percentile(samples, 0.1), percentile(samples, 0.5), percentile(samples, 0.9)
+
+    def next_delay(self, model_key, elapsed, min_interval):
+        """Số giây chờ tới lần check kế tiếp của operation đã chạy được elapsed giây"""
+        estimate = self.estimate(model_key) if model_key else None
+        if estimate is None:
+            delay = min_interval
+        else:
+            early, expected, late = estimate
+            if elapsed < early:
+                # Gần như chắc chắn chưa xong: check lần đầu quanh p10
+                delay = early - elapsed
+            elif elapsed < expected:
+                # Tiến gần trung vị: mỗi lần chờ một nửa thời gian còn lại
+                delay = (expected - elapsed) / 2
+            elif elapsed < late:
+                delay = min_interval
+            else:
+                # Trễ hơn thường lệ: giãn dần khoảng cách
+                delay = min_interval + (elapsed - late) * 0.1
+            delay = min(max(delay, min_interval), max(MAX_INTERVAL, early - elapsed))
+        return delay * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+_poll_timing = None
+_poll_timing_lock = threading.Lock()
+
+
+def get_poll_timing():
+    """PollTiming dùng chung cho mọi poller trong process"""
+    global _poll_timing
+    with _poll_timing_lock:
+        if _poll_timing is None:
+            _poll_timing = PollTiming()
+        return _poll_timing
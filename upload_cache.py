@@ -0,0 +1,190 @@
+import json
+import os
+import time
+import hashlib
+import threading
+
+
+DEFAULT_CACHE_FILE = "upload_cache.json"
+DEFAULT_TTL_SECONDS = 12 * 3600  # mediaId trên server không được coi là còn dùng được mãi
+DEFAULT_MAX_ENTRIES = 1000
+# Dấu hiệu trong lỗi của server cho thấy mediaId không còn tồn tại
+_MEDIA_MISSING_MARKERS = ("not_found", "not found", "does not exist", "no longer exists")
+
+
+def is_media_missing_error(error):
+    """Lỗi cho biết media đã upload không còn trên server (không phải lỗi prompt/timeout/tải video)"""
+    response = getattr(error, "response", None)
+    text = f"{error} {getattr(response, 'text', '') or ''}".lower()
+    if "media" not in text:
+        return False
+    return getattr(response, "status_code", None) == 404 or any(marker in text for marker in _MEDIA_MISSING_MARKERS)
+
+
+class UploadCache:
+    """Cache mediaId đã upload theo (account, SHA-256 nội dung, mime, aspect) để tái sử dụng giữa các job"""
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        self._entries = self._load_cache()  # key -> {"account", "media_id", "created_at", "last_used"}
+        self._refcounts = {}  # media_id -> số job đang dùng trong lượt chạy
+        self._key_locks = {}  # Mỗi key chỉ một thread upload, các thread khác chờ rồi dùng lại
+        self._evicted = []  # [(account, media_id)] đã bị loại khỏi cache, chờ xóa trên server
+
+    def _load_cache(self):
+        """Tải cache từ file"""
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    return data
+            except Exception:
+                pass
+        return {}
+
+    def _save_cache(self):
+        """Lưu cache vào file (ghi file tạm rồi rename để không hỏng file khi crash)"""
+        try:
+            temp_file = self.cache_file + ".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, indent=2, ensure_ascii=False)
+            os.replace(temp_file, self.cache_file)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def file_sha256(file_path, chunk_size=1024 * 1024):
+        """Tính SHA-256 nội dung file theo từng chunk"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(account_key, content_hash, mime_type, aspect_ratio):
+        return f"{account_key}|{content_hash}|{mime_type}|{aspect_ratio}"
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._key_locks[key] = lock
+            return lock
+
+    def _evict_locked(self, now):
+        """Loại entry hết hạn và entry ít dùng nhất khi vượt giới hạn"""
+        expired = [k for k, e in self._entries.items() if now - e.get("created_at", 0) > self.ttl_seconds]
+        overflow = len(self._entries) - len(expired) - self.max_entries
+        if overflow > 0:
+            alive = sorted(
+                (k for k in self._entries if k not in expired),
+                key=lambda k: self._entries[k].get("last_used", 0)
+            )
+            expired.extend(alive[:overflow])
+        for key in expired:
+            entry = self._entries.pop(key)
+            self._evicted.append((entry.get("account"), entry.get("media_id")))
+        return bool(expired)
+
+    def get(self, key):
+        """Lấy mediaId còn hạn theo key, None nếu chưa có"""
+        with self._lock:
+            now = time.time()
+            if self._evict_locked(now):
+                self._save_cache()
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            entry["last_used"] = now
+            return entry["media_id"]
+
+    def put(self, key, account_key, media_id):
+        with self._lock:
+            now = time.time()
+            self._entries[key] = {
+                "account": account_key,
+                "media_id": media_id,
+                "created_at": now,
+                "last_used": now,
+            }
+            self._evict_locked(now)
+            self._save_cache()
+
+    def get_or_upload(self, account_key, file_path, mime_type, aspect_ratio, upload_fn):
+        """Trả về (media_id, cache_hit); chỉ gọi upload_fn() khi chưa có trong cache. Job phải release() khi xong"""
+        key = self.make_key(account_key, self.file_sha256(file_path), mime_type, aspect_ratio)
+        with self._key_lock(key):
+            media_id = self.get(key)
+            cache_hit = media_id is not None
+            if not cache_hit:
+                media_id = upload_fn()
+                self.put(key, account_key, media_id)
+            self.acquire(media_id)
+            return media_id, cache_hit
+
+    def acquire(self, media_id):
+        with self._lock:
+            self._refcounts[media_id] = self._refcounts.get(media_id, 0) + 1
+
+    def release(self, media_id, delete=True):
+        """Job đã dùng xong mediaId. Trả về True nếu được phép xóa media trên server
+        (không còn job nào dùng và media không còn được cache giữ lại).
+        delete=False: job không tự xóa, media bị loại khỏi cache để purge_evicted xóa sau"""
+        with self._lock:
+            count = self._refcounts.get(media_id, 0) - 1
+            if count > 0:
+                self._refcounts[media_id] = count
+                return False
+            self._refcounts.pop(media_id, None)
+            if self.is_cached(media_id):
+                return False
+            # Media đã bị loại khỏi cache: job này chịu trách nhiệm xóa, bỏ khỏi danh sách chờ xóa
+            if delete:
+                self._evicted = [item for item in self._evicted if item[1] != media_id]
+            return True
+
+    def is_cached(self, media_id):
+        with self._lock:
+            return any(e.get("media_id") == media_id for e in self._entries.values())
+
+    def invalidate(self, media_id):
+        """Bỏ mediaId khỏi cache (server báo media không còn tồn tại); vẫn đưa vào danh sách chờ xóa như entry bị loại"""
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if e.get("media_id") == media_id]
+            for key in keys:
+                entry = self._entries.pop(key)
+                self._evicted.append((entry.get("account"), entry.get("media_id")))
+            if keys:
+                self._save_cache()
+
+    def purge_evicted(self, delete_fn):
+        """Xóa trên server các media đã bị loại khỏi cache và không còn job nào dùng.
+        delete_fn(account_key, [media_ids]) -> bool. Trả về số media đã xóa"""
+        with self._lock:
+            self._evict_locked(time.time())
+            self._save_cache()
+            ready = [(a, m) for a, m in self._evicted if self._refcounts.get(m, 0) <= 0]
+            self._evicted = [(a, m) for a, m in self._evicted if self._refcounts.get(m, 0) > 0]
+
+        by_account = {}
+        for account_key, media_id in ready:
+            by_account.setdefault(account_key, []).append(media_id)
+
+        deleted = 0
+        for account_key, media_ids in by_account.items():
+            try:
+                if delete_fn(account_key, media_ids):
+                    deleted += len(media_ids)
+            except Exception:
+                pass
+        return deleted
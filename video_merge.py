@@ -0,0 +1,466 @@
+import os
+import re
+import json
+import queue
+import shutil
+import tempfile
+import threading
+import subprocess
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from mp4_probe import MP4_EXTENSIONS, probe_mp4
+
+
+# Các thông số phải giống nhau thì mới nối được ở mức container (không encode lại)
+STREAM_KEYS = (
+    "video_codec", "video_profile", "width", "height", "pix_fmt", "frame_rate", "timescale",
+    "audio_codec", "sample_rate", "channels",
+)
+
+
+def find_ffmpeg():
+    """Đường dẫn ffmpeg: bản đi kèm imageio-ffmpeg (MoviePy) hoặc ffmpeg trong PATH"""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which("ffmpeg")
+
+
+def find_ffprobe(ffmpeg_path=None):
+    """ffprobe cạnh ffmpeg hoặc trong PATH (imageio-ffmpeg không kèm ffprobe)"""
+    if ffmpeg_path:
+        candidate = os.path.join(os.path.dirname(ffmpeg_path), "ffprobe" + (".exe" if os.name == "nt" else ""))
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which("ffprobe")
+
+
+def _run(cmd):
+    creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0)  # Không hiện cửa sổ CMD trên Windows
+    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creationflags)
+
+
+def _mp4_params(path):
+    """Đọc thông số trực tiếp từ box MP4 (nhanh, không cần ffprobe); None nếu không đọc được"""
+    if not path.lower().endswith(MP4_EXTENSIONS):
+        return None
+    try:
+        info = probe_mp4(path)
+    except (OSError, ValueError):
+        return None
+    video, audio = info["video"], info["audio"]
+    if not video or not video["codec"]:
+        return None
+    params = dict.fromkeys(STREAM_KEYS)
+    params.update(
+        video_codec=video["codec"], video_profile=video["profile"],
+        width=video["width"], height=video["height"], pix_fmt=video["pix_fmt"],
+        frame_rate=video["frame_rate"], timescale=video["timescale"],
+    )
+    if audio:
+        params.update(audio_codec=audio["codec"], sample_rate=audio["sample_rate"], channels=audio["channels"])
+    return params
+
+
+def _ffprobe_params(ffprobe, path):
+    result = _run([
+        ffprobe, "-v", "error", "-print_format", "json",
+        "-show_entries", "stream=codec_type,codec_name,profile,width,height,pix_fmt,r_frame_rate,time_base,sample_rate,channels",
+        path,
+    ])
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", "replace").strip() or "ffprobe lỗi")
+    params = dict.fromkeys(STREAM_KEYS)
+    for stream in json.loads(result.stdout.decode("utf-8")).get("streams", []):
+        if stream.get("codec_type") == "video" and params["video_codec"] is None:
+            time_base = stream.get("time_base", "")
+            params.update(
+                video_codec=stream.get("codec_name"), video_profile=stream.get("profile"),
+                width=stream.get("width"), height=stream.get("height"), pix_fmt=stream.get("pix_fmt"),
+                frame_rate=stream.get("r_frame_rate"),
+                timescale=int(time_base.split("/")[1]) if "/" in time_base else None,
+            )
+        elif stream.get("codec_type") == "audio" and params["audio_codec"] is None:
+            params.update(
+                audio_codec=stream.get("codec_name"),
+                sample_rate=int(stream["sample_rate"]) if stream.get("sample_rate") else None,
+                channels=stream.get("channels"),
+            )
+    return params
+
+
+_VIDEO_LINE = re.compile(r"Stream #\S+.*?Video: (\w+)(?: \(([^)]*)\))?.*?, (\w+)(?:\([^)]*\))?, (\d+)x(\d+)")
+_FPS = re.compile(r"([\d.]+) fps")
+_TBN = re.compile(r"([\d.]+)k? tbn")
+_AUDIO_LINE = re.compile(r"Stream #\S+.*?Audio: (\w+).*?, (\d+) Hz, ([\w.]+)")
+_CHANNELS = {"mono": 1, "stereo": 2, "5.1": 6}
+
+# Encoder dùng khi encode lại clip lệch thông số, theo codec của clip chuẩn
+_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+_H264_PROFILES = {"constrained baseline": "baseline", "baseline": "baseline", "main": "main", "high": "high"}
+
+
+def normalize_profile(profile):
+    """Tên profile so sánh được giữa box MP4/ffprobe/log ffmpeg: chữ thường, bỏ tag fourcc (avc1 / 0x...)"""
+    if not profile or " / 0x" in profile:
+        return None
+    return profile.strip().lower()
+
+
+def _ffmpeg_params(ffmpeg, path):
+    """Đọc thông số từ log của `ffmpeg -i` khi không có ffprobe"""
+    output = _run([ffmpeg, "-hide_banner", "-i", path]).stderr.decode("utf-8", "replace")
+    params = dict.fromkeys(STREAM_KEYS)
+    for line in output.splitlines():
+        video = _VIDEO_LINE.search(line)
+        if video and params["video_codec"] is None:
+            fps = _FPS.search(line)
+            tbn = _TBN.search(line)
+            params.update(
+                video_codec=video.group(1), video_profile=video.group(2), pix_fmt=video.group(3),
+                width=int(video.group(4)), height=int(video.group(5)),
+                frame_rate=fps.group(1) if fps else None,
+                timescale=int(float(tbn.group(1)) * (1000 if "k tbn" in line else 1)) if tbn else None,
+            )
+            continue
+        audio = _AUDIO_LINE.search(line)
+        if audio and params["audio_codec"] is None:
+            params.update(
+                audio_codec=audio.group(1), sample_rate=int(audio.group(2)),
+                channels=_CHANNELS.get(audio.group(3), audio.group(3)),
+            )
+    if params["video_codec"] is None:
+        raise RuntimeError(f"Không đọc được thông số video: {path}")
+    return params
+
+
+def probe_params(path, ffmpeg, ffprobe=None):
+    """Thông số STREAM_KEYS của một video: box MP4 trước, rồi ffprobe, cuối cùng log của ffmpeg"""
+    params = _mp4_params(path)
+    if params is None:
+        params = _ffprobe_params(ffprobe, path) if ffprobe else _ffmpeg_params(ffmpeg, path)
+    params["video_profile"] = normalize_profile(params["video_profile"])
+    return params
+
+
+_DURATION = re.compile(r"Duration: (\d+):(\d+):([\d.]+)")
+
+
+def clip_duration(path, ffmpeg):
+    """Độ dài video (giây) từ box MP4, không được thì từ log của ffmpeg"""
+    if path.lower().endswith(MP4_EXTENSIONS):
+        try:
+            duration = probe_mp4(path)["duration"]
+            if duration:
+                return duration
+        except (OSError, ValueError):
+            pass
+    match = _DURATION.search(_run([ffmpeg, "-hide_banner", "-i", path]).stderr.decode("utf-8", "replace"))
+    if not match:
+        raise RuntimeError(f"Không đọc được độ dài video: {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def normalize_clip(ffmpeg, path, params, reference, target_path, threads=0):
+    """Encode lại một clip theo thông số chuẩn (scale + pad giữ tỉ lệ, thêm audio câm nếu thiếu)
+
+    threads=0 để ffmpeg tự chọn số thread; trả về target_path.
+    """
+    width, height = reference["width"], reference["height"]
+    video_filter = (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+    )
+    if reference["frame_rate"]:
+        video_filter += f",fps={reference['frame_rate']}"
+    cmd = [ffmpeg, "-y", "-hide_banner", "-loglevel", "error", "-i", path]
+    if reference["audio_codec"] and not params["audio_codec"]:
+        layout = "mono" if reference["channels"] == 1 else "stereo"
+        cmd += ["-f", "lavfi", "-i", f"anullsrc=channel_layout={layout}:sample_rate={reference['sample_rate']}", "-shortest"]
+    cmd += ["-map", "0:v:0"]
+    if reference["audio_codec"]:
+        cmd += ["-map", "0:a:0" if params["audio_codec"] else "1:a:0",
+                "-c:a", "aac", "-ar", str(reference["sample_rate"]), "-ac", str(reference["channels"])]
+    else:
+        cmd += ["-an"]
+    cmd += ["-vf", video_filter, "-c:v", _ENCODERS.get(reference["video_codec"], "libx264"), "-preset", "veryfast", "-crf", "18",
+            "-threads", str(threads)]
+    profile = _H264_PROFILES.get((reference["video_profile"] or "").lower())
+    if reference["video_codec"] == "h264" and profile:
+        cmd += ["-profile:v", profile]
+    if reference["pix_fmt"]:
+        cmd += ["-pix_fmt", reference["pix_fmt"]]
+    if reference["timescale"]:
+        cmd += ["-video_track_timescale", str(reference["timescale"])]
+    cmd.append(target_path)
+    result = _run(cmd)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", "replace").strip() or f"Không encode lại được {path}")
+    return target_path
+
+
+def group_by_format(plan):
+    """Gom các clip cần encode lại theo thông số gốc: {params tuple: [(index, path, params)]}"""
+    groups = defaultdict(list)
+    for i, (path, params, reencode) in enumerate(plan):
+        if reencode:
+            groups[tuple(params[k] for k in STREAM_KEYS)].append((i, path, params))
+    return groups
+
+
+class StreamCopyMerger:
+    """Ghép MP4 bằng ffmpeg concat demuxer + stream copy (không encode lại)
+
+    Clip có codec/độ phân giải/timescale/audio khác clip chuẩn (thông số phổ biến nhất)
+    được gom theo thông số và encode lại song song (mỗi clip một tiến trình ffmpeg) cho khớp rồi mới nối.
+    """
+
+    def __init__(self, video_paths, output_path, log=print, progress=None, ffmpeg_path=None, max_workers=None):
+        self.video_paths = list(video_paths)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.output_path = output_path
+        self.log = log
+        self.progress = progress or (lambda value, message: None)
+        self.ffmpeg = ffmpeg_path or find_ffmpeg()
+        self.ffprobe = find_ffprobe(self.ffmpeg)
+
+    @property
+    def available(self):
+        return bool(self.ffmpeg)
+
+    def probe(self, path):
+        return probe_params(path, self.ffmpeg, self.ffprobe)
+
+    def plan(self):
+        """[(path, params, cần encode lại?)] và thông số chuẩn"""
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(self.video_paths)), thread_name_prefix="probe") as pool:
+            probed = list(zip(self.video_paths, pool.map(self.probe, self.video_paths)))
+        reference = Counter(tuple(params[k] for k in STREAM_KEYS) for _, params in probed).most_common(1)[0][0]
+        reference = dict(zip(STREAM_KEYS, reference))
+        return [(path, params, params != reference) for path, params in probed], reference
+
+    def merge(self):
+        """Ghép tất cả clip vào output_path; raise RuntimeError nếu ffmpeg lỗi"""
+        if not self.available:
+            raise RuntimeError("Không tìm thấy ffmpeg")
+        self.log("🔍 Đang kiểm tra thông số các video...")
+        plan, reference = self.plan()
+        mismatched = [path for path, _, reencode in plan if reencode]
+        self.log(
+            f"🎞️ Thông số chuẩn: {reference['video_codec']} {reference['width']}x{reference['height']} "
+            f"@ {reference['frame_rate']}, audio {reference['audio_codec'] or 'không có'}"
+        )
+        if mismatched:
+            groups = group_by_format(plan)
+            self.log(f"⚠️ {len(mismatched)}/{len(plan)} video khác thông số ({len(groups)} nhóm), sẽ encode lại song song các video này")
+            for clips in groups.values():
+                params = clips[0][2]
+                self.log(f"   • {len(clips)} video {params['video_codec']} {params['width']}x{params['height']} @ {params['frame_rate']}")
+
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        os.makedirs(output_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="merge_", dir=output_dir) as temp_dir:
+            inputs = [os.path.abspath(path) for path, _, _ in plan]
+            if mismatched:
+                for i, target_path in self._normalize_all(plan, reference, temp_dir):
+                    inputs[i] = os.path.abspath(target_path)
+
+            list_file = os.path.join(temp_dir, "inputs.txt")
+            with open(list_file, "w", encoding="utf-8") as f:
+                for path in inputs:
+                    escaped = path.replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+
+            self.log("🔗 Đang nối video (stream copy, không encode lại)...")
+            self.progress(80, "Đang nối video...")
+            temp_output = os.path.join(temp_dir, "merged.mp4")
+            result = _run([
+                self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", list_file,
+                "-map", "0", "-c", "copy", "-movflags", "+faststart", temp_output,
+            ])
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.decode("utf-8", "replace").strip() or "ffmpeg concat lỗi")
+            os.replace(temp_output, self.output_path)
+        return len(mismatched)
+
+    def _normalize_all(self, plan, reference, temp_dir):
+        """Encode lại song song các clip lệch thông số; trả về [(index, file đã chuẩn hóa)]
+
+        Mỗi clip là một tiến trình ffmpeg riêng nên chạy song song trên nhiều core;
+        số thread x264 của mỗi tiến trình được chia đều để không tranh CPU.
+        """
+        jobs = [clip for clips in group_by_format(plan).values() for clip in clips]
+        workers = min(self.max_workers, len(jobs))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        normalized = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="normalize") as pool:
+            futures = {
+                pool.submit(normalize_clip, self.ffmpeg, path, params, reference, os.path.join(temp_dir, f"{i:05d}.mp4"), threads): i
+                for i, path, params in jobs
+            }
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    i = futures[future]
+                    normalized.append((i, future.result()))
+                    self.progress(30 + done * 40 // len(jobs), f"Đã encode lại {done}/{len(jobs)} video...")
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        return normalized
+
+
+# Bitstream filter chuyển H.264/HEVC trong MP4 sang dạng Annex B dùng cho MPEG-TS
+_ANNEXB_FILTERS = {"h264": "h264_mp4toannexb", "hevc": "hevc_mp4toannexb"}
+
+
+class IncrementalMerger:
+    """Ghép dần video theo STT ngay khi các STT nhỏ hơn đã xong
+
+    Mỗi clip được remux (stream copy) sang MPEG-TS với timestamp nối tiếp rồi nối thêm byte vào
+    file .part.ts; clip lệch thông số clip đầu được encode lại trước. Tiến độ lưu ở file checkpoint
+    để lần chạy sau (resume) không nối lại các STT đã có. finish() chỉ còn remux .part.ts sang MP4.
+    STT lỗi được bỏ qua; STT chưa có kết quả (đã dừng) để lại khoảng trống, file ghép dừng ở đó.
+    """
+
+    def __init__(self, stts, output_path, log=print, ffmpeg_path=None):
+        self.stts = list(stts)
+        self.output_path = output_path
+        self.log = log
+        self.ffmpeg = ffmpeg_path or find_ffmpeg()
+        self.ffprobe = find_ffprobe(self.ffmpeg)
+        self.part_path = output_path + ".part.ts"
+        self.checkpoint_path = output_path + ".merge.json"
+        self._lock = threading.Lock()
+        self._ready = {}  # stt -> đường dẫn video (None nếu lỗi), chờ tới lượt
+        self._queue = queue.Queue()
+        self._state = self._load_checkpoint()
+        self._thread = threading.Thread(target=self._worker, name="incremental-merge", daemon=True)
+        self._thread.start()
+
+    @property
+    def available(self):
+        return bool(self.ffmpeg)
+
+    def _load_checkpoint(self):
+        state = {"stts": self.stts, "next": 0, "appended": [], "skipped": [], "part_size": 0, "offset": 0.0, "reference": None}
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = None
+        if saved and saved.get("stts") == self.stts and os.path.exists(self.part_path) \
+                and os.path.getsize(self.part_path) >= saved.get("part_size", 0):
+            state.update(saved)
+            # Bỏ phần nối dở (nếu lần trước dừng giữa lúc ghi) trước khi nối tiếp
+            with open(self.part_path, "r+b") as f:
+                f.truncate(state["part_size"])
+            self.log(f"♻️ Tiếp tục ghép từ checkpoint: đã có {len(state['appended'])} video")
+        elif os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        return state
+
+    def _save_checkpoint(self):
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, ensure_ascii=False)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def add(self, stt, video_path):
+        """Báo STT đã xong (video_path=None nếu lỗi); gọi được từ thread bất kỳ"""
+        with self._lock:
+            self._ready[stt] = video_path
+        self._queue.put(True)
+
+    def _worker(self):
+        while self._queue.get():
+            try:
+                self._drain()
+            except Exception as e:
+                self.log(f"⚠️ Lỗi ghép tự động: {str(e)}")
+
+    def _drain(self):
+        """Nối các STT liên tiếp đã sẵn sàng"""
+        while self._state["next"] < len(self.stts):
+            stt = self.stts[self._state["next"]]
+            with self._lock:
+                if stt not in self._ready:
+                    return
+                video_path = self._ready.pop(stt)
+            if video_path is None or not os.path.exists(video_path):
+                self._state["skipped"].append(stt)
+                self.log(f"⏭️ Ghép tự động: bỏ qua STT {stt} (không có video)")
+            else:
+                try:
+                    self._append(stt, video_path)
+                except Exception as e:
+                    # Bỏ phần đã ghi dở của clip lỗi, ghép tiếp các STT sau thay vì dừng cả lượt
+                    self._truncate_part()
+                    self._state["skipped"].append(stt)
+                    self.log(f"⚠️ Ghép tự động: bỏ qua STT {stt} do lỗi: {str(e)}")
+            self._state["next"] += 1
+            self._save_checkpoint()
+
+    def _truncate_part(self):
+        if os.path.exists(self.part_path):
+            with open(self.part_path, "r+b") as f:
+                f.truncate(self._state["part_size"])
+
+    def _append(self, stt, video_path):
+        params = probe_params(video_path, self.ffmpeg, self.ffprobe)
+        reference = self._state["reference"] or params
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        with tempfile.TemporaryDirectory(prefix="merge_", dir=output_dir) as temp_dir:
+            source = video_path
+            if params != reference:
+                self.log(f"⚠️ STT {stt} khác thông số video đầu, đang encode lại...")
+                source = normalize_clip(self.ffmpeg, video_path, params, reference, os.path.join(temp_dir, "normalized.mp4"))
+            duration = clip_duration(source, self.ffmpeg)
+            segment = os.path.join(temp_dir, "segment.ts")
+            cmd = [self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error", "-i", source, "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy"]
+            if reference["video_codec"] in _ANNEXB_FILTERS:
+                cmd += ["-bsf:v", _ANNEXB_FILTERS[reference["video_codec"]]]
+            cmd += ["-output_ts_offset", f"{self._state['offset']:.6f}", "-f", "mpegts", segment]
+            result = _run(cmd)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.decode("utf-8", "replace").strip() or f"Không remux được STT {stt}")
+            with open(segment, "rb") as src, open(self.part_path, "ab") as dst:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+        self._state["part_size"] = os.path.getsize(self.part_path)
+        self._state["reference"] = reference
+        self._state["offset"] += duration
+        self._state["appended"].append(stt)
+        self.log(f"🔗 Ghép tự động: đã nối STT {stt} ({len(self._state['appended'])} video)")
+
+    def finish(self, timeout=None):
+        """Chờ nối xong các STT đã sẵn sàng rồi xuất MP4; trả về output_path hoặc None nếu chưa có video nào"""
+        self._queue.put(False)
+        self._thread.join(timeout)
+        if not self._state["appended"]:
+            return None
+        complete = self._state["next"] >= len(self.stts)
+        temp_output = self.output_path + ".tmp.mp4"
+        cmd = [self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error", "-i", self.part_path, "-map", "0", "-c", "copy"]
+        if self._state["reference"] and self._state["reference"]["audio_codec"] == "aac":
+            cmd += ["-bsf:a", "aac_adtstoasc"]
+        cmd += ["-movflags", "+faststart", "-f", "mp4", temp_output]
+        result = _run(cmd)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode("utf-8", "replace").strip() or "ffmpeg xuất file ghép lỗi")
+        os.replace(temp_output, self.output_path)
+        if complete:
+            # Đã ghép đủ lượt: không cần giữ file tạm và checkpoint
+            for path in (self.part_path, self.checkpoint_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        else:
+            self.log(f"⏸️ File ghép mới tới STT {self.stts[self._state['next'] - 1] if self._state['next'] else '-'}, lần chạy sau sẽ ghép tiếp")
+        return self.output_path